@@ -0,0 +1,194 @@
+import math
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List, Optional
+
+from base.fingerprint import corpus_fingerprint
+from base.similarity import tokenize
+
+try:
+    import numpy as np
+except ImportError:  # numpy为可选依赖，仅在使用聚类分块时需要
+    np = None
+
+
+class ClusterChunker:
+    """
+    基于TF-IDF向量和聚类的语义分块器
+
+    将语义相近的文档放入同一个chunk，而不是按位置切分；聚类结果按语料指纹缓存。
+    提供问题时，chunk按与问题的相关度排序，并跳过相关度低于min_relevance的chunk。
+    """
+
+    METHODS = ("kmeans", "agglomerative")
+
+    def __init__(self, method: str = "kmeans", min_relevance: float = 0.0, max_iter: int = 50,
+                 seed: int = 0, cache_size: int = 16):
+        """
+        Args:
+            method: 聚类方法，"kmeans"或"agglomerative"(适合文档数较少的语料)
+            min_relevance: chunk与问题的最低余弦相关度，低于该值的chunk被跳过(至少保留一个)
+            max_iter: k-means最大迭代次数
+            seed: k-means初始化的随机种子，保证同一语料的分块结果稳定
+            cache_size: 按语料指纹缓存的聚类结果数量
+        """
+        if np is None:
+            raise ImportError("ClusterChunker需要numpy，请先执行 pip install numpy")
+        if method not in self.METHODS:
+            raise ValueError(f"不支持的聚类方法: {method}，可选值: {self.METHODS}")
+        self.method = method
+        self.min_relevance = min_relevance
+        self.max_iter = max_iter
+        self.seed = seed
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+
+    def split(self, context: List[str], chunk_count: int, question: Optional[str] = None) -> List[List[str]]:
+        """
+        将上下文按语义聚类为chunk
+
+        Args:
+            context: 上下文信息列表
+            chunk_count: 期望的chunk数量(即聚类数)
+            question: 用户问题，提供时按相关度排序并跳过无关chunk
+
+        Returns:
+            List[List[str]]: 分割后的context chunks
+        """
+        return [[context[i] for i in indices] for indices in self.split_indices(context, chunk_count, question)]
+
+    def split_indices(self, context: List[str], chunk_count: int,
+                      question: Optional[str] = None) -> List[List[int]]:
+        """
+        与split相同，但返回每个chunk包含的文档下标
+
+        Args:
+            context: 上下文信息列表
+            chunk_count: 期望的chunk数量(即聚类数)
+            question: 用户问题，提供时按相关度排序并跳过无关chunk
+
+        Returns:
+            List[List[int]]: 每个chunk包含的文档下标(chunk内保持原始顺序)
+        """
+        if not context:
+            return []
+        model = self._get_model(context, max(1, min(chunk_count, len(context))))
+        clusters = model["clusters"]
+        if question is None:
+            return [list(indices) for indices in clusters]
+
+        relevance = self.score_clusters(model, question)
+        order = sorted(range(len(clusters)), key=lambda i: relevance[i], reverse=True)
+        kept = [i for i in order if relevance[i] >= self.min_relevance] or order[:1]
+        if len(kept) < len(clusters):
+            print(f"聚类分块：跳过{len(clusters) - len(kept)}个与问题无关的chunk")
+        return [list(clusters[i]) for i in kept]
+
+    def score_clusters(self, model: Dict[str, Any], question: str) -> List[float]:
+        """计算问题向量与每个聚类中心的余弦相关度"""
+        query = self._vectorize([question], model["vocab"], model["idf"])[0]
+        return (model["centroids"] @ query).tolist()
+
+    def _get_model(self, context: List[str], cluster_count: int) -> Dict[str, Any]:
+        """获取(或计算并缓存)语料的聚类结果"""
+        key = (corpus_fingerprint(context), cluster_count, self.method)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        vocab, idf = self._build_vocab(context)
+        matrix = self._vectorize(context, vocab, idf)
+        if self.method == "kmeans":
+            labels = self._kmeans(matrix, cluster_count)
+        else:
+            labels = self._agglomerative(matrix, cluster_count)
+
+        clusters = [np.flatnonzero(labels == label).tolist() for label in np.unique(labels)]
+        clusters.sort(key=lambda indices: indices[0])
+        centroids = np.stack([self._normalize(matrix[indices].mean(axis=0)) for indices in clusters])
+        model = {"vocab": vocab, "idf": idf, "clusters": clusters, "centroids": centroids}
+
+        self._cache[key] = model
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return model
+
+    def _build_vocab(self, context: List[str]):
+        """构建词表和IDF权重"""
+        doc_freq = Counter()
+        for doc in context:
+            doc_freq.update(set(tokenize(doc)))
+        vocab = {term: i for i, term in enumerate(sorted(doc_freq))}
+        total = len(context)
+        idf = np.array([math.log((1 + total) / (1 + doc_freq[term])) + 1 for term in sorted(doc_freq)])
+        return vocab, idf
+
+    def _vectorize(self, texts: List[str], vocab: Dict[str, int], idf) -> "np.ndarray":
+        """将文本转换为L2归一化的TF-IDF矩阵"""
+        matrix = np.zeros((len(texts), len(vocab)))
+        for row, text in enumerate(texts):
+            for term, count in Counter(tokenize(text)).items():
+                col = vocab.get(term)
+                if col is not None:
+                    matrix[row, col] = count
+        matrix *= idf
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    @staticmethod
+    def _normalize(vector) -> "np.ndarray":
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _kmeans(self, matrix, k: int) -> "np.ndarray":
+        """基于余弦相似度的k-means(k-means++初始化)"""
+        rng = np.random.default_rng(self.seed)
+        n = matrix.shape[0]
+
+        centers = [matrix[rng.integers(n)]]
+        for _ in range(1, k):
+            distances = 1 - np.max(matrix @ np.stack(centers).T, axis=1)
+            distances = np.clip(distances, 0, None)
+            if distances.sum() == 0:
+                centers.append(matrix[rng.integers(n)])
+            else:
+                centers.append(matrix[rng.choice(n, p=distances / distances.sum())])
+        centers = np.stack(centers)
+
+        labels = np.full(n, -1)
+        for _ in range(self.max_iter):
+            similarities = matrix @ centers.T
+            new_labels = similarities.argmax(axis=1)
+            # 空簇重新放置到距离当前中心最远的文档上
+            for cluster in range(k):
+                if not np.any(new_labels == cluster):
+                    farthest = int(similarities.max(axis=1).argmin())
+                    new_labels[farthest] = cluster
+                    similarities[farthest] = np.inf
+            if np.array_equal(new_labels, labels):
+                break
+            labels = new_labels
+            centers = np.stack([self._normalize(matrix[labels == cluster].mean(axis=0)) for cluster in range(k)])
+        return labels
+
+    def _agglomerative(self, matrix, k: int) -> "np.ndarray":
+        """平均连接的层次聚类，合并到k个簇为止"""
+        n = matrix.shape[0]
+        similarity = matrix @ matrix.T
+        sizes = np.ones(n)
+        active = np.ones(n, dtype=bool)
+        labels = np.arange(n)
+        np.fill_diagonal(similarity, -np.inf)
+
+        for _ in range(n - k):
+            masked = np.where(active[:, None] & active[None, :], similarity, -np.inf)
+            i, j = np.unravel_index(np.argmax(masked), masked.shape)
+            # 合并j到i，按簇大小加权更新平均相似度
+            merged = (similarity[i] * sizes[i] + similarity[j] * sizes[j]) / (sizes[i] + sizes[j])
+            similarity[i, :] = merged
+            similarity[:, i] = merged
+            similarity[i, i] = -np.inf
+            sizes[i] += sizes[j]
+            active[j] = False
+            labels[labels == j] = i
+        return labels
@@ -0,0 +1,16 @@
+import hashlib
+from typing import List
+
+
+def text_hash(text: str) -> str:
+    """计算文本内容的sha256哈希"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def corpus_fingerprint(context: List[str]) -> str:
+    """计算语料指纹，语料内容或顺序变化时指纹随之变化"""
+    digest = hashlib.sha256()
+    for doc in context:
+        digest.update(doc.encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
@@ -2,6 +2,7 @@
 import asyncio
 from typing import Any, Dict, List, Optional, Union, AsyncGenerator, Generator
 from openai import OpenAI, AsyncOpenAI
+from base.tokens import estimate_tokens, estimate_tokens_many, get_context_window
 
 DEFAULT_SYSTEM_PROMPT:str = """你是一个专业的问答助手，专门根据提供的上下文信息来回答用户的问题。请遵循以下规则：
 
@@ -22,6 +23,20 @@ DEFAULT_SYSTEM_PROMPT:str = """你是一个专业的问答助手，专门根据
 
 请根据即将提供的上下文信息，准确回答用户的问题。"""
 
+# 上下文足够小时直接单次调用("stuff"快速路径)使用的模板
+STUFF_TEMPLATE: str = """
+---
+上下文信息:
+{context}
+---
+问题:
+{question}
+---
+请基于上述上下文信息回答问题:
+"""
+
+STUFF_HEADROOM_RATIO: float = 0.5  # 单次调用时为输出及估算误差预留的窗口比例
+
 
 
 class LLMCallMixin:
@@ -108,6 +123,48 @@ class LLMCallMixin:
         else:
             return response.choices[0].message.content
     
+    def fits_single_call(self, *texts: str, headroom_ratio: float = STUFF_HEADROOM_RATIO) -> bool:
+        """
+        判断给定文本(连同系统提示词)能否在一次调用中放入模型的上下文窗口
+        
+        Args:
+            *texts: 将要放入prompt的文本(模板、问题、上下文等)
+            headroom_ratio: 为输出及估算误差预留的窗口比例
+        
+        Returns:
+            bool: 是否可以单次调用
+        """
+        prompt_tokens = estimate_tokens(DEFAULT_SYSTEM_PROMPT) + estimate_tokens_many(texts)
+        return prompt_tokens <= get_context_window(self.model) * (1 - headroom_ratio)
+    
+    def can_stuff(self, question: str, context: List[str], skipped: str) -> bool:
+        """
+        判断完整上下文能否一次放入模型窗口，可以时记录快速路径的统计信息(写入last_run_stats)
+        
+        Args:
+            question: 用户问题
+            context: 上下文信息列表
+            skipped: 走快速路径时跳过的流程名称，用于提示信息
+        
+        Returns:
+            bool: 是否走单次调用的快速路径
+        """
+        if not self.fits_single_call(STUFF_TEMPLATE, question, *context):
+            return False
+        print(f"上下文可一次放入模型窗口，跳过{skipped}直接单次调用回答")
+        self.last_run_stats = {
+            "fast_path": True,
+            "llm_calls": 1,
+            "prompt_tokens": estimate_tokens(DEFAULT_SYSTEM_PROMPT + STUFF_TEMPLATE + question + "\n".join(context))
+        }
+        return True
+    
+    def create_stuff_messages(self, question: str, context: List[str]) -> List[Dict[str, str]]:
+        """将全部上下文放入一次调用的消息列表("stuff"快速路径)"""
+        return self.create_messages(
+            user_content=STUFF_TEMPLATE.format(context="\n".join(context), question=question)
+        )
+    
     def _process_stream_response(self, response) -> Generator[str, None, None]:
         """处理同步流式响应"""
         for chunk in response:
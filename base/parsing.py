@@ -0,0 +1,27 @@
+import json
+from typing import Any, Optional
+
+
+def extract_json(response: str) -> Optional[Any]:
+    """
+    从LLM的回答中提取JSON内容
+
+    兼容```json代码块以及前后夹杂说明文字的情况,优先尝试对象,其次尝试数组。
+
+    Args:
+        response: LLM返回的原始文本
+
+    Returns:
+        Optional[Any]: 解析得到的JSON对象,解析失败时返回None
+    """
+    if not response:
+        return None
+    for open_char, close_char in (("{", "}"), ("[", "]")):
+        start_idx = response.find(open_char)
+        end_idx = response.rfind(close_char) + 1
+        if start_idx != -1 and end_idx > start_idx:
+            try:
+                return json.loads(response[start_idx:end_idx])
+            except json.JSONDecodeError:
+                continue
+    return None
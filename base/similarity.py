@@ -0,0 +1,145 @@
+import math
+import re
+import unicodedata
+from collections import Counter
+from typing import Callable, Dict, List, Set
+
+# 打分函数：输入问题和文档列表，批量返回每个文档的相关度分数
+Scorer = Callable[[str, List[str]], List[float]]
+
+_TOKEN_PATTERN = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff]+|[a-z0-9_]+")
+_CJK_PATTERN = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff]")
+_NON_WORD_PATTERN = re.compile(r"[\W_]+")
+# 常见的同义问法，按顺序改写为统一的形式(作用于normalize_text之后的文本)
+_QUESTION_REWRITES = [
+    (re.compile(r"^请问|一下"), ""),
+    (re.compile(r"的?(?:定义|含义|概念)是什么$"), "是什么"),
+    (re.compile(r"指的?是什么$"), "是什么"),
+    (re.compile(r"^什么是(.+)$"), r"\1是什么"),
+    (re.compile(r"(?:包括|包含|涵盖)哪些"), "有哪些"),
+    (re.compile(r"^(.+?)有哪些(.+)$"), r"\1的\2有哪些"),
+]
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    轻量分词：中文连续片段切分为字符bigram(单字保留unigram)，英文和数字按单词切分
+
+    Args:
+        text: 待分词文本
+
+    Returns:
+        List[str]: 词项列表
+    """
+    terms = []
+    for segment in _TOKEN_PATTERN.findall(text.lower()):
+        if _CJK_PATTERN.match(segment):
+            if len(segment) == 1:
+                terms.append(segment)
+            else:
+                terms.extend(segment[i:i + 2] for i in range(len(segment) - 1))
+        else:
+            terms.append(segment)
+    return terms
+
+
+def normalize_text(text: str) -> str:
+    """归一化文本：全角/半角折叠(NFKC)、转小写，并去除空白和标点，用于判断文本是否为同一问题的不同写法"""
+    return _NON_WORD_PATTERN.sub("", unicodedata.normalize("NFKC", text).lower())
+
+
+def canonical_question(text: str, filler_chars: str = "") -> str:
+    """
+    问题的规范形式：归一化后把常见的同义问法改写为统一形式，再去除虚词字符
+
+    保留实词的顺序，"A是否优于B"与"B是否优于A"的规范形式不同；
+    "什么是X/X是什么/X的定义是什么"、"X有哪些Y/X的Y有哪些/X包括哪些Y"的规范形式相同。
+
+    Args:
+        text: 问题文本
+        filler_chars: 不影响问题含义、比较时忽略的字符
+
+    Returns:
+        str: 规范形式，相同时视为同一个问题
+    """
+    text = normalize_text(text)
+    for pattern, replacement in _QUESTION_REWRITES:
+        text = pattern.sub(replacement, text)
+    return "".join(char for char in text if char not in filler_chars)
+
+
+def char_ngrams(text: str, n: int = 3) -> Counter:
+    """提取文本的字符n-gram计数(去除空白并转为小写)，对改写、同义句式较为鲁棒"""
+    normalized = re.sub(r"\s+", "", text.lower())
+    if len(normalized) <= n:
+        return Counter([normalized]) if normalized else Counter()
+    return Counter(normalized[i:i + n] for i in range(len(normalized) - n + 1))
+
+
+def cosine_similarity(a: Dict[str, float], b: Dict[str, float]) -> float:
+    """计算两个稀疏向量(词项→权重)的余弦相似度"""
+    if not a or not b:
+        return 0.0
+    if len(a) > len(b):
+        a, b = b, a
+    dot = sum(weight * b.get(term, 0.0) for term, weight in a.items())
+    if dot == 0:
+        return 0.0
+    norm_a = math.sqrt(sum(weight * weight for weight in a.values()))
+    norm_b = math.sqrt(sum(weight * weight for weight in b.values()))
+    return dot / (norm_a * norm_b)
+
+
+def jaccard_similarity(a: Set[str], b: Set[str]) -> float:
+    """计算两个集合的Jaccard相似度"""
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def text_similarity(a: str, b: str, n: int = 3) -> float:
+    """基于字符n-gram余弦相似度衡量两段文本的相似程度，取值0~1"""
+    return cosine_similarity(char_ngrams(a, n), char_ngrams(b, n))
+
+
+class LexicalScorer:
+    """基于BM25的本地词法打分器，一次调用批量为所有文档打分"""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+
+    def __call__(self, question: str, documents: List[str]) -> List[float]:
+        """
+        计算每个文档与问题的BM25分数
+
+        Args:
+            question: 用户问题
+            documents: 文档列表
+
+        Returns:
+            List[float]: 与documents一一对应的相关度分数
+        """
+        if not documents:
+            return []
+        doc_terms = [Counter(tokenize(doc)) for doc in documents]
+        doc_lengths = [sum(terms.values()) for terms in doc_terms]
+        avg_length = (sum(doc_lengths) / len(doc_lengths)) or 1.0
+        query_terms = set(tokenize(question))
+
+        doc_freq = Counter()
+        for terms in doc_terms:
+            doc_freq.update(query_terms & terms.keys())
+
+        total = len(documents)
+        scores = []
+        for terms, length in zip(doc_terms, doc_lengths):
+            score = 0.0
+            for term in query_terms:
+                tf = terms.get(term, 0)
+                if not tf:
+                    continue
+                idf = math.log(1 + (total - doc_freq[term] + 0.5) / (doc_freq[term] + 0.5))
+                score += idf * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * length / avg_length))
+            scores.append(score)
+        return scores
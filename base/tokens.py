@@ -0,0 +1,43 @@
+import re
+from typing import Iterable
+
+# 常见模型的上下文窗口大小(token)
+MODEL_CONTEXT_WINDOWS = {
+    "deepseek-chat": 64000,
+    "deepseek-reasoner": 64000,
+    "gpt-4o": 128000,
+    "gpt-4o-mini": 128000,
+}
+DEFAULT_CONTEXT_WINDOW = 32000  # 未知模型时使用的保守窗口大小
+
+_CJK_PATTERN = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估算文本的token数量(无需加载tokenizer)
+
+    中文等CJK字符按每字1个token计算,其余字符按每4个字符1个token计算,
+    结果偏保守,适合用于预算规划而非精确计费。
+
+    Args:
+        text: 待估算的文本
+
+    Returns:
+        int: 估算的token数量
+    """
+    if not text:
+        return 0
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    other_count = len(text) - cjk_count
+    return cjk_count + (other_count + 3) // 4
+
+
+def estimate_tokens_many(texts: Iterable[str]) -> int:
+    """估算多段文本的token总数"""
+    return sum(estimate_tokens(text) for text in texts)
+
+
+def get_context_window(model: str) -> int:
+    """获取模型的上下文窗口大小"""
+    return MODEL_CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW)
@@ -0,0 +1,226 @@
+import asyncio
+import json
+import os
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from .template import HYDE_CACHE_SIZE, HYDE_CACHE_TTL_SECONDS, HYDE_CACHE_SAVE_INTERVAL_SECONDS
+
+HYDE_CACHE_FORMAT_VERSION = 1  # 缓存文件格式版本，格式或Prompt模板变化时递增以使旧缓存失效
+
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def normalize_question(question: str) -> str:
+    """归一化问题：全角/半角折叠(NFKC)、转小写并去除空白，保留标点以区分"C++"和"C"这类问题"""
+    return _WHITESPACE_PATTERN.sub("", unicodedata.normalize("NFKC", question).lower())
+
+
+class HypothesisCache:
+    """
+    假设性答案缓存
+
+    按(归一化问题, prompt类型)缓存假设性答案，假设性答案的向量与文本存放在同一条目中。
+    支持LRU和TTL淘汰；异步生成时相同问题的并发请求只生成一次(single-flight)；
+    指定path时启动时自动加载；写入只标记为未保存，由save_if_due/save_if_due_async按save_interval节流地
+    整体写回(先写临时文件再原子替换)，异步版本在线程中写文件，不阻塞事件循环。退出前调用close()保存剩余的修改。
+    """
+
+    def __init__(self, max_entries: int = HYDE_CACHE_SIZE, ttl: Optional[float] = HYDE_CACHE_TTL_SECONDS,
+                 path: Optional[str] = None, save_interval: float = HYDE_CACHE_SAVE_INTERVAL_SECONDS):
+        """
+        Args:
+            max_entries: 最多保留的条目数，超出时淘汰最久未使用的条目
+            ttl: 条目的有效期(秒)，None表示永不过期
+            path: 可选的持久化文件路径
+            save_interval: 两次自动保存的最小间隔(秒)
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.save_interval = save_interval
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._dirty = False  # 是否有尚未写回磁盘的修改
+        self._last_saved: Optional[float] = None  # 上次保存的时刻(time.monotonic)，None表示本进程尚未保存过
+        self._saving = False  # 是否有进行中的异步保存
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "coalesced": 0}
+        if path:
+            self._load()
+
+    @staticmethod
+    def make_key(question: str, prompt_type: Optional[str]) -> str:
+        """缓存键：prompt类型(未指定时为auto，即自动检测)加归一化后的问题"""
+        return f"{prompt_type or 'auto'}:{normalize_question(question)}"
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        读取条目
+
+        Args:
+            key: 缓存键
+
+        Returns:
+            Optional[Dict[str, Any]]: 条目的副本(prompt_type、hypothesis、vector、created_at)，不存在或已过期时返回None
+        """
+        entry = self.peek(key)
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        self._entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return entry
+
+    def peek(self, key: str) -> Optional[Dict[str, Any]]:
+        """读取条目但不计入命中统计、不更新LRU顺序，过期的条目会被删除"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if self._expired(entry):
+            del self._entries[key]
+            self.stats["expired"] += 1
+            return None
+        return dict(entry)
+
+    def put(self, key: str, entry: Dict[str, Any]):
+        """写入条目(保留原有的创建时间)，超出容量时淘汰最久未使用的条目；只修改内存，不写磁盘"""
+        entry = {**entry, "created_at": entry.get("created_at") or time.time()}
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        self._dirty = True
+
+    async def get_or_create_async(self, key: str,
+                                  factory: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        """
+        读取条目，不存在时调用factory生成并写入；相同key的并发请求等待同一次生成(single-flight)
+
+        负责生成的请求被取消(如客户端断开)时不影响其余等待者：它们重新调用本方法，由其中一个接手生成。
+
+        Args:
+            key: 缓存键
+            factory: 生成条目的异步函数
+
+        Returns:
+            Dict[str, Any]: 条目
+        """
+        entry = self.get(key)
+        if entry is not None:
+            return entry
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.stats["coalesced"] += 1
+            shared = await asyncio.shield(inflight)
+            if shared is None:
+                # 负责生成的请求被取消，重新发起
+                return await self.get_or_create_async(key, factory)
+            return dict(shared)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            entry = await factory()
+        except asyncio.CancelledError:
+            future.set_result(None)  # 通知等待者重试，而不是把取消传递给它们
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # 没有等待者时不再报告未获取的异常
+            raise
+        finally:
+            self._inflight.pop(key, None)
+        self.put(key, entry)
+        future.set_result(entry)
+        await self.save_if_due_async()
+        return dict(entry)
+
+    def clear(self):
+        self._entries.clear()
+        self._dirty = True
+
+    def save_if_due(self):
+        """有未保存的修改且距上次保存已超过save_interval时写回磁盘"""
+        if self._save_due():
+            self.save()
+
+    async def save_if_due_async(self):
+        """异步版本的save_if_due，在线程中写文件；已有进行中的保存时跳过，修改留到下次保存"""
+        if self._save_due() and not self._saving:
+            await self.save_async()
+
+    def save(self):
+        """将未过期的条目按LRU顺序写入磁盘(先写临时文件再原子替换，避免中断时留下损坏的文件)"""
+        data = self._snapshot()
+        try:
+            self._write(data)
+        except OSError:
+            self._dirty = True
+            raise
+
+    async def save_async(self):
+        """异步版本的save：在事件循环中取快照，在线程中序列化并写文件"""
+        data = self._snapshot()
+        self._saving = True
+        try:
+            await asyncio.to_thread(self._write, data)
+        except OSError as e:
+            self._dirty = True
+            print(f"保存假设性答案缓存失败({self.path}): {e}")
+        finally:
+            self._saving = False
+
+    def close(self):
+        """保存尚未写回磁盘的修改"""
+        if self.path and self._dirty:
+            self.save()
+
+    def _save_due(self) -> bool:
+        if not (self.path and self._dirty):
+            return False
+        return self._last_saved is None or time.monotonic() - self._last_saved >= self.save_interval
+
+    def _snapshot(self) -> Dict[str, Any]:
+        """取出待保存的数据并标记为已保存"""
+        self._dirty = False
+        self._last_saved = time.monotonic()
+        return {
+            "version": HYDE_CACHE_FORMAT_VERSION,
+            "entries": [{"key": key, **entry} for key, entry in self._entries.items() if not self._expired(entry)]
+        }
+
+    def _write(self, data: Dict[str, Any]):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def _load(self):
+        """从磁盘加载条目，文件不存在、损坏或版本不匹配时从空缓存开始"""
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"读取假设性答案缓存失败({self.path}): {e}")
+            return
+        if data.get("version") != HYDE_CACHE_FORMAT_VERSION:
+            return
+        entries = data.get("entries", [])[-self.max_entries:] if self.max_entries > 0 else []
+        for entry in entries:
+            key = entry.pop("key", None)
+            if key is not None and not self._expired(entry):
+                self._entries[key] = entry
+
+    def _expired(self, entry: Dict[str, Any]) -> bool:
+        return self.ttl is not None and time.time() - entry.get("created_at", 0) > self.ttl
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -1,10 +1,12 @@
 import asyncio
-from typing import List, Dict, Any, Optional
+import inspect
+from typing import List, Dict, Any, Optional, Callable, Sequence
 from .template import (
     PROMPT_TYPES,
     QUESTION_CLASSIFICATION_PROMPT,
     FINAL_ANSWER_PROMPT
 )
+from .cache import HypothesisCache
 from base.mixins import LLMCallMixin
 
 
@@ -19,10 +21,20 @@ class HydeRunner(LLMCallMixin):
     5. 基于检索到的真实文档生成最终答案
     """
     
-    def __init__(self, llm_api_key: str, llm_api_url: str):
+    def __init__(self, llm_api_key: str, llm_api_url: str, hyde_cache: Optional[HypothesisCache] = None,
+                 use_cache: bool = True, embed_func: Optional[Callable[[str], Sequence[float]]] = None):
+        """
+        Args:
+            llm_api_key: LLM API Key
+            llm_api_url: LLM API地址
+            hyde_cache: 假设性答案缓存，默认使用内存中的HypothesisCache；需要跨进程复用时传入指定了path的缓存
+            use_cache: 是否缓存假设性答案
+            embed_func: 可选的向量化函数(可以是异步的)；设置后假设性答案的向量与文本一起缓存，
+                retrieval_func接收向量而不是文本
+        """
         super().__init__(llm_api_key, llm_api_url)
-        self.hyde_cache = {}  # 缓存假设性答案
-
+        self.hyde_cache = (hyde_cache if hyde_cache is not None else HypothesisCache()) if use_cache else None  # 缓存假设性答案
+        self.embed_func = embed_func
 
     
     def auto_detect_prompt_type(self, question: str) -> str:
@@ -46,6 +58,13 @@ class HydeRunner(LLMCallMixin):
         Returns:
             str: 生成的假设性答案
         """
+        key = HypothesisCache.make_key(question, prompt_type)
+        if self.hyde_cache is not None:
+            entry = self.hyde_cache.get(key)
+            if entry is not None:
+                print(f"命中假设性答案缓存 (问题类型: {entry['prompt_type']})")
+                return entry["hypothesis"]
+        
         # 自动检测或使用指定的prompt类型
         if prompt_type is None:
             prompt_type = self.auto_detect_prompt_type(question)
@@ -61,6 +80,9 @@ class HydeRunner(LLMCallMixin):
         hypothetical_answer = self.call_llm_sync(messages)
         
         print("假设性答案生成完成")
+        if self.hyde_cache is not None:
+            self.hyde_cache.put(key, {"prompt_type": prompt_type, "hypothesis": hypothetical_answer, "vector": None})
+            self.hyde_cache.save_if_due()
         return hypothetical_answer
     
     async def generate_hypothetical_answer_async(self, question: str, prompt_type: Optional[str] = None) -> str:
@@ -74,7 +96,26 @@ class HydeRunner(LLMCallMixin):
         Returns:
             str: 生成的假设性答案
         """
-
+        if self.hyde_cache is None:
+            _, hypothetical_answer = await self._stream_hypothetical_answer(question, prompt_type)
+            return hypothetical_answer
+        
+        generated = False
+        
+        async def generate() -> Dict[str, Any]:
+            nonlocal generated
+            generated = True
+            resolved_type, hypothetical_answer = await self._stream_hypothetical_answer(question, prompt_type)
+            return {"prompt_type": resolved_type, "hypothesis": hypothetical_answer, "vector": None}
+        
+        # 相同问题的并发请求共用同一次生成
+        entry = await self.hyde_cache.get_or_create_async(HypothesisCache.make_key(question, prompt_type), generate)
+        if not generated:
+            print(f"命中假设性答案缓存 (问题类型: {entry['prompt_type']})")
+        return entry["hypothesis"]
+    
+    async def _stream_hypothetical_answer(self, question: str, prompt_type: Optional[str]) -> tuple:
+        """流式生成假设性答案，返回(实际使用的prompt类型, 假设性答案)"""
         # 自动检测或使用指定的prompt类型
         if prompt_type is None:
             prompt_type = self.auto_detect_prompt_type(question)
@@ -92,12 +133,12 @@ class HydeRunner(LLMCallMixin):
         print("\n")
         
         print("假设性答案生成完成")
-        return hypothetical_answer
+        return prompt_type, hypothetical_answer
     
     def run(self, question: str, retrieval_func, prompt_type: Optional[str] = None, 
                           top_k: int = 5) -> Dict[str, Any]:
         """
-        完整的Hyde策略执行:生成假设性答案 -> 检索 -> 生成最终答案
+        完整的Hyde策略执行(同步版本):生成假设性答案 -> 检索 -> 生成最终答案
 
         Args:
             question: 用户问题
@@ -113,9 +154,10 @@ class HydeRunner(LLMCallMixin):
         # 步骤1: 生成假设性答案
         hypothetical_answer = self.generate_hypothetical_answer(question, prompt_type)
         
-        # 步骤2: 使用假设性答案进行检索
+        # 步骤2: 使用假设性答案(设置了embed_func时为其向量)进行检索
+        vector = self._hypothesis_vector(question, prompt_type, hypothetical_answer)
         print("正在使用假设性答案进行文档检索...")
-        retrieved_docs = retrieval_func(hypothetical_answer, top_k=top_k)
+        retrieved_docs = retrieval_func(hypothetical_answer if vector is None else vector, top_k=top_k)
         print(f"检索到 {len(retrieved_docs)} 个相关文档")
         
         # 步骤3: 基于真实检索文档生成最终答案
@@ -147,9 +189,10 @@ class HydeRunner(LLMCallMixin):
         # 步骤1: 异步生成假设性答案
         hypothetical_answer = await self.generate_hypothetical_answer_async(question, prompt_type)
         
-        # 步骤2: 使用假设性答案进行检索
+        # 步骤2: 使用假设性答案(设置了embed_func时为其向量)进行检索
+        vector = await self._hypothesis_vector_async(question, prompt_type, hypothetical_answer)
         print("正在使用假设性答案进行文档检索...")
-        context = retrieval_func(hypothetical_answer, top_k=top_k)
+        context = retrieval_func(hypothetical_answer if vector is None else vector, top_k=top_k)
         print(f"检索到 {len(context)} 个相关文档")
         
         if isinstance(context, list):
@@ -163,5 +206,53 @@ class HydeRunner(LLMCallMixin):
         print("=== Hyde策略异步执行完成 ===")
         
         return final_answer
+    
+    def _hypothesis_vector(self, question: str, prompt_type: Optional[str],
+                           hypothetical_answer: str) -> Optional[List[float]]:
+        """设置了embed_func时返回假设性答案的向量，优先使用与文本一起缓存的向量"""
+        if self.embed_func is None:
+            return None
+        key, vector = self._cached_vector(question, prompt_type, hypothetical_answer)
+        if vector is None:
+            vector = [float(value) for value in self.embed_func(hypothetical_answer)]
+            if self._cache_vector(key, hypothetical_answer, vector):
+                self.hyde_cache.save_if_due()
+        return vector
+    
+    async def _hypothesis_vector_async(self, question: str, prompt_type: Optional[str],
+                                       hypothetical_answer: str) -> Optional[List[float]]:
+        """异步版本的_hypothesis_vector，embed_func可以是同步或异步的"""
+        if self.embed_func is None:
+            return None
+        key, vector = self._cached_vector(question, prompt_type, hypothetical_answer)
+        if vector is None:
+            vector = self.embed_func(hypothetical_answer)
+            if inspect.isawaitable(vector):
+                vector = await vector
+            vector = [float(value) for value in vector]
+            if self._cache_vector(key, hypothetical_answer, vector):
+                await self.hyde_cache.save_if_due_async()
+        return vector
+    
+    def _cached_vector(self, question: str, prompt_type: Optional[str], hypothetical_answer: str) -> tuple:
+        """查找与假设性答案一起缓存的向量，返回(缓存键, 向量或None)"""
+        key = HypothesisCache.make_key(question, prompt_type)
+        if self.hyde_cache is None:
+            return key, None
+        entry = self.hyde_cache.peek(key)
+        if entry is not None and entry["hypothesis"] == hypothetical_answer and entry.get("vector") is not None:
+            print("命中假设性答案向量缓存，跳过向量化")
+            return key, entry["vector"]
+        return key, None
+    
+    def _cache_vector(self, key: str, hypothetical_answer: str, vector: List[float]) -> bool:
+        """将向量写入对应假设性答案的缓存条目，返回是否写入"""
+        if self.hyde_cache is None:
+            return False
+        entry = self.hyde_cache.peek(key)
+        if entry is None or entry["hypothesis"] != hypothetical_answer:
+            return False
+        self.hyde_cache.put(key, {**entry, "vector": vector})
+        return True
 
 
@@ -193,4 +193,9 @@ PROMPT_TYPES = {
     "business": HYDE_BUSINESS_PROMPT,
     "academic": HYDE_ACADEMIC_PROMPT,
     "enhanced": HYDE_ENHANCED_PROMPT
-}
\ No newline at end of file
+}
+
+# 假设性答案缓存相关配置
+HYDE_CACHE_SIZE = 1024  # 最多缓存的假设性答案数(LRU淘汰)
+HYDE_CACHE_TTL_SECONDS = 24 * 3600  # 缓存条目的有效期(秒)，过期后重新生成
+HYDE_CACHE_SAVE_INTERVAL_SECONDS = 30  # 指定持久化路径时两次自动保存的最小间隔(秒)，期间的写入只标记为未保存
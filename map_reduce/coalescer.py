@@ -0,0 +1,93 @@
+import asyncio
+from typing import Any, Dict, List, Set
+
+from .digest import chunk_hash
+from .template import COALESCE_WINDOW_MS, MAX_QUESTIONS_PER_MAP_CALL
+
+
+class MapCoalescer:
+    """
+    跨请求的Map调用合并器
+
+    并发请求对同一chunk发起的Map调用会在一个很短的时间窗口内被暂存，
+    窗口结束(或问题数达到上限)时合并为一次多问题Map调用，再把各问题的答案分发回对应的请求。
+    chunk的prefill开销因此随并发度成比例下降。
+    """
+
+    def __init__(self, runner, window_ms: float = COALESCE_WINDOW_MS,
+                 max_questions: int = MAX_QUESTIONS_PER_MAP_CALL):
+        """
+        Args:
+            runner: LLMMapReduceRunner实例，用于发起实际的Map调用
+            window_ms: 合并窗口长度(毫秒)
+            max_questions: 单次合并调用最多携带的问题数量
+        """
+        self.runner = runner
+        self.window_ms = window_ms
+        self.max_questions = max_questions
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._tasks: Set[asyncio.Task] = set()  # 进行中的合并调用，保持引用避免任务在执行中被回收
+        self.stats = {"requests": 0, "llm_calls": 0}
+
+    async def submit(self, chunk: List[str], question: str, chunk_index: int) -> str:
+        """
+        提交一次Map请求并等待该问题的答案片段
+
+        Args:
+            chunk: 单个context chunk
+            question: 用户问题
+            chunk_index: chunk索引(用于显示)
+
+        Returns:
+            str: 该chunk针对该问题的处理结果
+        """
+        loop = asyncio.get_running_loop()
+        key = chunk_hash(chunk)
+        batch = self._pending.get(key)
+        if batch is None:
+            batch = {"chunk": chunk, "chunk_index": chunk_index, "futures": {}}
+            batch["timer"] = loop.call_later(self.window_ms / 1000, self._flush, key)
+            self._pending[key] = batch
+
+        # 同一窗口内的相同问题共享同一个结果
+        future = batch["futures"].get(question)
+        if future is None:
+            future = loop.create_future()
+            batch["futures"][question] = future
+        self.stats["requests"] += 1
+
+        if len(batch["futures"]) >= self.max_questions:
+            self._flush(key)
+        return await asyncio.shield(future)
+
+    def _flush(self, key: str):
+        """结束某个chunk的合并窗口并发起合并调用"""
+        batch = self._pending.pop(key, None)
+        if batch is None:
+            return
+        batch["timer"].cancel()
+        self.stats["llm_calls"] += 1
+        task = asyncio.ensure_future(self._run_batch(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, batch: Dict[str, Any]):
+        """执行合并后的多问题Map调用，并把结果分发给等待中的请求"""
+        questions = list(batch["futures"].keys())
+        if len(questions) > 1:
+            print(f"  - 合并{len(questions)}个请求对第{batch['chunk_index']}个chunk的Map调用")
+        error: Exception = RuntimeError(f"第{batch['chunk_index']}个chunk的合并Map调用被取消或未返回结果")
+        try:
+            answers = await self.runner._process_chunk_multi_async(batch["chunk"], questions, batch["chunk_index"])
+            for question, answer in zip(questions, answers):
+                future = batch["futures"][question]
+                if not future.done():
+                    future.set_result(answer)
+        except Exception as e:
+            error = e
+        finally:
+            # 调用失败或被取消(如关闭时)时结束仍在等待的请求，避免它们永远挂起；
+            # 取消时也设置普通异常，等待者按失败的chunk处理，而不是被当作自身被取消
+            for future in batch["futures"].values():
+                if not future.done():
+                    future.set_exception(error)
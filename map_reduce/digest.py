@@ -0,0 +1,91 @@
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+from base.fingerprint import text_hash
+from .template import DIGEST_TEMPLATE
+
+DIGEST_FORMAT_VERSION = 2  # 摘要文件格式版本，格式变化时递增以使旧摘要失效
+DIGEST_PROMPT_HASH = text_hash(DIGEST_TEMPLATE)  # 摘要Prompt模板的哈希，模板修改后旧摘要自动失效
+
+
+def chunk_hash(chunk: List[str]) -> str:
+    """计算chunk内容的哈希，作为摘要的存储键"""
+    return text_hash("\x00".join(chunk))
+
+
+class DigestStore:
+    """
+    chunk摘要的磁盘存储
+
+    摘要只依赖chunk自身的内容，按 {directory}/{chunk哈希}.json 存放，与语料的其余部分无关：
+    语料变化后内容未变的chunk继续复用已有摘要，只有新的chunk需要生成。
+    读取时校验格式版本和摘要Prompt的哈希，不匹配的旧摘要视为不存在。
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        读取摘要
+
+        Args:
+            key: chunk哈希
+
+        Returns:
+            Optional[Dict[str, Any]]: 摘要内容，不存在或版本、Prompt不匹配时返回None
+        """
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                digest = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"读取摘要失败({path}): {e}")
+            return None
+        if digest.get("version") != DIGEST_FORMAT_VERSION or digest.get("prompt_hash") != DIGEST_PROMPT_HASH:
+            return None
+        return digest
+
+    def put(self, key: str, summary: str, facts: List[str]) -> Dict[str, Any]:
+        """
+        写入摘要(先写临时文件再原子替换，避免中断时留下损坏的文件)
+
+        Args:
+            key: chunk哈希
+            summary: chunk的摘要
+            facts: chunk中抽取的关键事实
+
+        Returns:
+            Dict[str, Any]: 写入的摘要内容
+        """
+        digest = {
+            "version": DIGEST_FORMAT_VERSION,
+            "prompt_hash": DIGEST_PROMPT_HASH,
+            "chunk_hash": key,
+            "summary": summary,
+            "facts": facts,
+            "created_at": time.time()
+        }
+        path = self._path(key)
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(digest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+        return digest
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+
+def render_digest(digest: Dict[str, Any]) -> str:
+    """将摘要渲染为Map阶段使用的文本"""
+    lines = [f"摘要: {digest['summary']}"]
+    if digest.get("facts"):
+        lines.append("关键事实:")
+        lines.extend(f"- {fact}" for fact in digest["facts"])
+    return "\n".join(lines)
@@ -1,27 +1,82 @@
 import asyncio
-from typing import List, Dict, Any
-from .template import MAP_TEMPLATE, REDUCE_TEMPLATE, DEFAULT_CHUNK_COUNT, MAX_CONCURRENT_REQUESTS
-from base.mixins import LLMCallMixin
+import re
+import time
+from typing import List, Dict, Any, AsyncIterator, Optional
+from .template import (
+    MAP_TEMPLATE,
+    REDUCE_TEMPLATE,
+    MULTI_QUESTION_MAP_TEMPLATE,
+    COMPACT_MAP_TEMPLATE,
+    COMPACT_REDUCE_TEMPLATE,
+    DIGEST_TEMPLATE,
+    DIGEST_MAP_TEMPLATE,
+    DEFAULT_CHUNK_COUNT,
+    MAX_CONCURRENT_REQUESTS,
+    MULTI_QUESTION_TOKEN_BUDGET,
+    MULTI_QUESTION_ANSWER_TOKENS,
+    MAX_QUESTIONS_PER_MAP_CALL,
+    CHUNK_TOKEN_BUDGET,
+    MAX_IN_FLIGHT_CHUNKS,
+    REDUCE_TOKEN_BUDGET,
+    NO_RELEVANT_INFO_MARK,
+    NO_MAP_RESULT_ANSWER,
+    DEFAULT_CHUNK_TIMEOUT,
+    REDUCE_TIME_RESERVE,
+    COMPACT_MAP_MAX_TOKENS,
+    COMPACT_FACT_DEDUP_THRESHOLD,
+    DIGEST_INSUFFICIENT_MARK,
+    COALESCE_WINDOW_MS
+)
+from .source import DocumentSource, aiter_documents
+from .digest import DigestStore, chunk_hash, render_digest
+from .coalescer import MapCoalescer
+from base.mixins import LLMCallMixin, DEFAULT_SYSTEM_PROMPT
+from base.similarity import Scorer, text_similarity
+from base.cluster import ClusterChunker
+from base.parsing import extract_json
+from base.tokens import estimate_tokens
 
 
 class LLMMapReduceRunner(LLMCallMixin):
     """基于Map-Reduce策略的RAG检索优化处理器"""
     
-    def __init__(self, llm_api_key: str, llm_api_url: str):
+    MAP_FORMATS = ("text", "compact")
+    
+    def __init__(self, llm_api_key: str, llm_api_url: str, chunker: Optional[ClusterChunker] = None):
+        """
+        Args:
+            llm_api_key: LLM API Key
+            llm_api_url: LLM API地址
+            chunker: 可选的聚类分块器，设置后按语义聚类而不是按位置分块
+        """
         super().__init__(llm_api_key, llm_api_url)
+        self.chunker = chunker
+        self.coalescer: Optional[MapCoalescer] = None
+        self.last_run_stats: Dict[str, Any] = {}  # 最近一次执行的统计信息
     
-    def run(self, question: str, context: List[str], chunk_count: int = DEFAULT_CHUNK_COUNT) -> str:
+    def run(self, question: str, context: List[str], chunk_count: int = DEFAULT_CHUNK_COUNT,
+            map_format: str = "text", allow_fast_path: bool = True) -> str:
         """        
         Args:
             question: 用户问题
             context: 上下文信息列表
             chunk_count: 分割的chunk数量
+            map_format: Map输出格式，"text"为自由文本，"compact"为结构化的原子事实列表
+            allow_fast_path: 上下文可一次放入模型窗口时是否直接单次调用回答
             
         Returns:
             str: 最终整合的答案
         """
+        self._check_map_format(map_format)
+        if allow_fast_path and self.can_stuff(question, context, "Map-Reduce"):
+            return self.call_llm_sync(self.create_stuff_messages(question, context))
+        
+        self.last_run_stats = {"fast_path": False, "map_format": map_format}
+        if map_format == "compact":
+            return self._run_compact(question, context, chunk_count)
+        
         # Map阶段：分割context并并行处理
-        context_chunks = self._split_context(context, chunk_count)
+        context_chunks = self._chunk_context(context, chunk_count, question)
         map_results = []
         
         print(f"Map阶段：将context分割为{len(context_chunks)}个部分进行处理...")
@@ -52,18 +107,32 @@ class LLMMapReduceRunner(LLMCallMixin):
         
         return final_answer
     
-    async def run_async(self, question: str, context: List[str], chunk_count: int = DEFAULT_CHUNK_COUNT) -> str:
+    async def run_async(self, question: str, context: List[str], chunk_count: int = DEFAULT_CHUNK_COUNT,
+                        map_format: str = "text", allow_fast_path: bool = True,
+                        chunk_timeout: Optional[float] = DEFAULT_CHUNK_TIMEOUT) -> str:
         """        
         Args:
             question: 用户问题
             context: 上下文信息列表
             chunk_count: 分割的chunk数量
+            map_format: Map输出格式，"text"为自由文本，"compact"为结构化的原子事实列表
+            allow_fast_path: 上下文可一次放入模型窗口时是否直接单次调用回答
+            chunk_timeout: 单个chunk的Map超时(秒，从获得并发名额起计时)，超时的chunk与失败的chunk一样被跳过；
+                None表示不限时
             
         Returns:
             str: 最终整合的答案
         """
+        self._check_map_format(map_format)
+        if allow_fast_path and self.can_stuff(question, context, "Map-Reduce"):
+            return await self.call_llm_async(self.create_stuff_messages(question, context))
+        
+        self.last_run_stats = {"fast_path": False, "map_format": map_format}
+        if map_format == "compact":
+            return await self._run_compact_async(question, context, chunk_count)
+        
         # Map阶段：分割context并并行处理
-        context_chunks = self._split_context(context, chunk_count)
+        context_chunks = self._chunk_context(context, chunk_count, question)
         
         print(f"Map阶段：将context分割为{len(context_chunks)}个部分进行并行处理...")
         
@@ -77,26 +146,537 @@ class LLMMapReduceRunner(LLMCallMixin):
         semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
         async def limited_task(task):
             async with semaphore:
-                return await task
+                return await asyncio.wait_for(task, timeout=chunk_timeout)
         
-        map_results = await asyncio.gather(*[limited_task(task) for task in map_tasks])
+        gathered = await asyncio.gather(*[limited_task(task) for task in map_tasks], return_exceptions=True)
+        
+        # 单个chunk失败或超时不影响整体，只有全部失败时才抛出异常
+        map_results, errors = [], []
+        for i, result in enumerate(gathered):
+            if isinstance(result, asyncio.TimeoutError):
+                errors.append(f"第{i+1}个chunk超时({chunk_timeout}秒)")
+            elif isinstance(result, Exception):
+                errors.append(f"第{i+1}个chunk处理失败: {result}")
+            else:
+                map_results.append(result)
+                continue
+            print(f"  - {errors[-1]}，已跳过")
+        self.last_run_stats["skipped_chunks"] = len(errors)
+        if not map_results and gathered:
+            raise RuntimeError(f"全部{len(gathered)}个chunk都未能得到回答: " + "; ".join(errors))
         
         # Reduce阶段：整合所有结果
         print("Reduce阶段：整合所有片段的回答...")
-        combined_results = "\n\n".join([f"片段{i+1}的回答:\n{result}" 
-                                    for i, result in enumerate(map_results)])
+        final_answer = await self._reduce_async(question, map_results)
         
-        messages = self.create_messages(
-            user_content=REDUCE_TEMPLATE.format(
-                question=question,
-                map_results=combined_results
+        return final_answer
+    
+    async def run_anytime_async(self, question: str, context: List[str], chunk_count: int = DEFAULT_CHUNK_COUNT,
+                                deadline: Optional[float] = None,
+                                chunk_timeout: Optional[float] = DEFAULT_CHUNK_TIMEOUT,
+                                scorer: Optional[Scorer] = None,
+                                reduce_reserve: float = REDUCE_TIME_RESERVE) -> Dict[str, Any]:
+        """
+        带截止时间的Map-Reduce("anytime"模式)
+        
+        每个chunk有独立超时，失败或超时的chunk被跳过；临近截止时间时取消仍未完成的Map任务，
+        直接用已得到的Map结果执行Reduce。提供scorer时文档按相关度排序后再分块，
+        最相关的chunk最先调度。
+        
+        Args:
+            question: 用户问题
+            context: 上下文信息列表
+            chunk_count: 分割的chunk数量
+            deadline: 整体时间上限(秒)，None表示不限时
+            chunk_timeout: 单个chunk的Map超时(秒)，None表示不限时
+            scorer: 相关度打分函数，如base.similarity.LexicalScorer()
+            reduce_reserve: 为Reduce预留的时间(秒)
+            
+        Returns:
+            Dict[str, Any]: 包含最终答案以及各chunk覆盖情况的字典
+        """
+        start_time = time.monotonic()
+        
+        # 按相关度排序文档，记录原始下标用于汇报覆盖情况
+        scores = scorer(question, context) if scorer is not None and context else None
+        if self.chunker is not None:
+            index_chunks = self._chunk_indices(context, chunk_count, question)
+            if scores is not None:
+                index_chunks.sort(key=lambda indices: max(scores[i] for i in indices), reverse=True)
+        else:
+            doc_indices = list(range(len(context)))
+            if scores is not None:
+                doc_indices.sort(key=lambda i: scores[i], reverse=True)
+            index_chunks = self._split_context(doc_indices, chunk_count)
+        
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        async def run_chunk(chunk_index: int, indices: List[int]) -> str:
+            async with semaphore:
+                chunk = [context[i] for i in indices]
+                return await asyncio.wait_for(self._process_chunk_async(chunk, question, chunk_index),
+                                              timeout=chunk_timeout)
+        
+        print(f"Map阶段：将context分割为{len(index_chunks)}个部分，按优先级调度...")
+        tasks = {asyncio.create_task(run_chunk(i+1, indices)): i for i, indices in enumerate(index_chunks)}
+        
+        map_timeout = None
+        if deadline is not None:
+            map_timeout = max(0.0, deadline - reduce_reserve - (time.monotonic() - start_time))
+        pending = set()
+        if tasks:
+            _, pending = await asyncio.wait(tasks.keys(), timeout=map_timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            print(f"临近截止时间，取消{len(pending)}个未完成的chunk")
+            await asyncio.gather(*pending, return_exceptions=True)
+        
+        covered, failed, timed_out, cancelled = [], [], [], []
+        map_results = []
+        for task, i in sorted(tasks.items(), key=lambda item: item[1]):
+            if task in pending:
+                cancelled.append(i+1)
+            elif isinstance(task.exception(), asyncio.TimeoutError):
+                timed_out.append(i+1)
+            elif task.exception() is not None:
+                print(f"  - 第{i+1}个chunk处理失败: {task.exception()}")
+                failed.append(i+1)
+            else:
+                covered.append(i+1)
+                map_results.append(task.result())
+        
+        # Reduce阶段：基于已得到的结果整合，Reduce本身也受截止时间约束
+        if not map_results:
+            final_answer = "在截止时间内未能获得任何片段的回答，无法回答该问题"
+        else:
+            print(f"Reduce阶段：整合{len(map_results)}/{len(index_chunks)}个片段的回答...")
+            reduce_timeout = None
+            if deadline is not None:
+                reduce_timeout = max(0.0, deadline - (time.monotonic() - start_time))
+            try:
+                final_answer = await asyncio.wait_for(self._reduce_async(question, map_results), timeout=reduce_timeout)
+            except asyncio.TimeoutError:
+                print("Reduce阶段超时，直接返回各片段的回答")
+                final_answer = "\n\n".join(result for result in map_results if self._has_relevant_info(result))
+        
+        return {
+            "answer": final_answer,
+            "total_chunks": len(index_chunks),
+            "covered_chunks": covered,
+            "failed_chunks": failed,
+            "timed_out_chunks": timed_out,
+            "cancelled_chunks": cancelled,
+            "covered_documents": sorted(i for c in covered for i in index_chunks[c-1]),
+            "coverage": len(covered) / len(index_chunks) if index_chunks else 1.0,
+            "complete": len(covered) == len(index_chunks),
+            "elapsed": time.monotonic() - start_time
+        }
+    
+    async def build_digests(self, context: List[str], store: DigestStore,
+                            chunk_count: int = DEFAULT_CHUNK_COUNT, overwrite: bool = False) -> Dict[str, Any]:
+        """
+        离线为每个chunk生成与问题无关的摘要和关键事实，并写入磁盘存储
+        
+        摘要只按chunk内容的哈希存放；已存在的摘要默认跳过，因此语料变化后只需为内容变化的chunk重新生成。
+        按位置分块时，文档的增删会移动之后chunk的边界，原地修改文档只影响其所在的chunk。
+        
+        Args:
+            context: 上下文信息列表
+            store: 摘要存储
+            chunk_count: 分割的chunk数量(需与查询时一致)
+            overwrite: 是否重新生成已存在的摘要
+            
+        Returns:
+            Dict[str, Any]: 生成、跳过和失败的chunk数量统计
+        """
+        context_chunks = self._chunk_context(context, chunk_count)
+        stats = {"built": 0, "skipped": 0, "failed": 0}
+        
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        async def build_chunk(chunk_index: int, chunk: List[str]):
+            key = chunk_hash(chunk)
+            if not overwrite and store.get(key) is not None:
+                stats["skipped"] += 1
+                return
+            async with semaphore:
+                print(f"  - 生成第{chunk_index}个chunk的摘要...")
+                messages = self.create_messages(
+                    user_content=DIGEST_TEMPLATE.format(context="\n".join(chunk))
+                )
+                try:
+                    response = await self.call_llm_async(messages)
+                except Exception as e:
+                    print(f"  - 第{chunk_index}个chunk的摘要生成失败: {e}")
+                    stats["failed"] += 1
+                    return
+            result = extract_json(response)
+            if isinstance(result, dict) and isinstance(result.get("summary"), str):
+                facts = [fact for fact in result.get("facts", []) if isinstance(fact, str) and fact.strip()]
+                store.put(key, result["summary"], facts)
+            else:
+                store.put(key, response.strip(), [])
+            stats["built"] += 1
+        
+        print(f"离线摘要：共{len(context_chunks)}个chunk...")
+        await asyncio.gather(*[build_chunk(i+1, chunk) for i, chunk in enumerate(context_chunks)])
+        print(f"离线摘要完成：生成{stats['built']}个，跳过{stats['skipped']}个，失败{stats['failed']}个")
+        return stats
+    
+    async def run_with_digests_async(self, question: str, context: List[str], store: DigestStore,
+                                     chunk_count: int = DEFAULT_CHUNK_COUNT) -> str:
+        """
+        基于离线摘要执行Map-Reduce
+        
+        Map阶段读取build_digests预先生成的摘要而不是原文；chunk没有摘要，
+        或模型判断摘要信息不足时，回退到原文执行普通Map调用。
+        
+        Args:
+            question: 用户问题
+            context: 上下文信息列表(用于分块及回退)
+            store: 摘要存储
+            chunk_count: 分割的chunk数量(需与生成摘要时一致)
+            
+        Returns:
+            str: 最终整合的答案
+        """
+        context_chunks = self._chunk_context(context, chunk_count, question)
+        stats = {"digest_hits": 0, "digest_misses": 0, "raw_fallbacks": 0}
+        
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        async def map_chunk(chunk_index: int, chunk: List[str]) -> str:
+            async with semaphore:
+                digest = store.get(chunk_hash(chunk))
+                if digest is None:
+                    stats["digest_misses"] += 1
+                    return await self._process_chunk_async(chunk, question, chunk_index)
+                
+                stats["digest_hits"] += 1
+                messages = self.create_messages(
+                    user_content=DIGEST_MAP_TEMPLATE.format(
+                        chunk_index=chunk_index,
+                        digest=render_digest(digest),
+                        question=question,
+                        insufficient_mark=DIGEST_INSUFFICIENT_MARK
+                    )
+                )
+                print(f"  - 基于摘要处理第{chunk_index}个chunk...")
+                result = await self.call_llm_async(messages)
+                if DIGEST_INSUFFICIENT_MARK in result:
+                    print(f"  - 第{chunk_index}个chunk的摘要信息不足，回退到原文")
+                    stats["raw_fallbacks"] += 1
+                    return await self._process_chunk_async(chunk, question, chunk_index)
+                return result
+        
+        print(f"Map阶段(摘要)：共{len(context_chunks)}个chunk进行并行处理...")
+        map_results = await asyncio.gather(*[map_chunk(i+1, chunk) for i, chunk in enumerate(context_chunks)])
+        self.last_run_stats = {"fast_path": False, "map_format": "digest", **stats}
+        
+        print("Reduce阶段：整合所有片段的回答...")
+        return await self._reduce_async(question, map_results)
+    
+    def _run_compact(self, question: str, context: List[str], chunk_count: int) -> str:
+        """同步执行紧凑格式的Map-Reduce"""
+        index_chunks = self._chunk_indices(context, chunk_count, question)
+        print(f"Map阶段(紧凑格式)：将context分割为{len(index_chunks)}个部分进行处理...")
+        
+        responses = []
+        for i, indices in enumerate(index_chunks):
+            print(f"处理第{i+1}个chunk...")
+            messages = self._build_compact_map_messages(question, context, indices, i+1)
+            responses.append(self.call_llm_sync(messages, max_tokens=COMPACT_MAP_MAX_TOKENS))
+        
+        print("Reduce阶段：整合去重后的事实...")
+        messages = self._build_compact_reduce_messages(question, index_chunks, responses)
+        return self.call_llm_sync(messages)
+    
+    async def _run_compact_async(self, question: str, context: List[str], chunk_count: int) -> str:
+        """异步执行紧凑格式的Map-Reduce"""
+        index_chunks = self._chunk_indices(context, chunk_count, question)
+        print(f"Map阶段(紧凑格式)：将context分割为{len(index_chunks)}个部分进行并行处理...")
+        
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        async def map_chunk(chunk_index: int, indices: List[int]) -> str:
+            async with semaphore:
+                messages = self._build_compact_map_messages(question, context, indices, chunk_index)
+                print(f"  - 处理第{chunk_index}个chunk...")
+                return await self.call_llm_async(messages, max_tokens=COMPACT_MAP_MAX_TOKENS)
+        
+        responses = await asyncio.gather(*[map_chunk(i+1, indices) for i, indices in enumerate(index_chunks)])
+        
+        print("Reduce阶段：整合去重后的事实...")
+        messages = self._build_compact_reduce_messages(question, index_chunks, responses)
+        return await self.call_llm_async(messages)
+    
+    def _build_compact_map_messages(self, question: str, context: List[str], indices: List[int],
+                                    chunk_index: int) -> List[Dict[str, str]]:
+        """构造紧凑格式的Map消息，每个文档前标注全局文档编号"""
+        chunk_context = "\n".join(f"[d{i}] {context[i]}" for i in indices)
+        return self.create_messages(
+            user_content=COMPACT_MAP_TEMPLATE.format(
+                chunk_index=chunk_index,
+                context=chunk_context,
+                question=question
             )
         )
-        final_answer = await self.call_llm_async(messages)
+    
+    def _build_compact_reduce_messages(self, question: str, index_chunks: List[List[int]],
+                                       responses: List[str]) -> List[Dict[str, str]]:
+        """
+        解析、校验并去重所有chunk的事实，构造紧凑的Reduce消息并记录token节省情况
         
-        return final_answer
+        Args:
+            question: 用户问题
+            index_chunks: 每个chunk包含的文档编号
+            responses: 每个chunk的Map原始输出
+            
+        Returns:
+            List[Dict[str, str]]: Reduce阶段的消息列表
+        """
+        all_facts = []
+        for indices, response in zip(index_chunks, responses):
+            all_facts.extend(self._parse_compact_facts(response, indices))
+        merged_facts = self._dedup_facts(all_facts)
+        facts_text = "\n".join(
+            f"- {fact['fact']}" + (f" [{','.join(fact['sources'])}]" if fact["sources"] else "")
+            for fact in merged_facts
+        ) or NO_RELEVANT_INFO_MARK
+        
+        raw_tokens = sum(estimate_tokens(response) for response in responses)
+        compact_tokens = estimate_tokens(facts_text)
+        self.last_run_stats = {
+            "fast_path": False,
+            "map_format": "compact",
+            "chunk_count": len(index_chunks),
+            "facts_extracted": len(all_facts),
+            "facts_after_dedup": len(merged_facts),
+            "map_output_tokens": raw_tokens,
+            "reduce_input_tokens": compact_tokens,
+            # 本地解析和去重相对Map原始(JSON)输出省下的token数，并非相对自由文本Map的节省
+            "dedup_saved_tokens": raw_tokens - compact_tokens
+        }
+        print(f"紧凑格式：{len(all_facts)}条事实去重后剩余{len(merged_facts)}条，"
+              f"Reduce输入约{compact_tokens} tokens(Map原始输出约{raw_tokens} tokens)")
+        
+        return self.create_messages(
+            user_content=COMPACT_REDUCE_TEMPLATE.format(question=question, facts=facts_text)
+        )
+    
+    def _parse_compact_facts(self, response: str, indices: List[int]) -> List[Dict[str, Any]]:
+        """
+        在本地解析并校验紧凑格式的Map输出
+        
+        Args:
+            response: LLM返回的原始文本
+            indices: 该chunk包含的文档编号
+            
+        Returns:
+            List[Dict[str, Any]]: 校验后的事实列表，每项包含fact和sources
+        """
+        valid_sources = {f"d{i}" for i in indices}
+        result = extract_json(response)
+        if not isinstance(result, dict):
+            # 输出被截断时尽量回收已完整输出的事实；完全不是JSON时将原文作为一条事实保留
+            if not response or not self._has_relevant_info(response):
+                return []
+            salvaged = re.findall(r'"fact"\s*:\s*"((?:[^"\\]|\\.)+)"', response)
+            if salvaged:
+                return [{"fact": fact, "sources": []} for fact in salvaged]
+            if "{" in response:
+                return []
+            return [{"fact": response.strip(), "sources": sorted(valid_sources, key=lambda source: int(source[1:]))}]
+        if result.get("relevant") is False:
+            return []
+        
+        items = result.get("facts")
+        if not isinstance(items, list):
+            return []
+        facts = []
+        for item in items:
+            if not isinstance(item, dict) or not isinstance(item.get("fact"), str) or not item["fact"].strip():
+                continue
+            # sources可能为null或包含非字符串的值，只保留本chunk内合法的文档编号
+            raw_sources = item.get("sources")
+            if not isinstance(raw_sources, list):
+                raw_sources = []
+            sources = [source for source in raw_sources if isinstance(source, str) and source in valid_sources]
+            facts.append({"fact": item["fact"].strip(), "sources": sources})
+        return facts
+    
+    def _dedup_facts(self, facts: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """跨chunk合并重复或高度相似的事实，合并其来源编号"""
+        merged = []
+        for fact in facts:
+            for existing in merged:
+                if text_similarity(fact["fact"], existing["fact"]) >= COMPACT_FACT_DEDUP_THRESHOLD:
+                    existing["sources"] = sorted(set(existing["sources"]) | set(fact["sources"]),
+                                                 key=lambda source: int(source[1:]))
+                    break
+            else:
+                merged.append({"fact": fact["fact"], "sources": list(fact["sources"])})
+        return merged
+    
+    def _check_map_format(self, map_format: str):
+        """校验Map输出格式参数"""
+        if map_format not in self.MAP_FORMATS:
+            raise ValueError(f"不支持的map_format: {map_format}，可选值: {self.MAP_FORMATS}")
+    
+    async def run_many(self, questions: List[str], context: List[str], chunk_count: int = DEFAULT_CHUNK_COUNT,
+                       token_budget: int = MULTI_QUESTION_TOKEN_BUDGET) -> List[str]:
+        """
+        异步批量回答针对同一知识库的多个问题
+        
+        每个chunk在一次Map调用中同时携带多个问题(按token预算自适应分批)，
+        chunk的token只需按批次而不是按问题重复发送；随后对每个问题分别执行一次Reduce。
+        单次Map调用失败时只跳过该chunk上这一批问题，各问题基于其余成功的chunk整合。
+        
+        Args:
+            questions: 问题列表
+            context: 上下文信息列表
+            chunk_count: 分割的chunk数量
+            token_budget: 单次多问题Map调用的token预算
+            
+        Returns:
+            List[str]: 与questions一一对应的最终答案
+        """
+        if not questions:
+            return []
+        
+        unique_questions = list(dict.fromkeys(questions))
+        context_chunks = self._chunk_context(context, chunk_count)
+        
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        async def limited_task(task):
+            async with semaphore:
+                return await task
+        
+        # Map阶段：每个chunk按问题批次并行处理
+        map_tasks = []
+        task_keys = []
+        for i, chunk in enumerate(context_chunks):
+            for batch in self._plan_question_batches(chunk, unique_questions, token_budget):
+                batch_questions = [unique_questions[q] for q in batch]
+                map_tasks.append(self._process_chunk_multi_async(chunk, batch_questions, i+1))
+                task_keys.append((i, batch))
+        
+        print(f"Map阶段：{len(unique_questions)}个问题、{len(context_chunks)}个chunk，共{len(map_tasks)}次Map调用...")
+        batch_results = await asyncio.gather(*[limited_task(task) for task in map_tasks], return_exceptions=True)
+        
+        # 单次Map调用失败只影响该chunk上这一批问题，各问题用其余成功的chunk整合
+        map_results = {q: [] for q in range(len(unique_questions))}
+        failed_calls = 0
+        for (chunk_idx, batch), answers in zip(task_keys, batch_results):
+            if isinstance(answers, Exception):
+                print(f"  - 第{chunk_idx+1}个chunk上{len(batch)}个问题的Map调用失败，已跳过: {answers}")
+                failed_calls += 1
+                continue
+            for q, answer in zip(batch, answers):
+                map_results[q].append((chunk_idx, answer))
+        self.last_run_stats = {"map_calls": len(map_tasks), "failed_map_calls": failed_calls}
+        
+        # Reduce阶段：每个问题分别整合(按chunk顺序)，没有任何成功chunk的问题不调用Reduce
+        print(f"Reduce阶段：分别整合{len(unique_questions)}个问题的回答...")
+        final_answers = [NO_MAP_RESULT_ANSWER] * len(unique_questions)
+        answered = [q for q in range(len(unique_questions)) if map_results[q]]
+        reduce_tasks = [
+            self._reduce_async(unique_questions[q], [answer for _, answer in sorted(map_results[q])])
+            for q in answered
+        ]
+        for q, answer in zip(answered, await asyncio.gather(*[limited_task(task) for task in reduce_tasks])):
+            final_answers[q] = answer
+        
+        answer_map = dict(zip(unique_questions, final_answers))
+        return [answer_map[question] for question in questions]
+    
+    async def run_iterable_async(self, question: str, documents: DocumentSource,
+                                 chunk_token_budget: int = CHUNK_TOKEN_BUDGET,
+                                 max_in_flight: int = MAX_IN_FLIGHT_CHUNKS) -> str:
+        """
+        对任意规模的文档流执行Map-Reduce策略
+        
+        文档按token预算边读边分块，Map任务在途数量受max_in_flight限制(背压)，
+        累积的Map结果超过REDUCE_TOKEN_BUDGET时先做中间Reduce，
+        因此内存占用取决于在途chunk数量而不是语料规模。
+        
+        Args:
+            question: 用户问题
+            documents: 文档的同步/异步可迭代对象，如iter_json_array/iter_jsonl的返回值
+            chunk_token_budget: 单个chunk的token上限
+            max_in_flight: 同时在途的chunk数量上限
+            
+        Returns:
+            str: 最终整合的答案
+        """
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        async def limited_task(task):
+            async with semaphore:
+                return await task
+        
+        map_results = []
+        in_flight = set()
+        chunk_total = 0
+        
+        async def collect(done_tasks):
+            for task in done_tasks:
+                result = task.result()
+                if self._has_relevant_info(result):
+                    map_results.append(result)
+            # 累积结果过多时先做中间Reduce，保证内存和Reduce prompt有界
+            if estimate_tokens("\n\n".join(map_results)) > REDUCE_TOKEN_BUDGET:
+                print(f"中间Reduce：合并{len(map_results)}个片段的回答...")
+                map_results[:] = [await self._reduce_async(question, map_results)]
+        
+        print("Map阶段：流式读取文档并分块处理...")
+        try:
+            async for chunk in self._iter_chunks(documents, chunk_token_budget):
+                chunk_total += 1
+                if len(in_flight) >= max_in_flight:
+                    done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                    await collect(done)
+                task = asyncio.create_task(limited_task(self._process_chunk_async(chunk, question, chunk_total)))
+                in_flight.add(task)
+            
+            if in_flight:
+                done, in_flight = await asyncio.wait(in_flight)
+                await collect(done)
+        finally:
+            # 某个Map任务出错(或被取消)时，取消其余在途任务并等待其结束，再向上抛出异常
+            pending = [task for task in in_flight if not task.done()]
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+        
+        print(f"Reduce阶段：共处理{chunk_total}个chunk，整合所有片段的回答...")
+        if not map_results:
+            map_results = [NO_RELEVANT_INFO_MARK]
+        return await self._reduce_async(question, map_results)
     
-    async def run_async_stream(self, question: str, context: List[str], chunk_count: int = DEFAULT_CHUNK_COUNT) -> str:
+    async def _iter_chunks(self, documents: DocumentSource, chunk_token_budget: int) -> AsyncIterator[List[str]]:
+        """
+        按token预算将文档流组装为chunk
+        
+        Args:
+            documents: 文档的同步/异步可迭代对象
+            chunk_token_budget: 单个chunk的token上限
+            
+        Returns:
+            AsyncIterator[List[str]]: chunk的异步迭代器，超过预算的单个文档独占一个chunk
+        """
+        chunk = []
+        chunk_tokens = 0
+        async for document in aiter_documents(documents):
+            document_tokens = estimate_tokens(document)
+            if chunk and chunk_tokens + document_tokens > chunk_token_budget:
+                yield chunk
+                chunk = []
+                chunk_tokens = 0
+            chunk.append(document)
+            chunk_tokens += document_tokens
+        if chunk:
+            yield chunk
+    
+    async def run_async_stream(self, question: str, context: List[str], chunk_count: int = DEFAULT_CHUNK_COUNT,
+                               allow_fast_path: bool = True) -> str:
         """
         异步流式执行Map-Reduce策略，实时显示处理过程
         
@@ -104,12 +684,22 @@ class LLMMapReduceRunner(LLMCallMixin):
             question: 用户问题
             context: 上下文信息列表
             chunk_count: 分割的chunk数量
+            allow_fast_path: 上下文可一次放入模型窗口时是否直接单次调用回答
             
         Returns:
             str: 最终整合的答案
         """
+        if allow_fast_path and self.can_stuff(question, context, "Map-Reduce"):
+            final_answer = ""
+            async for chunk in await self.call_llm_async(self.create_stuff_messages(question, context), stream=True):
+                print(chunk, end='', flush=True)
+                final_answer += chunk
+            print("")
+            return final_answer
+        
+        self.last_run_stats = {"fast_path": False, "map_format": "text"}
         # Map阶段：分割context并并行处理
-        context_chunks = self._split_context(context, chunk_count)
+        context_chunks = self._chunk_context(context, chunk_count, question)
         
         print(f"Map阶段:将context分割为{len(context_chunks)}个部分进行并行处理...")
         
@@ -146,6 +736,26 @@ class LLMMapReduceRunner(LLMCallMixin):
         
         return final_answer
     
+    def _chunk_context(self, context: List[str], chunk_count: int, question: Optional[str] = None) -> List[List[str]]:
+        """
+        将上下文分块，设置了聚类分块器时按语义聚类，否则按位置切分
+        
+        Args:
+            context: 上下文信息列表
+            chunk_count: 分割的chunk数量
+            question: 用户问题，聚类分块时用于跳过与问题无关的chunk
+            
+        Returns:
+            List[List[str]]: 分割后的context chunks
+        """
+        return [[context[i] for i in indices] for indices in self._chunk_indices(context, chunk_count, question)]
+    
+    def _chunk_indices(self, context: List[str], chunk_count: int, question: Optional[str] = None) -> List[List[int]]:
+        """与_chunk_context相同，但返回每个chunk包含的文档下标"""
+        if self.chunker is not None:
+            return self.chunker.split_indices(context, chunk_count, question)
+        return self._split_context(list(range(len(context))), chunk_count)
+    
     def _split_context(self, context: List[str], chunk_count: int) -> List[List[str]]:
         """
         将上下文信息分割为指定数量的chunk
@@ -178,9 +788,31 @@ class LLMMapReduceRunner(LLMCallMixin):
         
         return chunks
     
+    def enable_coalescing(self, window_ms: float = COALESCE_WINDOW_MS,
+                          max_questions: int = MAX_QUESTIONS_PER_MAP_CALL) -> MapCoalescer:
+        """
+        开启跨请求的Map调用合并
+        
+        开启后，并发执行的多个请求对同一chunk的Map调用会在window_ms内合并为一次多问题调用。
+        适合服务端共享同一个runner实例处理大量并发请求的场景。
+        
+        Args:
+            window_ms: 合并窗口长度(毫秒)
+            max_questions: 单次合并调用最多携带的问题数量
+            
+        Returns:
+            MapCoalescer: 合并器实例，其stats记录请求数和实际调用数
+        """
+        self.coalescer = MapCoalescer(self, window_ms=window_ms, max_questions=max_questions)
+        return self.coalescer
+    
+    def disable_coalescing(self):
+        """关闭跨请求的Map调用合并"""
+        self.coalescer = None
+    
     async def _process_chunk_async(self, chunk: List[str], question: str, chunk_index: int) -> str:
         """
-        异步处理单个chunk
+        异步处理单个chunk，开启了调用合并时交给合并器处理
         
         Args:
             chunk: 单个context chunk
@@ -190,6 +822,12 @@ class LLMMapReduceRunner(LLMCallMixin):
         Returns:
             str: 该chunk的处理结果
         """
+        if self.coalescer is not None:
+            return await self.coalescer.submit(chunk, question, chunk_index)
+        return await self._map_chunk_async(chunk, question, chunk_index)
+    
+    async def _map_chunk_async(self, chunk: List[str], question: str, chunk_index: int) -> str:
+        """对单个chunk发起单问题Map调用"""
         chunk_context = "\n".join(chunk)
         messages = self.create_messages(
             user_content=MAP_TEMPLATE.format(
@@ -203,6 +841,136 @@ class LLMMapReduceRunner(LLMCallMixin):
         print(f"  - 第{chunk_index}个chunk处理完成")
         return result
     
+    async def _process_chunk_multi_async(self, chunk: List[str], questions: List[str], chunk_index: int) -> List[str]:
+        """
+        异步处理单个chunk，一次调用回答多个问题
+        
+        Args:
+            chunk: 单个context chunk
+            questions: 本批次的问题列表
+            chunk_index: chunk索引(用于显示)
+            
+        Returns:
+            List[str]: 与questions一一对应的答案片段
+        """
+        if len(questions) == 1:
+            return [await self._map_chunk_async(chunk, questions[0], chunk_index)]
+        
+        chunk_context = "\n".join(chunk)
+        questions_text = "\n".join(f"{i}. {question}" for i, question in enumerate(questions, 1))
+        messages = self.create_messages(
+            user_content=MULTI_QUESTION_MAP_TEMPLATE.format(
+                chunk_index=chunk_index,
+                context=chunk_context,
+                questions=questions_text
+            )
+        )
+        print(f"  - 处理第{chunk_index}个chunk({len(questions)}个问题)...")
+        response = await self.call_llm_async(messages)
+        answers = self._parse_multi_answers(response, len(questions))
+        
+        # 解析失败或缺失的问题并行退回单问题Map调用
+        retry_indices = [i for i, answer in enumerate(answers) if answer is None]
+        if retry_indices:
+            print(f"  - 第{chunk_index}个chunk有{len(retry_indices)}个问题解析失败，单独重试")
+            retried = await asyncio.gather(*(
+                self._map_chunk_async(chunk, questions[i], chunk_index) for i in retry_indices
+            ))
+            for i, answer in zip(retry_indices, retried):
+                answers[i] = answer
+        print(f"  - 第{chunk_index}个chunk处理完成")
+        return answers
+    
+    def _parse_multi_answers(self, response: str, question_count: int) -> List[Any]:
+        """
+        解析多问题Map调用的结构化输出
+        
+        Args:
+            response: LLM返回的原始文本
+            question_count: 本批次的问题数量
+            
+        Returns:
+            List[Any]: 按问题编号排列的答案，无法解析的位置为None
+        """
+        answers = [None] * question_count
+        result = extract_json(response)
+        if isinstance(result, dict):
+            result = result.get("answers", [])
+        if not isinstance(result, list):
+            return answers
+        
+        for item in result:
+            if not isinstance(item, dict):
+                continue
+            try:
+                index = int(item.get("id")) - 1
+            except (TypeError, ValueError):
+                continue
+            answer = item.get("answer")
+            if 0 <= index < question_count and isinstance(answer, str) and answer.strip():
+                answers[index] = answer.strip()
+        return answers
+    
+    def _plan_question_batches(self, chunk: List[str], questions: List[str], token_budget: int) -> List[List[int]]:
+        """
+        根据token预算为单个chunk规划问题批次
+        
+        Args:
+            chunk: 单个context chunk
+            questions: 全部问题
+            token_budget: 单次Map调用的token预算
+            
+        Returns:
+            List[List[int]]: 每个批次包含的问题下标
+        """
+        base_tokens = (estimate_tokens(DEFAULT_SYSTEM_PROMPT)
+                       + estimate_tokens(MULTI_QUESTION_MAP_TEMPLATE)
+                       + estimate_tokens("\n".join(chunk)))
+        available = token_budget - base_tokens
+        
+        batches = []
+        current_batch = []
+        current_tokens = 0
+        for i, question in enumerate(questions):
+            question_tokens = estimate_tokens(question) + MULTI_QUESTION_ANSWER_TOKENS
+            if current_batch and (current_tokens + question_tokens > available
+                                  or len(current_batch) >= MAX_QUESTIONS_PER_MAP_CALL):
+                batches.append(current_batch)
+                current_batch = []
+                current_tokens = 0
+            current_batch.append(i)
+            current_tokens += question_tokens
+        if current_batch:
+            batches.append(current_batch)
+        return batches
+    
+    @staticmethod
+    def _has_relevant_info(map_result: str) -> bool:
+        """判断Map结果是否包含相关信息(仅回答"无相关信息"的结果视为无效)"""
+        stripped = map_result.strip()
+        return not (NO_RELEVANT_INFO_MARK in stripped and len(stripped) <= len(NO_RELEVANT_INFO_MARK) * 2)
+    
+    async def _reduce_async(self, question: str, map_results: List[str]) -> str:
+        """
+        异步整合所有片段的回答
+        
+        Args:
+            question: 用户问题
+            map_results: 按chunk顺序排列的Map结果
+            
+        Returns:
+            str: 最终整合的答案
+        """
+        combined_results = "\n\n".join([f"片段{i+1}的回答:\n{result}"
+                                        for i, result in enumerate(map_results)])
+        messages = self.create_messages(
+            user_content=REDUCE_TEMPLATE.format(
+                question=question,
+                map_results=combined_results
+            )
+        )
+        return await self.call_llm_async(messages)
+    
     def get_performance_stats(self, context: List[str], chunk_count: int = DEFAULT_CHUNK_COUNT) -> Dict[str, Any]:
         """
         获取性能统计信息
@@ -214,7 +982,7 @@ class LLMMapReduceRunner(LLMCallMixin):
         Returns:
             Dict[str, Any]: 性能统计信息
         """
-        chunks = self._split_context(context, chunk_count)
+        chunks = self._chunk_context(context, chunk_count)
         
         return {
             "total_context_items": len(context),
@@ -0,0 +1,123 @@
+import json
+from typing import Any, AsyncIterable, AsyncIterator, Iterable, Iterator, Union
+
+DEFAULT_READ_BUFFER_SIZE = 64 * 1024  # 惰性解析时每次读取的字符数
+
+DocumentSource = Union[Iterable[Any], AsyncIterable[Any]]
+
+
+def iter_json_array(path: str, encoding: str = "utf-8",
+                    buffer_size: int = DEFAULT_READ_BUFFER_SIZE) -> Iterator[Any]:
+    """
+    惰性解析JSON数组文件，逐个产出数组元素
+
+    只在内存中保留当前读取缓冲区和正在解析的元素，适合超大知识库文件。
+
+    Args:
+        path: JSON数组文件路径
+        encoding: 文件编码
+        buffer_size: 每次读取的字符数
+
+    Returns:
+        Iterator[Any]: 数组元素迭代器
+    """
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding=encoding) as f:
+        buffer = ""
+        eof = False
+        started = False
+
+        while True:
+            buffer = buffer.lstrip()
+            if started and buffer.startswith(","):
+                buffer = buffer[1:].lstrip()
+
+            # 缓冲区为空时继续读取
+            if not buffer:
+                if eof:
+                    raise ValueError(f"JSON数组不完整: {path}")
+                more = f.read(buffer_size)
+                eof = not more
+                buffer += more
+                continue
+
+            if not started:
+                if buffer[0] != "[":
+                    raise ValueError(f"文件内容不是JSON数组: {path}")
+                buffer = buffer[1:]
+                started = True
+                continue
+
+            if buffer[0] == "]":
+                return
+
+            try:
+                item, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                end = None
+
+            # 元素可能被缓冲区截断(包括数字等无结束符的值),读入更多内容后重试
+            if end is None or (end == len(buffer) and not eof):
+                more = f.read(buffer_size)
+                eof = not more
+                buffer += more
+                continue
+
+            yield item
+            buffer = buffer[end:]
+
+
+def iter_jsonl(path: str, encoding: str = "utf-8") -> Iterator[Any]:
+    """
+    逐行解析JSONL文件
+
+    Args:
+        path: JSONL文件路径
+        encoding: 文件编码
+
+    Returns:
+        Iterator[Any]: 每行解析得到的对象
+    """
+    with open(path, "r", encoding=encoding) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def iter_documents(path: str, encoding: str = "utf-8") -> Iterator[Any]:
+    """根据文件扩展名选择JSONL或JSON数组的惰性解析方式"""
+    if path.endswith(".jsonl"):
+        return iter_jsonl(path, encoding)
+    return iter_json_array(path, encoding)
+
+
+def document_to_text(document: Any) -> str:
+    """将文档转换为文本，字符串原样返回，其余对象优先取text/content字段"""
+    if isinstance(document, str):
+        return document
+    if isinstance(document, dict):
+        for key in ("text", "content"):
+            if isinstance(document.get(key), str):
+                return document[key]
+    return json.dumps(document, ensure_ascii=False)
+
+
+async def aiter_documents(documents: DocumentSource) -> AsyncIterator[str]:
+    """
+    将同步/异步可迭代对象统一转换为异步文本迭代器
+
+    Args:
+        documents: 文档的同步或异步可迭代对象
+
+    Returns:
+        AsyncIterator[str]: 文档文本的异步迭代器
+    """
+    if hasattr(documents, "__aiter__"):
+        async for document in documents:
+            yield document_to_text(document)
+    else:
+        for document in documents:
+            yield document_to_text(document)
@@ -44,6 +44,136 @@ REDUCE_TEMPLATE = """
 整合后的完整答案：
 """
 
+MULTI_QUESTION_MAP_TEMPLATE = """
+你是一个专业的信息分析师，正在参与一个分布式问答处理过程。你需要基于提供的特定部分上下文信息，同时回答多个问题。
+
+重要说明：
+1. 你只需要处理当前这部分上下文信息
+2. 每个问题单独作答，只提取与该问题相关的内容
+3. 如果这部分信息无法完全回答某个问题，请只回答能够确定的部分
+4. 不要试图推测或补充上下文中没有的信息
+5. 如果这部分信息与某个问题无关，该问题的answer请填写"当前部分无相关信息"
+
+---
+当前处理的上下文信息 (第{chunk_index}部分):
+{context}
+---
+问题列表:
+{questions}
+---
+请严格按照以下JSON格式输出，每个问题对应一项，id与问题编号一致：
+```json
+{{
+    "answers": [
+        {{"id": 1, "answer": "问题1的答案片段"}},
+        {{"id": 2, "answer": "问题2的答案片段"}}
+    ]
+}}
+```
+"""
+
+COMPACT_MAP_TEMPLATE = """
+你是一个信息抽取器，正在参与一个分布式问答处理过程。请从当前这部分上下文中抽取与问题直接相关的原子事实。
+
+要求：
+1. 每条事实只陈述一个信息点，尽量简短，不要连接词和客套话
+2. sources填写事实所依据的文档编号(如"d3")
+3. 只抽取上下文中明确出现的信息，不要推测
+4. 如果这部分信息与问题无关，relevant填false，facts为空列表
+5. 只输出JSON，不要输出任何其他内容
+
+---
+当前处理的上下文信息 (第{chunk_index}部分，每行以文档编号开头):
+{context}
+---
+问题:
+{question}
+---
+输出格式：
+{{"relevant": true, "facts": [{{"fact": "事实1", "sources": ["d1"]}}]}}
+"""
+
+COMPACT_REDUCE_TEMPLATE = """
+你是一个专业的信息整合专家，需要根据从多个信息源抽取并去重后的事实列表，为问题给出完整、准确、逻辑清晰的最终答案。
+
+原始问题：{question}
+
+事实列表(每行一条事实，方括号内为来源文档编号)：
+---
+{facts}
+---
+
+要求：
+1. 只使用事实列表中的信息，不要添加额外内容
+2. 按逻辑顺序组织答案，必要时分点列举
+3. 如果事实之间存在冲突，请指出并选择最合理的版本
+4. 如果信息不足以完整回答问题，请明确指出缺失的方面
+
+整合后的完整答案：
+"""
+
+DIGEST_TEMPLATE = """
+你是一个专业的信息整理专家，需要为一部分知识库内容生成与具体问题无关的摘要，供之后回答各种问题时代替原文使用。
+
+要求：
+1. summary用几句话概括这部分内容涉及的主题和要点
+2. facts逐条列出其中的关键事实、定义、数据和专有名词，每条只包含一个信息点，尽量保留原文表述
+3. 不要遗漏可能被提问的细节，不要添加原文没有的信息
+4. 只输出JSON，不要输出任何其他内容
+
+---
+知识库内容:
+{context}
+---
+输出格式：
+{{"summary": "摘要", "facts": ["事实1", "事实2"]}}
+"""
+
+DIGEST_MAP_TEMPLATE = """
+你是一个专业的信息分析师，正在参与一个分布式问答处理过程。下面是某部分知识库内容的预先整理的摘要和关键事实，请基于它回答问题。
+
+重要说明：
+1. 只使用摘要和关键事实中的信息，不要推测
+2. 如果这部分内容与问题无关，请回答"当前部分无相关信息"
+3. 如果内容与问题相关但摘要中的信息不足以回答，请只回答"{insufficient_mark}"
+4. 回答要简洁明了，突出重点
+
+---
+第{chunk_index}部分的摘要:
+{digest}
+---
+问题:
+{question}
+---
+请基于摘要提供相关的答案片段：
+"""
+
 # Map-Reduce相关配置
 DEFAULT_CHUNK_COUNT = 4  # 默认分割成4个chunk进行并行处理
 MAX_CONCURRENT_REQUESTS = 8  # 最大并发请求数
+
+# 多问题批量Map相关配置
+MULTI_QUESTION_TOKEN_BUDGET = 16000  # 单次多问题Map调用的token预算(prompt + 预计输出)
+MULTI_QUESTION_ANSWER_TOKENS = 400  # 每个问题预留的输出token数
+MAX_QUESTIONS_PER_MAP_CALL = 8  # 单次Map调用最多携带的问题数量
+
+# 流式语料相关配置
+CHUNK_TOKEN_BUDGET = 4000  # 流式分块时单个chunk的token上限
+MAX_IN_FLIGHT_CHUNKS = 16  # 同时在途(已分块但未完成Map)的chunk数量上限
+REDUCE_TOKEN_BUDGET = 12000  # 累积的Map结果超过该token数时先做一次中间Reduce
+NO_RELEVANT_INFO_MARK = "当前部分无相关信息"  # Map阶段无相关信息时的标记
+NO_MAP_RESULT_ANSWER = "所有片段的Map调用均失败，无法回答该问题"  # 批量回答时某个问题没有任何成功的Map结果时返回的答案
+
+# 截止时间(anytime)模式相关配置
+DEFAULT_CHUNK_TIMEOUT = 60  # 单个chunk的Map调用超时时间(秒)
+REDUCE_TIME_RESERVE = 10  # 为Reduce阶段预留的时间(秒)，截止时间前这么久停止等待Map结果
+
+# 紧凑Map输出相关配置
+COMPACT_MAP_MAX_TOKENS = 300  # 紧凑模式下单次Map调用的输出token上限
+COMPACT_FACT_DEDUP_THRESHOLD = 0.85  # 跨chunk事实去重的文本相似度阈值
+
+# 离线摘要相关配置
+DIGEST_INSUFFICIENT_MARK = "摘要信息不足"  # 摘要不足以回答时的标记，出现时回退到原文
+
+# 跨请求合并Map调用相关配置
+COALESCE_WINDOW_MS = 5  # 合并窗口长度(毫秒)
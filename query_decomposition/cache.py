@@ -0,0 +1,109 @@
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from base.fingerprint import corpus_fingerprint
+from base.similarity import canonical_question
+from query_decomposition.template import SEMANTIC_CACHE_SIZE, QUESTION_FILLER_CHARS
+
+
+class SemanticCache:
+    """
+    按问题的规范形式查找的LRU缓存
+
+    问题先转换为规范形式(canonical_question)：同义问法("什么是X/X是什么"、"X有哪些/X包括哪些")
+    改写为统一形式并去除助词，但保留实词及其顺序。规范形式相同才视为命中，
+    "优点/缺点"这类只差一个实词、"A收购B/B收购A"这类主客体互换的问题不会互相命中。
+    可以附带一个必须完全相同的key(如上下文指纹)。
+    """
+
+    def __init__(self, max_entries: int = SEMANTIC_CACHE_SIZE, filler_chars: str = QUESTION_FILLER_CHARS):
+        """
+        Args:
+            max_entries: 最多保留的条目数，超出时淘汰最久未使用的条目
+            filler_chars: 比较时忽略的助词/语气词
+        """
+        self.max_entries = max_entries
+        self.filler_chars = filler_chars
+        self._entries: "OrderedDict[tuple, Any]" = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0}
+
+    def get(self, text: str, key: str = "") -> Optional[Any]:
+        """
+        查找与text规范形式相同且key相同的条目
+
+        Args:
+            text: 查询文本
+            key: 必须完全匹配的附加键
+
+        Returns:
+            Optional[Any]: 命中时返回缓存的值，否则返回None
+        """
+        entry_key = (key, canonical_question(text, self.filler_chars))
+        if entry_key not in self._entries:
+            self.stats["misses"] += 1
+            return None
+        self._entries.move_to_end(entry_key)
+        self.stats["hits"] += 1
+        return self._entries[entry_key]
+
+    def put(self, text: str, value: Any, key: str = ""):
+        """写入条目，超出容量时淘汰最久未使用的条目"""
+        entry_key = (key, canonical_question(text, self.filler_chars))
+        self._entries[entry_key] = value
+        self._entries.move_to_end(entry_key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class DecompositionCache:
+    """
+    查询分解的语义缓存：同义的问题复用分解计划，同义的子问题在检索到的上下文相同时复用子答案
+
+    子答案依赖语料，语料指纹变化时子答案缓存整体失效；分解计划只依赖问题本身，不受影响。
+    """
+
+    def __init__(self, max_entries: int = SEMANTIC_CACHE_SIZE):
+        """
+        Args:
+            max_entries: 每类缓存最多保留的条目数
+        """
+        self.plans = SemanticCache(max_entries)
+        self.answers = SemanticCache(max_entries)
+        self.corpus_fingerprint: Optional[str] = None
+
+    def check_corpus(self, context: List[str]) -> bool:
+        """
+        检查语料是否变化，变化时清空子答案缓存
+
+        Args:
+            context: 当前语料
+
+        Returns:
+            bool: 语料是否发生了变化(首次调用不算变化)
+        """
+        fingerprint = corpus_fingerprint(context)
+        changed = self.corpus_fingerprint is not None and fingerprint != self.corpus_fingerprint
+        if changed:
+            print(f"语料已变化，清空{len(self.answers)}条子答案缓存")
+            self.answers.clear()
+        self.corpus_fingerprint = fingerprint
+        return changed
+
+    def get_plan(self, question: str) -> Optional[List[Dict[str, Any]]]:
+        sub_queries = self.plans.get(question)
+        return [dict(sub_query) for sub_query in sub_queries] if sub_queries is not None else None
+
+    def put_plan(self, question: str, sub_queries: List[Dict[str, Any]]):
+        self.plans.put(question, [dict(sub_query) for sub_query in sub_queries])
+
+    def get_answer(self, sub_question: str, context_fingerprint: str) -> Optional[str]:
+        return self.answers.get(sub_question, context_fingerprint)
+
+    def put_answer(self, sub_question: str, context_fingerprint: str, answer: str):
+        self.answers.put(sub_question, answer, context_fingerprint)
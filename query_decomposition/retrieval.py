@@ -0,0 +1,89 @@
+import math
+from collections import Counter, defaultdict
+from typing import Awaitable, Dict, List, Protocol, Union, runtime_checkable
+
+from base.similarity import tokenize
+from query_decomposition.template import RETRIEVAL_TOP_K
+
+
+@runtime_checkable
+class BatchRetriever(Protocol):
+    """
+    批量检索接口：一次调用为多个查询检索文档
+
+    retrieve_many可以是同步方法，也可以返回awaitable(异步)；返回值与queries一一对应。
+    向量检索可借此做一次矩阵乘法，BM25可共享倒排表的遍历。
+    """
+
+    def retrieve_many(self, queries: List[str], top_k: int) -> Union[List[List[str]], Awaitable[List[List[str]]]]:
+        ...
+
+
+class LexicalBatchRetriever:
+    """
+    基于BM25倒排索引的本地批量检索器
+
+    索引在构造时建立一次；retrieve_many对所有查询的词项并集只遍历一次倒排表。
+    同时支持按单个查询调用，可直接作为retrieval_func使用。
+    """
+
+    def __init__(self, documents: List[str], k1: float = 1.5, b: float = 0.75):
+        """
+        Args:
+            documents: 待检索的文档列表
+            k1: BM25的词频饱和参数
+            b: BM25的长度归一化参数
+        """
+        self.documents = documents
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, List[tuple]] = defaultdict(list)
+        lengths = []
+        for doc_index, doc in enumerate(documents):
+            terms = Counter(tokenize(doc))
+            lengths.append(sum(terms.values()))
+            for term, tf in terms.items():
+                self._postings[term].append((doc_index, tf))
+        self._lengths = lengths
+        self._avg_length = (sum(lengths) / len(lengths)) if lengths and sum(lengths) else 1.0
+
+    def retrieve_many(self, queries: List[str], top_k: int = RETRIEVAL_TOP_K) -> List[List[str]]:
+        """
+        批量检索
+
+        Args:
+            queries: 查询列表
+            top_k: 每个查询返回的文档数上限
+
+        Returns:
+            List[List[str]]: 与queries一一对应的文档列表(按相关度降序，不含零分文档)
+        """
+        query_terms = [set(tokenize(query)) for query in queries]
+        term_queries: Dict[str, List[int]] = defaultdict(list)
+        for query_index, terms in enumerate(query_terms):
+            for term in terms:
+                term_queries[term].append(query_index)
+
+        total = len(self.documents)
+        scores = [defaultdict(float) for _ in queries]
+        # 每个词项的倒排表只遍历一次，分数累加到所有包含该词项的查询上
+        for term, query_indices in term_queries.items():
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_index, tf in postings:
+                length_norm = 1 - self.b + self.b * self._lengths[doc_index] / self._avg_length
+                weight = idf * tf * (self.k1 + 1) / (tf + self.k1 * length_norm)
+                for query_index in query_indices:
+                    scores[query_index][doc_index] += weight
+
+        results = []
+        for query_scores in scores:
+            ranked = sorted(query_scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+            results.append([self.documents[doc_index] for doc_index, _ in ranked])
+        return results
+
+    def __call__(self, query: str, top_k: int = RETRIEVAL_TOP_K) -> List[str]:
+        """单个查询的检索"""
+        return self.retrieve_many([query], top_k)[0]
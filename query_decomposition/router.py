@@ -0,0 +1,182 @@
+import json
+import math
+import re
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+from base.tokens import estimate_tokens
+from query_decomposition.template import ROUTER_DECOMPOSE_THRESHOLD, ROUTER_HISTORY_SIZE
+
+_QUESTION_MARK_PATTERN = re.compile(r"[?？]")
+_CLAUSE_SPLIT_PATTERN = re.compile(r"[,，;；。？?!！]+")
+_INTERROGATIVE_PATTERN = re.compile(
+    r"什么|哪些|哪个|哪里|如何|怎么|怎样|为什么|为何|是否|多少|几种|\b(?:what|which|how|why|when|where|who)\b",
+    re.IGNORECASE
+)
+_STRONG_CONJUNCTION_PATTERN = re.compile(
+    r"以及|并且|而且|另外|此外|同时|还有|分别|\b(?:and also|as well as|additionally)\b",
+    re.IGNORECASE
+)
+_WEAK_CONJUNCTION_PATTERN = re.compile(r"和|与|及|或|\b(?:and|or)\b", re.IGNORECASE)
+
+# 手工设定的线性模型权重(logistic)，可通过fit在标注数据上重新学习
+DEFAULT_ROUTER_WEIGHTS = {
+    "bias": -2.0,
+    "extra_question_marks": 2.0,
+    "extra_clauses": 1.0,
+    "extra_interrogatives": 1.5,
+    "strong_conjunctions": 1.5,
+    "weak_conjunctions": 0.5,
+    "length": 1.0
+}
+
+
+class ComplexityRouter:
+    """
+    本地问题复杂度路由器：判断问题是否需要分解
+
+    基于问号、分句、疑问词、连词和长度等廉价特征，用线性(logistic)模型给出需要分解的概率，
+    不调用LLM，单次判断耗时在毫秒以下。每次判断都会记录下来，便于离线评估路由效果。
+    """
+
+    FEATURES = ("extra_question_marks", "extra_clauses", "extra_interrogatives",
+                "strong_conjunctions", "weak_conjunctions", "length")
+
+    def __init__(self, threshold: float = ROUTER_DECOMPOSE_THRESHOLD, weights: Optional[Dict[str, float]] = None,
+                 history_size: int = ROUTER_HISTORY_SIZE):
+        """
+        Args:
+            threshold: 需要分解的概率阈值，达到该值时分解问题
+            weights: 线性模型权重(特征名→权重，"bias"为偏置)，默认使用手工设定的权重；未给出的特征权重为0
+            history_size: 保留的最近路由记录数
+        """
+        self.threshold = threshold
+        self.weights = {name: 0.0 for name in ("bias",) + self.FEATURES}
+        self.weights.update(weights or DEFAULT_ROUTER_WEIGHTS)
+        self.history: deque = deque(maxlen=history_size)
+
+    def features(self, question: str) -> Dict[str, float]:
+        """
+        提取问题的廉价特征
+
+        Args:
+            question: 用户问题
+
+        Returns:
+            Dict[str, float]: 特征名→特征值
+        """
+        clauses = [clause for clause in _CLAUSE_SPLIT_PATTERN.split(question) if clause.strip()]
+        return {
+            "extra_question_marks": max(0, len(_QUESTION_MARK_PATTERN.findall(question)) - 1),
+            "extra_clauses": max(0, len(clauses) - 1),
+            "extra_interrogatives": max(0, len(_INTERROGATIVE_PATTERN.findall(question)) - 1),
+            "strong_conjunctions": len(_STRONG_CONJUNCTION_PATTERN.findall(question)),
+            "weak_conjunctions": len(_WEAK_CONJUNCTION_PATTERN.findall(question)),
+            "length": estimate_tokens(question) / 50
+        }
+
+    def predict_proba(self, question: str) -> float:
+        """返回问题需要分解的概率"""
+        return self._sigmoid(self._score(self.features(question)))
+
+    def route(self, question: str) -> Dict[str, Any]:
+        """
+        判断问题是否需要分解，并记录本次判断
+
+        Args:
+            question: 用户问题
+
+        Returns:
+            Dict[str, Any]: decompose为是否分解，confidence为该判断的置信度(0.5~1)，
+            probability为需要分解的概率，features为使用的特征
+        """
+        features = self.features(question)
+        probability = self._sigmoid(self._score(features))
+        decompose = probability >= self.threshold
+        decision = {
+            "question": question,
+            "decompose": decompose,
+            "probability": probability,
+            "confidence": probability if decompose else 1 - probability,
+            "features": features
+        }
+        self.history.append(decision)
+        return decision
+
+    def fit(self, questions: List[str], labels: List[bool], epochs: int = 200,
+            learning_rate: float = 0.1, l2: float = 0.01) -> "ComplexityRouter":
+        """
+        在标注数据上用梯度下降学习线性模型权重(以当前权重为初始值)
+
+        Args:
+            questions: 问题列表
+            labels: 与questions一一对应，True表示需要分解
+            epochs: 迭代轮数
+            learning_rate: 学习率
+            l2: L2正则系数
+
+        Returns:
+            ComplexityRouter: self，便于链式调用
+        """
+        if len(questions) != len(labels):
+            raise ValueError("questions和labels的长度必须一致")
+        samples = [(self.features(question), 1.0 if label else 0.0) for question, label in zip(questions, labels)]
+        if not samples:
+            return self
+
+        for _ in range(epochs):
+            gradients = {name: 0.0 for name in self.weights}
+            for features, label in samples:
+                error = self._sigmoid(self._score(features)) - label
+                gradients["bias"] += error
+                for name in self.FEATURES:
+                    gradients[name] += error * features[name]
+            for name in self.weights:
+                penalty = 0.0 if name == "bias" else l2 * self.weights[name]
+                self.weights[name] -= learning_rate * (gradients[name] / len(samples) + penalty)
+        return self
+
+    def evaluate(self, questions: List[str], labels: List[bool]) -> Dict[str, float]:
+        """
+        评估路由效果(不写入判断记录)
+
+        Args:
+            questions: 问题列表
+            labels: 与questions一一对应，True表示需要分解
+
+        Returns:
+            Dict[str, float]: accuracy、precision、recall，以及被判为无需分解(省去分解调用)的比例skip_rate
+        """
+        predictions = [self.predict_proba(question) >= self.threshold for question in questions]
+        true_positive = sum(1 for p, l in zip(predictions, labels) if p and l)
+        predicted_positive = sum(predictions)
+        actual_positive = sum(1 for label in labels if label)
+        total = len(labels) or 1
+        return {
+            "accuracy": sum(1 for p, l in zip(predictions, labels) if p == bool(l)) / total,
+            "precision": true_positive / predicted_positive if predicted_positive else 0.0,
+            "recall": true_positive / actual_positive if actual_positive else 0.0,
+            "skip_rate": (len(predictions) - predicted_positive) / total
+        }
+
+    def save(self, path: str):
+        """将模型权重和阈值保存为JSON文件"""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"threshold": self.threshold, "weights": self.weights}, f, ensure_ascii=False, indent=2)
+
+    @classmethod
+    def load(cls, path: str) -> "ComplexityRouter":
+        """从JSON文件加载模型权重和阈值"""
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(threshold=data["threshold"], weights=data["weights"])
+
+    def _score(self, features: Dict[str, float]) -> float:
+        return self.weights.get("bias", 0.0) + sum(self.weights.get(name, 0.0) * features[name] for name in self.FEATURES)
+
+    @staticmethod
+    def _sigmoid(x: float) -> float:
+        if x >= 0:
+            return 1 / (1 + math.exp(-x))
+        z = math.exp(x)
+        return z / (1 + z)
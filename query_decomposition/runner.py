@@ -1,218 +1,1300 @@
-import json
 import asyncio
-from typing import List, Dict, Any, Callable, Optional, Awaitable
-from query_decomposition.template import QUERY_DECOMPOSITION_PROMPT, RESULT_SUMMARIZATION_PROMPT,SINGLE_QUERY_PROMPT
+import inspect
+import json
+import re
+import time
+from typing import List, Dict, Any, Callable, Iterable, Optional, Awaitable, Union
+from query_decomposition.template import (
+    QUERY_DECOMPOSITION_PROMPT,
+    BATCH_DECOMPOSITION_PROMPT,
+    RESULT_SUMMARIZATION_PROMPT,
+    SINGLE_QUERY_PROMPT,
+    DEPENDENCY_CONTEXT_TEMPLATE,
+    MULTI_ANSWER_PROMPT,
+    MULTI_ANSWER_MAX_CONTEXT_TOKENS,
+    SUMMARY_SENTENCE_DEDUP_THRESHOLD,
+    SUMMARY_SENTENCE_MIN_CHARS,
+    DECOMPOSE_BATCH_TOKEN_BUDGET,
+    DECOMPOSE_BATCH_MAX_QUESTIONS,
+    DECOMPOSE_BATCH_MAX_RETRIES,
+    SUMMARY_RESERVE_SECONDS,
+    MISSING_ASPECTS_TEMPLATE,
+    QUESTION_FILLER_CHARS,
+    RETRIEVAL_TOP_K,
+    DECOMPOSITION_MAX_DEPTH,
+    MAX_CONCURRENT_LLM_CALLS
+)
 from base.mixins import LLMCallMixin
+from base.parsing import extract_json
+from base.tokens import estimate_tokens, estimate_tokens_many
+from base.fingerprint import text_hash
+from base.similarity import canonical_question, normalize_text, text_similarity
+from query_decomposition.router import ComplexityRouter
+from query_decomposition.cache import DecompositionCache
+from query_decomposition.retrieval import BatchRetriever
+
+_SENTENCE_SPLIT_PATTERN = re.compile(r"(?<=[。！？!?；;\n])")
+# 批量分解结果中按问题编号组织的单个分解计划，如 "3": {"sub_queries": [...]}
+_PLAN_KEY_PATTERN = re.compile(r'"(\d+)"\s*:\s*(?=[{\[])')
+
+# 子问题未能回答的原因
+_MISSING_OUTCOME_LABELS = {
+    "timeout": "超时",
+    "error": "处理出错",
+    "cancelled": "到达截止时间被取消",
+    "skipped": "到达截止时间未处理"
+}
+
+# 检索函数：按单个查询检索(同步或异步)，或实现了retrieve_many的批量检索器
+Retriever = Union[Callable[[str], List[str]], Callable[[str], Awaitable[List[str]]], BatchRetriever]
+
+
+class _PrefetchedRetrieval:
+    """批量检索的结果，按查询取出，供逐个子问题使用"""
+
+    def __init__(self, queries: List[str], results: List[List[str]]):
+        self._results = dict(zip(queries, results))
+
+    def __call__(self, query: str) -> List[str]:
+        return self._results.get(query, [])
 
 
 class QueryDecompositionRunner(LLMCallMixin):
-    def __init__(self, llm_api_key: str, llm_api_url: str):
+    def __init__(self, llm_api_key: str, llm_api_url: str, router: Optional[ComplexityRouter] = None,
+                 cache: Optional[DecompositionCache] = None, retrieval_top_k: int = RETRIEVAL_TOP_K,
+                 max_depth: int = DECOMPOSITION_MAX_DEPTH, max_concurrency: int = MAX_CONCURRENT_LLM_CALLS,
+                 multi_answer: bool = False, pack_context: bool = False,
+                 sub_query_timeout: Optional[float] = None, deadline: Optional[float] = None,
+                 summary_reserve: float = SUMMARY_RESERVE_SECONDS):
+        """
+        Args:
+            llm_api_key: LLM API Key
+            llm_api_url: LLM API地址
+            router: 可选的复杂度路由器，设置后简单问题跳过分解，直接单次调用回答
+            cache: 可选的语义缓存，设置后同义的问题复用分解计划，同义的子问题在上下文相同时复用子答案
+            retrieval_top_k: 使用批量检索器时每个子问题检索的文档数
+            max_depth: 递归分解的最大层数，1表示不递归
+            max_concurrency: 异步执行时同时进行的LLM调用数上限
+            multi_answer: 是否在去重后的上下文足够小时一次调用回答本层所有子问题，超出预算时自动逐个回答
+            pack_context: 是否对子问题间共享的上下文去重打包：无检索函数时尽量一次调用回答所有子问题，
+                逐个回答时把共享文档提到上下文最前面(形成相同的prompt前缀)，汇总前去除子答案间重复的句子
+            sub_query_timeout: 异步执行时单个子问题(从其依赖完成起)的超时时间(秒)，None表示不限时
+            deadline: 整体时间上限(秒)，None表示不限时；到达截止时间时取消未完成的子问题，基于已有的回答汇总
+            summary_reserve: 设置了deadline时为汇总预留的时间(秒)
+        """
         super().__init__(llm_api_key, llm_api_url)
+        self.router = router
+        self.cache = cache
+        self.retrieval_top_k = retrieval_top_k
+        self.max_depth = max_depth
+        self.max_concurrency = max_concurrency
+        self.multi_answer = multi_answer
+        self.pack_context = pack_context
+        self.sub_query_timeout = sub_query_timeout
+        self.deadline = deadline
+        self.summary_reserve = summary_reserve
+        self._deadline_at: Optional[float] = None  # 本次运行的截止时刻(time.monotonic)
+        self._sent_doc_ids: set = set()  # 本次运行已放入prompt的文档id
+        self._llm_semaphore: Optional[asyncio.Semaphore] = None
+        self.last_run_stats: Dict[str, Any] = {}  # 最近一次执行的统计信息
 
-    def run(self, question: str, context: list[str], retrieval_func: Optional[Callable[[str], List[str]]] = None) -> str:
+    def run(self, question: str, context: list[str], retrieval_func: Optional[Retriever] = None) -> str:
         """
         同步执行query decomposition策略
         
         Args:
             question: 用户问题
             context: 初始上下文信息（当无检索函数时使用）
-            retrieval_func: 检索函数，用于根据子问题检索相关信息
+            retrieval_func: 检索函数，用于根据子问题检索相关信息；实现了retrieve_many的批量检索器会一次检索所有子问题
         
         Returns:
             str: 最终汇总答案
         """
+        # 简单问题跳过分解，直接回答
+        if not self._start_run(question, context):
+            retrieval_func = self._prefetch(retrieval_func, [question])
+            context_str, _, _ = self._resolve_context(question, context, retrieval_func, 1)
+            return self._answer_sub_query(question, context_str)
+        
+        return self._solve(question, context, retrieval_func, 1)
+
+    def _solve(self, question: str, context: list[str], retrieval_func: Optional[Retriever], depth: int,
+               inherited_answers: str = "") -> str:
+        """
+        分解问题、按依赖顺序回答子问题并汇总，复杂的子问题在深度允许时递归分解
+        
+        Args:
+            question: 当前层的问题
+            context: 初始上下文信息
+            retrieval_func: 检索函数
+            depth: 当前分解层数(原问题为1)
+            inherited_answers: 上层前置子问题的回答，递归分解时传给下层的所有子问题
+        
+        Returns:
+            str: 当前层的汇总答案
+        """
         # 1. 分解问题
         print("=== 开始分解问题 ===")
         sub_queries = self._decompose_query(question)
         print(f"分解得到 {len(sub_queries)} 个子问题")
+        merged_into = self._merge_sub_queries(sub_queries)
+        order = self._plan_dag(sub_queries, merged_into, depth)
+        recursive = [self._needs_recursion(sub_query, depth) for sub_query in sub_queries]
+        batch_retrieval = self._prefetch(retrieval_func, self._unique_questions(sub_queries, merged_into, recursive))
         
-        # 2. 对每个子问题进行回答
+        # 2. 按依赖顺序回答子问题(合并的近似重复子问题只检索和回答一次)
         print("=== 开始回答子问题 ===")
-        sub_qa_pairs = []
-        for i, sub_query in enumerate(sub_queries, 1):
-            print(f"\n处理第{i}个子问题: {sub_query['question']}")
+        unique_pairs, batch_retrieval = self._answer_all(
+            sub_queries, merged_into, recursive, context, batch_retrieval, inherited_answers, depth
+        )
+        pending = self._pack_candidates(merged_into, recursive, unique_pairs)
+        if pending and batch_retrieval:
+            retrieved = {index: self._retrieve(sub_queries[index]['question'], batch_retrieval, index + 1)
+                         for index in pending}
+            batch_retrieval = self._hoist_shared_docs(sub_queries, retrieved, batch_retrieval)
+        elif pending:
+            self._record_hoisted_context(context, len(pending))
+        for index in order:
+            if merged_into[index] is not None or index in unique_pairs:
+                continue
+            sub_query = sub_queries[index]
+            if self._remaining_time() == 0:
+                print(f"\n到达截止时间，跳过第{index + 1}个子问题: {sub_query['question']}")
+                unique_pairs[index] = self._missing_pair(sub_query, depth, index, "skipped")
+                continue
+            print(f"\n处理第{index + 1}个子问题: {sub_query['question']}")
+            started_at = time.perf_counter()
+            dependency_answers = self._dependency_answers(sub_queries, merged_into, unique_pairs, index, inherited_answers)
             
-            # 使用检索函数为每个子问题检索最相关的上下文
-            if retrieval_func:
-                print(f"  正在为子问题{i}检索相关上下文...")
-                sub_context = retrieval_func(sub_query['question'])
-                if sub_context:
-                    context_str = "\n".join(sub_context)
-                    print(f"  检索到 {len(sub_context)} 条相关信息")
-                else:
-                    context_str = "\n".join(context)
-                    print(f"  未检索到相关信息，使用默认上下文")
+            if recursive[index]:
+                # 复杂的子问题继续分解，下层汇总的答案作为该子问题的答案
+                self.last_run_stats["recursive_decompositions"] += 1
+                sub_answer = self._solve(sub_query['question'], context, retrieval_func, depth + 1, dependency_answers)
+                context_used, doc_ids = 0, None
             else:
-                context_str = "\n".join(context)
-                print(f"  使用默认上下文")
-            
-            # 使用上下文回答子问题
-            sub_answer = self._answer_sub_query(sub_query['question'], context_str)
+                # 使用检索函数为每个子问题检索最相关的上下文
+                context_str, context_used, doc_ids = self._resolve_context(
+                    sub_query['question'], context, batch_retrieval, index + 1
+                )
+                # 使用上下文(及前置子问题的回答)回答子问题
+                sub_answer = self._answer_sub_query(sub_query['question'],
+                                                    self._with_dependencies(context_str, dependency_answers))
             
-            sub_qa_pairs.append({
+            unique_pairs[index] = {
                 'question': sub_query['question'],
                 'focus': sub_query['focus'],
                 'answer': sub_answer,
-                'context_used': len(sub_context) if retrieval_func and sub_context else len(context)
-            })
-            print(f"子问题{i}回答完成")
+                'context_used': context_used,
+                'doc_ids': doc_ids
+            }
+            self._record_outcome(depth, index, sub_query, "answered", time.perf_counter() - started_at)
+            print(f"子问题{index + 1}回答完成")
+        sub_qa_pairs = self._expand_merged_pairs(sub_queries, merged_into, unique_pairs, depth)
         
         # 3. 汇总所有答案
         print("\n=== 开始汇总答案 ===")
-        final_answer = self._summarize_answers(question, sub_qa_pairs)
+        final_answer = self._summarize_answers(question, self._dedup_sub_answers(sub_qa_pairs))
         print("汇总完成")
         
         return final_answer
 
-    async def run_async(self, question: str, context: list[str], retrieval_func: Optional[Callable[[str], Awaitable[List[str]]]] = None) -> str:
+    async def run_async(self, question: str, context: list[str], retrieval_func: Optional[Retriever] = None) -> str:
         """
         异步执行query decomposition策略
         
         Args:
             question: 用户问题
             context: 初始上下文信息（当无检索函数时使用）
-            retrieval_func: 异步检索函数，用于根据子问题检索相关信息
+            retrieval_func: 异步检索函数，用于根据子问题检索相关信息；实现了retrieve_many的批量检索器会一次检索所有子问题
         
         Returns:
             str: 最终汇总答案
         """
+        self._llm_semaphore = asyncio.Semaphore(self.max_concurrency)
+        # 简单问题跳过分解，直接回答
+        if not self._start_run(question, context):
+            retrieval_func = await self._prefetch_async(retrieval_func, [question])
+            context_str, _, _ = await self._resolve_context_async(question, context, retrieval_func, 1)
+            return await self._answer_sub_query_async(question, context_str)
+        
+        return await self._solve_async(question, context, retrieval_func, 1)
+
+    async def _solve_async(self, question: str, context: list[str], retrieval_func: Optional[Retriever], depth: int,
+                           inherited_answers: str = "") -> str:
+        """
+        异步版本的_solve：按依赖关系构成的DAG调度子问题
+        
+        每个子问题在其依赖的子问题全部完成后立即开始，相互独立的分支并行执行，
+        同时进行的LLM调用数受max_concurrency限制。分解、批量检索和单次回答全部子问题也受截止时间约束；
+        本层被取消(如上层子问题超时)时，本层创建的子问题任务一并取消并回收。
+        """
         # 1. 分解问题
         print("=== 开始分解问题 ===")
-        sub_queries = await self._decompose_query_async(question)
+        sub_queries = await self._within_deadline(
+            self._decompose_query_async(question), self._fallback_plan(question), "问题分解"
+        )
         print(f"分解得到 {len(sub_queries)} 个子问题")
+        merged_into = self._merge_sub_queries(sub_queries)
+        order = self._plan_dag(sub_queries, merged_into, depth)
+        recursive = [self._needs_recursion(sub_query, depth) for sub_query in sub_queries]
+        batch_retrieval = await self._within_deadline(
+            self._prefetch_async(retrieval_func, self._unique_questions(sub_queries, merged_into, recursive)),
+            retrieval_func if callable(retrieval_func) else None, "批量检索"
+        )
         
-        # 2. 并行处理所有子问题
+        # 2. 按DAG调度所有子问题(合并的近似重复子问题只检索和回答一次)
         print("=== 开始并行处理子问题 ===")
-        tasks = []
-        for i, sub_query in enumerate(sub_queries, 1):
-            print(f"创建第{i}个子问题的处理任务: {sub_query['question']}")
-            task = self._process_sub_query_async(sub_query, context, retrieval_func, i)
-            tasks.append(task)
+        unique_pairs, batch_retrieval = await self._within_deadline(
+            self._answer_all_async(sub_queries, merged_into, recursive, context, batch_retrieval,
+                                   inherited_answers, depth),
+            ({}, batch_retrieval), "单次回答全部子问题"
+        )
+        pending = self._pack_candidates(merged_into, recursive, unique_pairs)
+        if pending and batch_retrieval:
+            results = await asyncio.gather(*(
+                self._retrieve_async(sub_queries[index]['question'], batch_retrieval, index + 1) for index in pending
+            ))
+            batch_retrieval = self._hoist_shared_docs(sub_queries, dict(zip(pending, results)), batch_retrieval)
+        elif pending:
+            self._record_hoisted_context(context, len(pending))
+        tasks = {}
         
-        # 等待所有子问题处理完成
-        sub_qa_pairs = await asyncio.gather(*tasks)
+        async def run_node(index: int) -> None:
+            sub_query = sub_queries[index]
+            # 等待依赖的子问题完成(按拓扑顺序创建任务，依赖的任务一定已经存在)
+            if sub_query['depends_on']:
+                await asyncio.wait([tasks[dependency] for dependency in sub_query['depends_on']])
+            if merged_into[index] is not None or index in unique_pairs:
+                return
+            dependency_answers = self._dependency_answers(sub_queries, merged_into, unique_pairs, index, inherited_answers)
+            started_at[index] = time.perf_counter()
+            try:
+                unique_pairs[index] = await asyncio.wait_for(
+                    self._answer_node_async(sub_query, context, retrieval_func, batch_retrieval, depth, index,
+                                            recursive[index], dependency_answers),
+                    timeout=self.sub_query_timeout
+                )
+            except asyncio.TimeoutError:
+                print(f"子问题{index + 1}超时: {sub_query['question'][:50]}")
+                unique_pairs[index] = self._missing_pair(sub_query, depth, index, "timeout",
+                                                         time.perf_counter() - started_at[index])
+                return
+            except Exception as e:
+                print(f"处理子问题{index + 1}时出错: {e}")
+                unique_pairs[index] = self._missing_pair(sub_query, depth, index, "error",
+                                                         time.perf_counter() - started_at[index], str(e))
+                return
+            self._record_outcome(depth, index, sub_query, "answered", time.perf_counter() - started_at[index])
+        
+        started_at: Dict[int, float] = {}
+        for index in order:
+            if merged_into[index] is None and index not in unique_pairs:
+                print(f"创建第{index + 1}个子问题的处理任务: {sub_queries[index]['question']}")
+            tasks[index] = asyncio.ensure_future(run_node(index))
+        
+        # 等待所有子问题处理完成，到达截止时间时取消未完成的子问题；
+        # 本层被取消时同样取消并回收子任务，避免递归分解的子问题在上层超时后继续在后台调用LLM
+        try:
+            _, pending = await asyncio.wait(tasks.values(), timeout=self._remaining_time())
+        finally:
+            await self._cancel_tasks(tasks.values())
+        if pending:
+            print(f"临近截止时间，已取消{len(pending)}个未完成的子问题")
+            for index in order:
+                if merged_into[index] is None and index not in unique_pairs:
+                    elapsed = time.perf_counter() - started_at[index] if index in started_at else None
+                    unique_pairs[index] = self._missing_pair(sub_queries[index], depth, index, "cancelled", elapsed)
+        sub_qa_pairs = self._expand_merged_pairs(sub_queries, merged_into, unique_pairs, depth)
         
         # 3. 汇总所有答案
         print("\n=== 开始汇总答案 ===")
-        final_answer = await self._summarize_answers_async(question, sub_qa_pairs)
+        final_answer = await self._summarize_answers_async(question, self._dedup_sub_answers(sub_qa_pairs))
         print("汇总完成")
         
         return final_answer
 
+    async def _answer_node_async(self, sub_query: Dict[str, Any], context: list[str],
+                                 retrieval_func: Optional[Retriever], batch_retrieval: Optional[Retriever],
+                                 depth: int, index: int, recursive: bool, dependency_answers: str) -> Dict[str, Any]:
+        """回答DAG中的一个子问题：复杂的子问题递归分解，否则检索后回答"""
+        if not recursive:
+            return await self._process_sub_query_async(sub_query, context, batch_retrieval, index + 1,
+                                                       dependency_answers)
+        self.last_run_stats["recursive_decompositions"] += 1
+        sub_answer = await self._solve_async(sub_query['question'], context, retrieval_func, depth + 1,
+                                             dependency_answers)
+        return {
+            'question': sub_query['question'],
+            'focus': sub_query['focus'],
+            'answer': sub_answer,
+            'context_used': 0,
+            'doc_ids': None
+        }
+
+    async def _within_deadline(self, awaitable: Awaitable, fallback: Any, label: str) -> Any:
+        """在截止时间(扣除汇总预留)内等待awaitable，超时时取消它并返回fallback"""
+        try:
+            return await asyncio.wait_for(awaitable, timeout=self._remaining_time())
+        except asyncio.TimeoutError:
+            print(f"临近截止时间，{label}未完成")
+            return fallback
+
+    @staticmethod
+    async def _cancel_tasks(tasks: Iterable[asyncio.Future]):
+        """取消未完成的任务并等待它们结束"""
+        unfinished = [task for task in tasks if not task.done()]
+        for task in unfinished:
+            task.cancel()
+        if unfinished:
+            await asyncio.gather(*unfinished, return_exceptions=True)
+
+    def _remaining_time(self, reserve: Optional[float] = None) -> Optional[float]:
+        """距离截止时间(扣除为汇总预留的时间)还剩的秒数，未设置截止时间时返回None"""
+        if self._deadline_at is None:
+            return None
+        reserve = self.summary_reserve if reserve is None else reserve
+        return max(0.0, self._deadline_at - reserve - time.monotonic())
+
+    def _record_outcome(self, depth: int, index: int, sub_query: Dict[str, Any], outcome: str,
+                        elapsed: Optional[float] = None, error: Optional[str] = None):
+        """记录子问题的处理结果和耗时(answered/timeout/error/cancelled/skipped)"""
+        record = {"depth": depth, "index": index + 1, "question": sub_query['question'],
+                  "outcome": outcome, "elapsed": elapsed}
+        if error is not None:
+            record["error"] = error
+        self.last_run_stats["sub_query_outcomes"].append(record)
+        if outcome != "answered":
+            self.last_run_stats["complete"] = False
+
+    def _missing_pair(self, sub_query: Dict[str, Any], depth: int, index: int, outcome: str,
+                      elapsed: Optional[float] = None, error: Optional[str] = None) -> Dict[str, Any]:
+        """记录未能回答的子问题，返回标记了missing的结果，汇总时作为未能回答的方面说明"""
+        self._record_outcome(depth, index, sub_query, outcome, elapsed, error)
+        return {
+            'question': sub_query['question'],
+            'focus': sub_query['focus'],
+            'answer': f"未能得到回答({_MISSING_OUTCOME_LABELS[outcome]})",
+            'context_used': 0,
+            'doc_ids': None,
+            'missing': outcome
+        }
+
+    def _start_run(self, question: str, context: list[str]) -> bool:
+        """
+        初始化一次运行：重置统计信息，语料变化时使缓存的子答案失效，并判断问题是否需要分解
+        
+        未设置路由器时总是分解；设置时按路由结果决定，并记录判断及其置信度。
+        """
+        self.last_run_stats = {
+            "route": None,
+            "decomposed": True,
+            "plan_cache_hit": False,
+            "answer_cache_hits": 0,
+            "merged_sub_queries": 0,
+            "recursive_decompositions": 0,
+            "dag_fallback": False,
+            "multi_answer_calls": 0,
+            "multi_answer_sub_queries": 0,
+            "multi_answer_fallbacks": 0,
+            "context_packing": {"prompt_context_tokens": 0, "unique_context_tokens": 0,
+                                "hoisted_prefix_tokens": 0, "saved_prompt_tokens": 0},
+            "sub_query_outcomes": [],
+            "complete": True,
+            "timing": self._empty_timing()
+        }
+        self._sent_doc_ids = set()
+        self._deadline_at = time.monotonic() + self.deadline if self.deadline is not None else None
+        if self.cache is not None:
+            self.cache.check_corpus(context)
+        if self.router is None:
+            return True
+        decision = self.router.route(question)
+        self.last_run_stats.update(route=decision, decomposed=decision["decompose"])
+        if not decision["decompose"]:
+            print(f"=== 问题无需分解(置信度{decision['confidence']:.2f})，直接回答 ===")
+        return decision["decompose"]
+
+    @staticmethod
+    def _empty_timing() -> Dict[str, Any]:
+        """检索与LLM调用耗时的统计项"""
+        return {"retrieval_seconds": 0.0, "retrieval_calls": 0, "batched_retrieval": False,
+                "llm_seconds": 0.0, "llm_calls": 0}
+
     def _decompose_query(self, question: str) -> List[Dict[str, Any]]:
         """分解问题为子问题"""
+        cached = self._get_cached_plan(question)
+        if cached is not None:
+            return cached
         messages = self.create_messages(
             user_content=QUERY_DECOMPOSITION_PROMPT.format(query=question)
         )
         
-        response = self.call_llm_sync(messages)
-        return self._parse_decomposition_result(response)
+        response = self._call_llm_timed(messages)
+        return self._parse_decomposition_result(response, question)
 
     async def _decompose_query_async(self, question: str) -> List[Dict[str, Any]]:
         """异步分解问题为子问题"""
+        cached = self._get_cached_plan(question)
+        if cached is not None:
+            return cached
         messages = self.create_messages(
             user_content=QUERY_DECOMPOSITION_PROMPT.format(query=question)
         )
         
-        response = await self.call_llm_async(messages)
-        return self._parse_decomposition_result(response)
+        response = await self._call_llm_timed_async(messages)
+        return self._parse_decomposition_result(response, question)
+
+    def _get_cached_plan(self, question: str) -> Optional[List[Dict[str, Any]]]:
+        """查找近似重复问题的分解计划"""
+        if self.cache is None:
+            return None
+        sub_queries = self.cache.get_plan(question)
+        if sub_queries is not None:
+            print("命中分解计划缓存，跳过分解调用")
+            self.last_run_stats["plan_cache_hit"] = True
+        return sub_queries
+
+    def _parse_decomposition_result(self, response: str, question: str) -> List[Dict[str, Any]]:
+        """解析分解结果，解析失败或没有有效子问题时以原问题作为单个子问题(解析失败的结果不写入缓存)"""
+        result = extract_json(response)
+        sub_queries = self._valid_sub_queries(result.get('sub_queries') if isinstance(result, dict) else None)
+        if sub_queries:
+            if self.cache is not None:
+                self.cache.put_plan(question, sub_queries)
+            return sub_queries
+        print("解析分解结果失败，使用原问题作为单个子问题")
+        return self._fallback_plan(question)
+
+    @staticmethod
+    def _valid_sub_queries(sub_queries: Any) -> List[Dict[str, Any]]:
+        """校验并规范化模型输出的子问题列表，格式不正确时返回空列表"""
+        if not isinstance(sub_queries, list):
+            return []
+        return [
+            {
+                'id': sub_query.get('id', i),
+                'question': sub_query['question'],
+                'focus': sub_query.get('focus', ''),
+                'depends_on': sub_query.get('depends_on') if isinstance(sub_query.get('depends_on'), list) else [],
+                'complex': sub_query.get('complex') is True
+            }
+            for i, sub_query in enumerate(sub_queries, 1)
+            if isinstance(sub_query, dict) and isinstance(sub_query.get('question'), str)
+        ]
+
+    @staticmethod
+    def _fallback_plan(question: str) -> List[Dict[str, Any]]:
+        """分解失败时以原问题作为单个子问题"""
+        return [{'id': 1, 'question': question, 'focus': '完整回答', 'depends_on': [], 'complex': False}]
+
+    def decompose_many(self, questions: List[str], token_budget: int = DECOMPOSE_BATCH_TOKEN_BUDGET,
+                       max_batch_size: int = DECOMPOSE_BATCH_MAX_QUESTIONS) -> List[List[Dict[str, Any]]]:
+        """
+        批量分解多个问题：把若干问题打包进一次结构化的分解调用，适用于离线批量处理大量问题
+        
+        归一化后相同的问题只分解一次，命中分解计划缓存的问题不再调用；输出不完整(如被截断)时逐个问题
+        取出能解析的分解计划，只重试失败的部分，且每轮重试的批次大小减半，
+        重试DECOMPOSE_BATCH_MAX_RETRIES轮后仍失败的问题以原问题作为单个子问题。
+        设置了缓存时分解计划会写入缓存，之后run这些问题时直接复用。
+        
+        Args:
+            questions: 问题列表
+            token_budget: 每次调用中问题文本的token数上限
+            max_batch_size: 每次调用最多包含的问题数
+        
+        Returns:
+            List[List[Dict[str, Any]]]: 与questions一一对应的子问题列表
+        """
+        plans, pending = self._start_decompose_many(questions)
+        for round_index in range(DECOMPOSE_BATCH_MAX_RETRIES + 1):
+            if not pending:
+                break
+            failed = []
+            for batch in self._start_decompose_round(pending, round_index, token_budget, max_batch_size):
+                try:
+                    response = self._call_llm_timed(self._batch_decomposition_messages(batch))
+                except Exception as e:
+                    print(f"批量分解调用失败({len(batch)}个问题): {e}")
+                    failed.extend(batch)
+                    continue
+                failed.extend(self._parse_batch_decomposition(response, batch, plans))
+            pending = failed
+        return self._finish_decompose_many(questions, plans, pending)
+
+    async def decompose_many_async(self, questions: List[str], token_budget: int = DECOMPOSE_BATCH_TOKEN_BUDGET,
+                                   max_batch_size: int = DECOMPOSE_BATCH_MAX_QUESTIONS) -> List[List[Dict[str, Any]]]:
+        """异步版本的decompose_many，同一轮的各批次并行调用，并发数受max_concurrency限制"""
+        self._llm_semaphore = asyncio.Semaphore(self.max_concurrency)
+        plans, pending = self._start_decompose_many(questions)
+        for round_index in range(DECOMPOSE_BATCH_MAX_RETRIES + 1):
+            if not pending:
+                break
+            batches = self._start_decompose_round(pending, round_index, token_budget, max_batch_size)
+            responses = await asyncio.gather(
+                *(self._call_llm_timed_async(self._batch_decomposition_messages(batch)) for batch in batches),
+                return_exceptions=True
+            )
+            failed = []
+            for batch, response in zip(batches, responses):
+                if isinstance(response, Exception):
+                    print(f"批量分解调用失败({len(batch)}个问题): {response}")
+                    failed.extend(batch)
+                    continue
+                failed.extend(self._parse_batch_decomposition(response, batch, plans))
+            pending = failed
+        return self._finish_decompose_many(questions, plans, pending)
+
+    def _start_decompose_many(self, questions: List[str]):
+        """
+        初始化批量分解：重置统计信息，去除重复问题并取出缓存的分解计划
+        
+        Returns:
+            tuple: (归一化问题→子问题列表的字典, 需要调用LLM分解的问题列表)
+        """
+        self.last_run_stats = {
+            "questions": len(questions),
+            "unique_questions": 0,
+            "plan_cache_hits": 0,
+            "planning_calls": 0,
+            "planned_questions": 0,
+            "retried_questions": 0,
+            "failed_questions": 0,
+            "instruction_tokens_saved": 0,
+            "timing": self._empty_timing()
+        }
+        plans: Dict[str, List[Dict[str, Any]]] = {}
+        pending, seen = [], set()
+        for question in questions:
+            key = normalize_text(question)
+            if key in seen:
+                continue
+            seen.add(key)
+            cached = self.cache.get_plan(question) if self.cache is not None else None
+            if cached is not None:
+                plans[key] = cached
+                self.last_run_stats["plan_cache_hits"] += 1
+            else:
+                pending.append(question)
+        self.last_run_stats["unique_questions"] = len(seen)
+        print(f"批量分解{len(questions)}个问题：去重后{len(seen)}个，命中缓存{len(seen) - len(pending)}个")
+        return plans, pending
+
+    def _start_decompose_round(self, pending: List[str], round_index: int, token_budget: int,
+                               max_batch_size: int) -> List[List[str]]:
+        """
+        开始一轮批量分解(第0轮为首次分解，之后为重试)并装批
+        
+        每次重试把token预算和批次问题数减半，降低再次输出过长被截断或格式出错的概率，最小为单个问题一批。
+        """
+        scale = 2 ** round_index
+        if round_index:
+            print(f"第{round_index}次重试：{len(pending)}个问题的分解结果解析失败，批次大小减为1/{scale}")
+            self.last_run_stats["retried_questions"] += len(pending)
+        return self._pack_questions(pending, max(1, token_budget // scale), max(1, max_batch_size // scale))
+
+    @staticmethod
+    def _pack_questions(questions: List[str], token_budget: int, max_batch_size: int) -> List[List[str]]:
+        """按token预算和数量上限把问题依次装入批次，单个超出预算的问题单独成批"""
+        batches, batch, batch_tokens = [], [], 0
+        for question in questions:
+            tokens = estimate_tokens(question)
+            if batch and (batch_tokens + tokens > token_budget or len(batch) >= max_batch_size):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(question)
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _batch_decomposition_messages(self, batch: List[str]) -> List[Dict[str, str]]:
+        """构造一次分解多个问题的消息，并记录本次调用"""
+        self.last_run_stats["planning_calls"] += 1
+        self.last_run_stats["planned_questions"] += len(batch)
+        questions_text = "\n".join(f"问题{i}: {question}" for i, question in enumerate(batch, 1))
+        return self.create_messages(user_content=BATCH_DECOMPOSITION_PROMPT.format(questions=questions_text))
+
+    def _parse_batch_decomposition(self, response: str, batch: List[str],
+                                   plans: Dict[str, List[Dict[str, Any]]]) -> List[str]:
+        """
+        解析一次批量分解的结果，有效的分解计划写入plans(及缓存)
+        
+        Returns:
+            List[str]: 分解结果缺失或格式不正确的问题
+        """
+        result = extract_json(response)
+        batch_plans = result.get('plans') if isinstance(result, dict) else None
+        if isinstance(batch_plans, list):
+            batch_plans = {str(i): plan for i, plan in enumerate(batch_plans, 1)}
+        if not isinstance(batch_plans, dict):
+            batch_plans = self._salvage_batch_plans(response or "")
+            if batch_plans:
+                print(f"批量分解结果不是完整的JSON，取出了{len(batch_plans)}个问题的分解计划")
+        failed = []
+        for i, question in enumerate(batch, 1):
+            plan = batch_plans.get(str(i))
+            sub_queries = self._valid_sub_queries(plan.get('sub_queries') if isinstance(plan, dict) else plan)
+            if not sub_queries:
+                failed.append(question)
+                continue
+            plans[normalize_text(question)] = sub_queries
+            if self.cache is not None:
+                self.cache.put_plan(question, sub_queries)
+        return failed
 
-    def _parse_decomposition_result(self, response: str) -> List[Dict[str, Any]]:
-        """解析分解结果"""
+    @staticmethod
+    def _salvage_batch_plans(response: str) -> Dict[str, Any]:
+        """从格式错误或被截断的批量分解结果中逐个解析按编号组织的分解计划，只保留能完整解析的部分"""
+        decoder = json.JSONDecoder()
+        batch_plans = {}
+        for match in _PLAN_KEY_PATTERN.finditer(response):
+            if match.group(1) in batch_plans:
+                continue
+            try:
+                plan, _ = decoder.raw_decode(response, match.end())
+            except json.JSONDecodeError:
+                continue
+            batch_plans[match.group(1)] = plan
+        return batch_plans
+
+    def _finish_decompose_many(self, questions: List[str], plans: Dict[str, List[Dict[str, Any]]],
+                               failed: List[str]) -> List[List[Dict[str, Any]]]:
+        """仍然失败的问题以原问题作为单个子问题，统计省下的指令token数，并按原始顺序返回各问题的子问题列表"""
+        if failed:
+            print(f"{len(failed)}个问题分解失败，使用原问题作为单个子问题")
+        for question in failed:
+            plans[normalize_text(question)] = self._fallback_plan(question)
+        stats = self.last_run_stats
+        stats["failed_questions"] = len(failed)
+        # 逐个分解时每个问题都要携带一份完整的分解指令
+        single_instruction_tokens = estimate_tokens(QUERY_DECOMPOSITION_PROMPT.format(query=""))
+        batch_instruction_tokens = estimate_tokens(BATCH_DECOMPOSITION_PROMPT.format(questions=""))
+        stats["instruction_tokens_saved"] = (single_instruction_tokens * stats["planned_questions"]
+                                             - batch_instruction_tokens * stats["planning_calls"])
+        print(f"批量分解完成：{stats['planning_calls']}次调用分解了{stats['planned_questions']}个问题")
+        # 返回副本，重复的问题不共用同一组子问题对象(执行时会原地修改depends_on)
+        return [[dict(sub_query) for sub_query in plans[normalize_text(question)]] for question in questions]
+
+    def _resolve_context(self, question: str, context: list[str], retrieval_func: Optional[Retriever], index: int):
+        """
+        为问题确定回答使用的上下文：有检索函数时使用检索结果，否则(或检索为空时)使用默认上下文
+        
+        Returns:
+            tuple: (上下文文本, 使用的上下文条数, 检索到的文档id列表(未使用检索结果时为None))
+        """
+        return self._context_from(self._retrieve(question, retrieval_func, index), context)
+
+    async def _resolve_context_async(self, question: str, context: list[str],
+                                     retrieval_func: Optional[Retriever], index: int):
+        """异步版本的_resolve_context，检索函数可以是同步或异步的"""
+        return self._context_from(await self._retrieve_async(question, retrieval_func, index), context)
+
+    def _retrieve(self, question: str, retrieval_func: Optional[Retriever], index: int) -> Optional[List[str]]:
+        """检索问题的相关文档，没有检索函数时返回None"""
+        if not retrieval_func:
+            print(f"  使用默认上下文")
+            return None
+        print(f"  正在为子问题{index}检索相关上下文...")
+        start_time = time.perf_counter()
+        docs = retrieval_func(question)
+        self._record_retrieval(retrieval_func, start_time)
+        return docs or []
+
+    async def _retrieve_async(self, question: str, retrieval_func: Optional[Retriever],
+                              index: int) -> Optional[List[str]]:
+        """异步版本的_retrieve，检索函数可以是同步或异步的"""
+        if not retrieval_func:
+            return None
+        print(f"  正在为子问题{index}检索相关上下文...")
+        start_time = time.perf_counter()
+        docs = retrieval_func(question)
+        if inspect.isawaitable(docs):
+            docs = await docs
+        self._record_retrieval(retrieval_func, start_time)
+        return docs or []
+
+    def _context_from(self, docs: Optional[List[str]], context: list[str]):
+        """检索结果非空时使用检索结果，否则使用默认上下文"""
+        if docs:
+            print(f"  检索到 {len(docs)} 条相关信息")
+            self._track_context(docs)
+            return "\n".join(docs), len(docs), [text_hash(doc) for doc in docs]
+        if docs is not None:
+            print(f"  未检索到相关信息，使用默认上下文")
+        self._track_context(context)
+        return "\n".join(context), len(context), None
+
+    def _track_context(self, docs: List[str]):
+        """按文档id记录放入prompt的上下文，统计总token数及其中不重复文档的token数"""
+        packing = self.last_run_stats["context_packing"]
+        for doc in docs:
+            tokens = estimate_tokens(doc)
+            packing["prompt_context_tokens"] += tokens
+            doc_id = text_hash(doc)
+            if doc_id not in self._sent_doc_ids:
+                self._sent_doc_ids.add(doc_id)
+                packing["unique_context_tokens"] += tokens
+
+    def _prefetch(self, retrieval_func: Optional[Retriever], queries: List[str]) -> Optional[Retriever]:
+        """
+        检索器实现了retrieve_many时一次检索所有查询，返回按查询取结果的检索函数；否则原样返回，逐个查询检索
+        
+        批量检索失败且检索器本身可按单个查询调用时，回退为逐个查询检索。
+        """
+        if not isinstance(retrieval_func, BatchRetriever):
+            return retrieval_func
+        start_time = time.perf_counter()
         try:
-            # 提取JSON部分
-            start_idx = response.find('{')
-            end_idx = response.rfind('}') + 1
-            if start_idx != -1 and end_idx > start_idx:
-                json_str = response[start_idx:end_idx]
-                result = json.loads(json_str)
-                return result.get('sub_queries', [])
+            results = retrieval_func.retrieve_many(queries, self.retrieval_top_k)
+            if inspect.isawaitable(results):
+                if hasattr(results, "close"):
+                    results.close()
+                raise TypeError("同步执行需要同步的retrieve_many，异步检索器请使用run_async")
         except Exception as e:
-            print(f"解析分解结果时出错: {e}")
-            # 如果解析失败，返回原问题作为单个子问题
-            return [{'id': 1, 'question': '原问题', 'focus': '完整回答'}]
+            return self._fallback_retrieval(retrieval_func, e)
+        return self._prefetched(queries, results, start_time)
+
+    async def _prefetch_async(self, retrieval_func: Optional[Retriever], queries: List[str]) -> Optional[Retriever]:
+        """异步版本的_prefetch，retrieve_many可以是同步或异步的"""
+        if not isinstance(retrieval_func, BatchRetriever):
+            return retrieval_func
+        start_time = time.perf_counter()
+        try:
+            results = retrieval_func.retrieve_many(queries, self.retrieval_top_k)
+            if inspect.isawaitable(results):
+                results = await results
+        except Exception as e:
+            return self._fallback_retrieval(retrieval_func, e)
+        return self._prefetched(queries, results, start_time)
+
+    def _prefetched(self, queries: List[str], results: List[List[str]], start_time: float) -> _PrefetchedRetrieval:
+        """记录一次批量检索并包装其结果"""
+        elapsed = time.perf_counter() - start_time
+        timing = self.last_run_stats["timing"]
+        timing["retrieval_seconds"] += elapsed
+        timing["retrieval_calls"] += 1
+        timing["batched_retrieval"] = True
+        print(f"批量检索完成：{len(queries)}个查询，用时{elapsed:.3f}秒")
+        return _PrefetchedRetrieval(queries, results)
+
+    def _fallback_retrieval(self, retrieval_func: BatchRetriever, error: Exception) -> Retriever:
+        """批量检索失败时回退为逐个查询检索"""
+        if not callable(retrieval_func):
+            raise error
+        print(f"批量检索失败，改为逐个查询检索: {error}")
+        return retrieval_func
+
+    def _record_retrieval(self, retrieval_func: Retriever, start_time: float):
+        """记录一次逐个查询的检索耗时(批量检索的结果已在批量调用时计时)"""
+        if isinstance(retrieval_func, _PrefetchedRetrieval):
+            return
+        timing = self.last_run_stats["timing"]
+        timing["retrieval_seconds"] += time.perf_counter() - start_time
+        timing["retrieval_calls"] += 1
+
+    def _call_llm_timed(self, messages: List[Dict[str, str]]) -> str:
+        """同步调用LLM并累计LLM耗时"""
+        start_time = time.perf_counter()
+        try:
+            return self.call_llm_sync(messages)
+        finally:
+            self.last_run_stats["timing"]["llm_seconds"] += time.perf_counter() - start_time
+            self.last_run_stats["timing"]["llm_calls"] += 1
+
+    async def _call_llm_timed_async(self, messages: List[Dict[str, str]]) -> str:
+        """异步调用LLM并累计LLM耗时(并行调用的耗时累加，可能超过总耗时)，并发数受max_concurrency限制"""
+        if self._llm_semaphore is None:
+            self._llm_semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self._llm_semaphore:
+            start_time = time.perf_counter()
+            try:
+                return await self.call_llm_async(messages)
+            finally:
+                self.last_run_stats["timing"]["llm_seconds"] += time.perf_counter() - start_time
+                self.last_run_stats["timing"]["llm_calls"] += 1
+
+
+    @staticmethod
+    def _unique_questions(sub_queries: List[Dict[str, Any]], merged_into: List[Optional[int]],
+                          recursive: List[bool]) -> List[str]:
+        """未被合并、也不再递归分解的子问题，即本层需要实际检索的查询"""
+        return [sub_query['question'] for sub_query, target, nested in zip(sub_queries, merged_into, recursive)
+                if target is None and not nested]
+
+    def _plan_dag(self, sub_queries: List[Dict[str, Any]], merged_into: List[Optional[int]], depth: int) -> List[int]:
+        """
+        将depends_on中的子问题id转换为下标，并给出拓扑顺序
+        
+        被合并的子问题只依赖所并入的子问题；未知的id和自身依赖被忽略。
+        存在环时放弃所有依赖关系，退化为全部并行(同步执行时按原始顺序)。
+        
+        Args:
+            sub_queries: 子问题列表，depends_on会被原地替换为下标列表
+            merged_into: 子问题合并结果
+            depth: 当前分解层数
+            
+        Returns:
+            List[int]: 子问题下标的拓扑顺序
+        """
+        index_of = {sub_query['id']: i for i, sub_query in enumerate(sub_queries)}
+        for i, sub_query in enumerate(sub_queries):
+            if merged_into[i] is not None:
+                sub_query['depends_on'] = [merged_into[i]]
+                continue
+            dependencies = []
+            for dependency_id in sub_query.get('depends_on', []):
+                dependency = index_of.get(dependency_id)
+                if dependency is not None and dependency != i and dependency not in dependencies:
+                    dependencies.append(dependency)
+            sub_query['depends_on'] = dependencies
+        
+        order = self._topological_order(sub_queries)
+        if order is None:
+            print("子问题的依赖关系存在环，忽略依赖关系并行处理")
+            self.last_run_stats["dag_fallback"] = True
+            for i, sub_query in enumerate(sub_queries):
+                sub_query['depends_on'] = [merged_into[i]] if merged_into[i] is not None else []
+            order = list(range(len(sub_queries)))
+        if depth == 1:
+            self.last_run_stats["sub_queries"] = len(sub_queries)
+            self.last_run_stats["dependency_edges"] = sum(
+                len(sub_query['depends_on']) for i, sub_query in enumerate(sub_queries) if merged_into[i] is None
+            )
+        return order
+
+    @staticmethod
+    def _topological_order(sub_queries: List[Dict[str, Any]]) -> Optional[List[int]]:
+        """Kahn算法求拓扑顺序(同一层内保持原始顺序)，存在环时返回None"""
+        remaining = [len(sub_query['depends_on']) for sub_query in sub_queries]
+        dependents: Dict[int, List[int]] = {i: [] for i in range(len(sub_queries))}
+        for i, sub_query in enumerate(sub_queries):
+            for dependency in sub_query['depends_on']:
+                dependents[dependency].append(i)
+        ready = [i for i, count in enumerate(remaining) if count == 0]
+        order = []
+        while ready:
+            current = ready.pop(0)
+            order.append(current)
+            for dependent in dependents[current]:
+                remaining[dependent] -= 1
+                if remaining[dependent] == 0:
+                    ready.append(dependent)
+        return order if len(order) == len(sub_queries) else None
+
+    def _needs_recursion(self, sub_query: Dict[str, Any], depth: int) -> bool:
+        """子问题被标记为complex(或路由器判断需要分解)且未达到最大层数时继续分解"""
+        if depth >= self.max_depth:
+            return False
+        if sub_query.get('complex') is True:
+            return True
+        return self.router is not None and self.router.predict_proba(sub_query['question']) >= self.router.threshold
+
+    @staticmethod
+    def _dependency_answers(sub_queries: List[Dict[str, Any]], merged_into: List[Optional[int]],
+                            unique_pairs: Dict[int, Dict[str, Any]], index: int, inherited_answers: str) -> str:
+        """格式化子问题所依赖的子问题的回答(连同上层传下来的回答)"""
+        parts = [inherited_answers] if inherited_answers else []
+        for dependency in sub_queries[index]['depends_on']:
+            target = merged_into[dependency] if merged_into[dependency] is not None else dependency
+            pair = unique_pairs.get(target)
+            if pair is not None and 'missing' not in pair:
+                parts.append(f"子问题: {sub_queries[dependency]['question']}\n回答: {pair['answer']}")
+        return "\n\n".join(parts)
+
+    @staticmethod
+    def _with_dependencies(context_str: str, dependency_answers: str) -> str:
+        """有前置子问题的回答时，将其与检索到的文档一起作为上下文"""
+        if not dependency_answers:
+            return context_str
+        return DEPENDENCY_CONTEXT_TEMPLATE.format(dependency_answers=dependency_answers, context=context_str)
+
+    def _answer_all(self, sub_queries: List[Dict[str, Any]], merged_into: List[Optional[int]], recursive: List[bool],
+                    context: list[str], retrieval_func: Optional[Retriever], inherited_answers: str, depth: int):
+        """
+        multi_answer模式下一次调用回答本层所有子问题
+        
+        本层有需要递归分解的子问题，或去重后的上下文超出预算时不使用；
+        模型漏答或结果解析失败的子问题留给逐个回答的流程处理，已检索的结果不会重复检索。
+        
+        Returns:
+            tuple: (子问题下标→结果的字典, 之后逐个回答子问题时使用的检索函数)
+        """
+        indices = self._multi_answer_candidates(merged_into, recursive, retrieval_func)
+        if not indices:
+            return {}, retrieval_func
+        retrieved = {index: self._retrieve(sub_queries[index]['question'], retrieval_func, index + 1)
+                     for index in indices}
+        retrieval_func = self._reuse_retrieved(sub_queries, retrieved, retrieval_func)
+        messages = self._multi_answer_messages(sub_queries, indices, retrieved, context, inherited_answers)
+        if messages is None:
+            return {}, retrieval_func
+        started_at = time.perf_counter()
+        response = self._call_llm_timed(messages)
+        pairs = self._parse_multi_answers(response, sub_queries, indices, retrieved, context)
+        self._record_multi_answer_outcomes(sub_queries, pairs, depth, time.perf_counter() - started_at)
+        return pairs, retrieval_func
+
+    async def _answer_all_async(self, sub_queries: List[Dict[str, Any]], merged_into: List[Optional[int]],
+                                recursive: List[bool], context: list[str], retrieval_func: Optional[Retriever],
+                                inherited_answers: str, depth: int):
+        """异步版本的_answer_all，各子问题的检索并行进行"""
+        indices = self._multi_answer_candidates(merged_into, recursive, retrieval_func)
+        if not indices:
+            return {}, retrieval_func
+        results = await asyncio.gather(*(
+            self._retrieve_async(sub_queries[index]['question'], retrieval_func, index + 1) for index in indices
+        ))
+        retrieved = dict(zip(indices, results))
+        retrieval_func = self._reuse_retrieved(sub_queries, retrieved, retrieval_func)
+        messages = self._multi_answer_messages(sub_queries, indices, retrieved, context, inherited_answers)
+        if messages is None:
+            return {}, retrieval_func
+        started_at = time.perf_counter()
+        response = await self._call_llm_timed_async(messages)
+        pairs = self._parse_multi_answers(response, sub_queries, indices, retrieved, context)
+        self._record_multi_answer_outcomes(sub_queries, pairs, depth, time.perf_counter() - started_at)
+        return pairs, retrieval_func
+
+    def _record_multi_answer_outcomes(self, sub_queries: List[Dict[str, Any]], pairs: Dict[int, Dict[str, Any]],
+                                      depth: int, elapsed: float):
+        """单次调用回答的子问题共用这次调用的耗时"""
+        for index in pairs:
+            self._record_outcome(depth, index, sub_queries[index], "answered", elapsed)
+
+    def _multi_answer_candidates(self, merged_into: List[Optional[int]], recursive: List[bool],
+                                 retrieval_func: Optional[Retriever]) -> List[int]:
+        """
+        可以一次回答的子问题下标：少于2个子问题或存在需要递归分解的子问题时为空
+        
+        开启multi_answer时总是尝试；开启pack_context且没有检索函数时(各子问题的上下文完全相同)也尝试。
+        """
+        if not (self.multi_answer or (self.pack_context and not retrieval_func)):
+            return []
+        indices = [i for i, target in enumerate(merged_into) if target is None]
+        if len(indices) < 2 or any(recursive[i] for i in indices):
+            return []
+        return indices
+
+    @staticmethod
+    def _reuse_retrieved(sub_queries: List[Dict[str, Any]], retrieved: Dict[int, Optional[List[str]]],
+                         retrieval_func: Optional[Retriever]) -> Optional[Retriever]:
+        """将已检索的结果包装为检索函数，逐个回答子问题时不再重复检索"""
+        if not retrieval_func:
+            return retrieval_func
+        indices = list(retrieved)
+        return _PrefetchedRetrieval([sub_queries[i]['question'] for i in indices], [retrieved[i] for i in indices])
+
+    def _multi_answer_messages(self, sub_queries: List[Dict[str, Any]], indices: List[int],
+                               retrieved: Dict[int, Optional[List[str]]], context: list[str],
+                               inherited_answers: str) -> Optional[List[Dict[str, str]]]:
+        """
+        构造一次回答所有子问题的消息：各子问题的上下文按内容去重后合并
+        
+        Returns:
+            Optional[List[Dict[str, str]]]: 消息列表，去重后的上下文超出预算时返回None
+        """
+        docs, seen, naive_tokens = [], set(), 0
+        for index in indices:
+            for doc in retrieved[index] or context:
+                naive_tokens += estimate_tokens(doc)
+                if doc not in seen:
+                    seen.add(doc)
+                    docs.append(doc)
+        context_str = self._with_dependencies("\n".join(docs), inherited_answers)
+        
+        lines = []
+        for index in indices:
+            sub_query = sub_queries[index]
+            line = f"{index + 1}. {sub_query['question']}"
+            if sub_query['focus']:
+                line += f" (关注点: {sub_query['focus']})"
+            if sub_query['depends_on']:
+                line += f" (依赖子问题{'、'.join(str(dependency + 1) for dependency in sub_query['depends_on'])}的回答)"
+            lines.append(line)
+        sub_queries_text = "\n".join(lines)
+        
+        context_tokens = estimate_tokens(context_str)
+        if (context_tokens > MULTI_ANSWER_MAX_CONTEXT_TOKENS
+                or not self.fits_single_call(MULTI_ANSWER_PROMPT, sub_queries_text, context_str)):
+            print(f"去重后的上下文约{context_tokens} tokens，超出单次回答的预算，逐个回答子问题")
+            return None
+        print(f"一次调用回答{len(indices)}个子问题(去重后{len(docs)}条上下文，约{context_tokens} tokens)")
+        self._track_context(docs)
+        self.last_run_stats["context_packing"]["saved_prompt_tokens"] += naive_tokens - estimate_tokens_many(docs)
+        return self.create_messages(
+            user_content=MULTI_ANSWER_PROMPT.format(context=context_str, sub_queries=sub_queries_text)
+        )
+
+    def _parse_multi_answers(self, response: str, sub_queries: List[Dict[str, Any]], indices: List[int],
+                             retrieved: Dict[int, Optional[List[str]]], context: list[str]) -> Dict[int, Dict[str, Any]]:
+        """解析一次回答所有子问题的结果，返回得到有效回答的子问题(下标→结果)"""
+        result = extract_json(response)
+        answers = result.get('answers') if isinstance(result, dict) else None
+        if not isinstance(answers, dict):
+            answers = {}
+        pairs = {}
+        for index in indices:
+            answer = answers.get(str(index + 1))
+            if not isinstance(answer, str) or not answer.strip():
+                continue
+            docs = retrieved[index]
+            pairs[index] = {
+                'question': sub_queries[index]['question'],
+                'focus': sub_queries[index]['focus'],
+                'answer': answer,
+                'context_used': len(docs) if docs else len(context),
+                'doc_ids': [text_hash(doc) for doc in docs] if docs else None
+            }
+        missing = len(indices) - len(pairs)
+        if missing:
+            print(f"{missing}个子问题未在单次调用中得到有效回答，改为逐个回答")
+        self.last_run_stats["multi_answer_calls"] += 1
+        self.last_run_stats["multi_answer_sub_queries"] += len(pairs)
+        self.last_run_stats["multi_answer_fallbacks"] += missing
+        return pairs
+
+    def _pack_candidates(self, merged_into: List[Optional[int]], recursive: List[bool],
+                         unique_pairs: Dict[int, Dict[str, Any]]) -> List[int]:
+        """开启pack_context时需要逐个回答的子问题下标(至少2个时才有共享上下文可提取)"""
+        if not self.pack_context:
+            return []
+        pending = [i for i, target in enumerate(merged_into)
+                   if target is None and not recursive[i] and i not in unique_pairs]
+        return pending if len(pending) >= 2 else []
+
+    def _hoist_shared_docs(self, sub_queries: List[Dict[str, Any]], retrieved: Dict[int, Optional[List[str]]],
+                           retrieval_func: Retriever) -> _PrefetchedRetrieval:
+        """
+        把被多个子问题共享的文档提到各自上下文的最前面
+        
+        文档按被共享的子问题数降序、首次出现的顺序排列，共享同一批文档的子问题的prompt前缀完全相同，
+        可以命中模型服务的前缀缓存；每个prompt与之前的prompt相同的文档前缀计入hoisted_prefix_tokens。
+        """
+        counts: Dict[str, int] = {}
+        first_seen: Dict[str, int] = {}
+        for docs in retrieved.values():
+            for doc in dict.fromkeys(docs or []):
+                counts[doc] = counts.get(doc, 0) + 1
+                first_seen.setdefault(doc, len(first_seen))
+        
+        packed, hoisted_tokens = {}, 0
+        for index, docs in retrieved.items():
+            if docs:
+                docs = sorted(dict.fromkeys(docs), key=lambda doc: (-counts[doc], first_seen[doc]))
+                common = max((self._common_prefix(docs, previous) for previous in packed.values() if previous), default=0)
+                hoisted_tokens += estimate_tokens_many(docs[:common])
+            packed[index] = docs
+        if hoisted_tokens:
+            print(f"共享文档已提到上下文最前面，约{hoisted_tokens} tokens可复用相同的prompt前缀")
+        self.last_run_stats["context_packing"]["hoisted_prefix_tokens"] += hoisted_tokens
+        return self._reuse_retrieved(sub_queries, packed, retrieval_func)
+
+    def _record_hoisted_context(self, context: list[str], prompt_count: int):
+        """没有检索函数时各子问题使用相同的默认上下文，除第一个prompt外都可以复用其前缀"""
+        self.last_run_stats["context_packing"]["hoisted_prefix_tokens"] += \
+            estimate_tokens_many(context) * (prompt_count - 1)
+
+    @staticmethod
+    def _common_prefix(a: List[str], b: List[str]) -> int:
+        length = 0
+        for x, y in zip(a, b):
+            if x != y:
+                break
+            length += 1
+        return length
+
+    def _dedup_sub_answers(self, sub_qa_pairs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        开启pack_context时，汇总前去除子答案中与前面子答案近似重复的句子
+        
+        被合并的子问题和过短的句子不参与去重；某个子答案的句子全部重复时，改为指向前面的回答。
+        
+        Returns:
+            List[Dict[str, Any]]: 去重后的子问题结果(不修改传入的结果)
+        """
+        if not self.pack_context:
+            return sub_qa_pairs
+        kept_sentences: List[str] = []
+        deduped, removed_tokens = [], 0
+        for qa in sub_qa_pairs:
+            if 'merged_into' in qa:
+                deduped.append(qa)
+                continue
+            sentences = [sentence for sentence in _SENTENCE_SPLIT_PATTERN.split(qa['answer']) if sentence.strip()]
+            kept, new_sentences = [], []
+            for sentence in sentences:
+                normalized = normalize_text(sentence)
+                if len(normalized) >= SUMMARY_SENTENCE_MIN_CHARS and any(
+                    text_similarity(normalized, previous) >= SUMMARY_SENTENCE_DEDUP_THRESHOLD
+                    for previous in kept_sentences
+                ):
+                    removed_tokens += estimate_tokens(sentence)
+                    continue
+                kept.append(sentence)
+                if len(normalized) >= SUMMARY_SENTENCE_MIN_CHARS:
+                    new_sentences.append(normalized)
+            kept_sentences.extend(new_sentences)
+            answer = "".join(kept).strip() if kept else "该子问题的回答已包含在前面子问题的回答中"
+            deduped.append({**qa, 'answer': answer})
+        if removed_tokens:
+            print(f"汇总前去除了子答案间重复的句子，约{removed_tokens} tokens")
+        self.last_run_stats["context_packing"]["saved_prompt_tokens"] += removed_tokens
+        return deduped
 
     def _answer_sub_query(self, sub_question: str, context: str) -> str:
         """回答单个子问题"""
+        cached = self._get_cached_answer(sub_question, context)
+        if cached is not None:
+            return cached
         prompt = SINGLE_QUERY_PROMPT.format(query=sub_question, context=context)
         messages = self.create_messages(user_content=prompt)
-        return self.call_llm_sync(messages)
+        answer = self._call_llm_timed(messages)
+        if self.cache is not None:
+            self.cache.put_answer(sub_question, text_hash(context), answer)
+        return answer
 
     async def _answer_sub_query_async(self, sub_question: str, context: str) -> str:
         """异步回答单个子问题"""
+        cached = self._get_cached_answer(sub_question, context)
+        if cached is not None:
+            return cached
         prompt = SINGLE_QUERY_PROMPT.format(query=sub_question, context=context)
         
         messages = self.create_messages(user_content=prompt)
-        return await self.call_llm_async(messages)
+        answer = await self._call_llm_timed_async(messages)
+        if self.cache is not None:
+            self.cache.put_answer(sub_question, text_hash(context), answer)
+        return answer
 
-    async def _process_sub_query_async(self, sub_query: Dict[str, Any],
-                                    retrieval_func: Optional[Callable[[str], Awaitable[List[str]]]] = None, 
-                                    index: int = 1) -> Dict[str, Any]:
-        """异步处理单个子问题"""
-        try:
-            # 使用检索函数为每个子问题检索最相关的上下文
-            if retrieval_func:
-                print(f"  正在为子问题{index}检索相关上下文...")
-            
-                sub_context = await retrieval_func(sub_query['question'])
-                if sub_context:
-                    context_str = "\n".join(sub_context)
-                    context_used = len(sub_context)
-                    print(f"  检索到 {len(sub_context)} 条相关信息")
-                else:
-                    context_str = ""
-            
-            # 回答子问题
-            sub_answer = await self._answer_sub_query_async(sub_query['question'], context_str)
-            
-            print(f"子问题{index}处理完成: {sub_query['question'][:50]}...")
-            
-            return {
-                'question': sub_query['question'],
-                'focus': sub_query['focus'],
-                'answer': sub_answer,
-                'context_used': context_used
-            }
-        except Exception as e:
-            print(f"处理子问题{index}时出错: {e}")
-            return {
-                'question': sub_query['question'],
-                'focus': sub_query['focus'],
-                'answer': f"处理该子问题时出现错误: {str(e)}",
-                'context_used': 0
-            }
+    def _get_cached_answer(self, sub_question: str, context: str) -> Optional[str]:
+        """查找近似重复子问题在相同上下文下的答案"""
+        if self.cache is None:
+            return None
+        answer = self.cache.get_answer(sub_question, text_hash(context))
+        if answer is not None:
+            print(f"  命中子答案缓存: {sub_question[:50]}")
+            self.last_run_stats["answer_cache_hits"] += 1
+        return answer
 
-    def _summarize_answers(self, original_question: str, sub_qa_pairs: List[Dict[str, Any]]) -> str:
-        """汇总所有子问题的答案"""
-        # 格式化子问题和答案
-        formatted_qa = []
-        total_context_used = 0
+    async def _process_sub_query_async(self, sub_query: Dict[str, Any], context: list[str],
+                                    retrieval_func: Optional[Retriever] = None, 
+                                    index: int = 1, dependency_answers: str = "") -> Dict[str, Any]:
+        """异步处理单个子问题(出错时抛出异常，由调度方记录为未能回答的子问题)"""
+        # 使用检索函数为每个子问题检索最相关的上下文
+        context_str, context_used, doc_ids = await self._resolve_context_async(
+            sub_query['question'], context, retrieval_func, index
+        )
         
-        for i, qa in enumerate(sub_qa_pairs, 1):
-            context_info = f" (使用了 {qa.get('context_used', 0)} 条上下文信息)" if 'context_used' in qa else ""
-            total_context_used += qa.get('context_used', 0)
-            
-            formatted_qa.append(f"""
-子问题{i}: {qa['question']}
-关注点: {qa['focus']}{context_info}
-回答: {qa['answer']}
-""")
+        # 回答子问题(有前置子问题时连同其回答一起作为上下文)
+        sub_answer = await self._answer_sub_query_async(
+            sub_query['question'], self._with_dependencies(context_str, dependency_answers)
+        )
         
-        print(f"总共使用了 {total_context_used} 条上下文信息")
-        sub_qa_text = "\n".join(formatted_qa)
+        print(f"子问题{index}处理完成: {sub_query['question'][:50]}...")
         
-        messages = self.create_messages(
-            user_content=RESULT_SUMMARIZATION_PROMPT.format(
-                original_query=original_question,
-                sub_qa_pairs=sub_qa_text
-            )
-        )
+        return {
+            'question': sub_query['question'],
+            'focus': sub_query['focus'],
+            'answer': sub_answer,
+            'context_used': context_used,
+            'doc_ids': doc_ids
+        }
+
+    def _merge_sub_queries(self, sub_queries: List[Dict[str, Any]]) -> List[Optional[int]]:
+        """
+        合并重复的子问题：与前面某个子问题的规范形式(canonical_question)相同时并入该子问题
+        
+        规范形式统一"什么是X/X是什么"、"X有哪些/X包括哪些"这类同义问法并忽略助词，但保留实词及其顺序，
+        因此"优点/缺点"、"区别/联系"这类只差一个实词的子问题，以及"A是否优于B/B是否优于A"
+        这类主客体互换的子问题都不会被合并。
         
-        return self.call_llm_sync(messages)
+        Args:
+            sub_queries: 分解得到的子问题
+            
+        Returns:
+            List[Optional[int]]: 与sub_queries一一对应，被合并时为所并入子问题的下标，否则为None
+        """
+        first_index: Dict[str, int] = {}
+        merged_into: List[Optional[int]] = []
+        for i, sub_query in enumerate(sub_queries):
+            canonical = canonical_question(sub_query['question'], QUESTION_FILLER_CHARS)
+            merged_into.append(first_index.get(canonical))
+            first_index.setdefault(canonical, i)
+        merged = sum(1 for target in merged_into if target is not None)
+        if merged:
+            print(f"合并了{merged}个近似重复的子问题")
+        self.last_run_stats["merged_sub_queries"] += merged
+        return merged_into
+
+    def _expand_merged_pairs(self, sub_queries: List[Dict[str, Any]], merged_into: List[Optional[int]],
+                             unique_pairs: Dict[int, Dict[str, Any]], depth: int = 1) -> List[Dict[str, Any]]:
+        """
+        按原始顺序还原所有子问题的结果，被合并的子问题保留自己的位置并引用所并入子问题的回答，
+        并为原问题这一层记录各子问题检索到的文档的并集/交集视图
+        """
+        sub_qa_pairs = []
+        for i, sub_query in enumerate(sub_queries):
+            target = merged_into[i]
+            if target is None:
+                sub_qa_pairs.append(unique_pairs[i])
+            else:
+                sub_qa_pairs.append({
+                    'question': sub_query['question'],
+                    'focus': sub_query['focus'],
+                    'answer': f"与子问题{target + 1}含义相同，见子问题{target + 1}的回答",
+                    'merged_into': target + 1,
+                    'doc_ids': unique_pairs[target].get('doc_ids')
+                })
+        if depth == 1:
+            self.last_run_stats["retrieval"] = self.retrieval_view(sub_qa_pairs)
+        return sub_qa_pairs
+
+    @staticmethod
+    def retrieval_view(sub_qa_pairs: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        汇总各子问题检索到的文档id(文档内容的哈希)，给出并集、交集以及被多个子问题共享的文档
+        
+        Args:
+            sub_qa_pairs: 子问题结果，doc_ids为None的子问题(未使用检索结果)不参与统计
+            
+        Returns:
+            Dict[str, Any]: by_sub_query为子问题编号→文档id列表，union/intersection/shared为文档id列表
+        """
+        by_sub_query = {i: qa['doc_ids'] for i, qa in enumerate(sub_qa_pairs, 1) if qa.get('doc_ids') is not None}
+        # 被合并的子问题与所并入的子问题共用同一次检索，不重复计数
+        retrieved = [qa['doc_ids'] for qa in sub_qa_pairs if qa.get('doc_ids') is not None and 'merged_into' not in qa]
+        id_sets = [set(doc_ids) for doc_ids in retrieved]
+        union, counts = [], {}
+        for doc_ids in retrieved:
+            for doc_id in doc_ids:
+                if doc_id not in counts:
+                    union.append(doc_id)
+                counts[doc_id] = counts.get(doc_id, 0) + 1
+        intersection = set.intersection(*id_sets) if id_sets else set()
+        return {
+            "by_sub_query": by_sub_query,
+            "union": union,
+            "intersection": [doc_id for doc_id in union if doc_id in intersection],
+            "shared": [doc_id for doc_id in union if counts[doc_id] > 1]
+        }
+
+    def _summarize_answers(self, original_question: str, sub_qa_pairs: List[Dict[str, Any]]) -> str:
+        """汇总所有子问题的答案"""
+        return self._call_llm_timed(self._summary_messages(original_question, sub_qa_pairs))
 
     async def _summarize_answers_async(self, original_question: str, sub_qa_pairs: List[Dict[str, Any]]) -> str:
-        """异步汇总所有子问题的答案"""
-        # 格式化子问题和答案
+        """异步汇总所有子问题的答案，设置了截止时间时汇总超时则直接返回已得到的子答案"""
+        messages = self._summary_messages(original_question, sub_qa_pairs)
+        try:
+            return await asyncio.wait_for(self._call_llm_timed_async(messages), timeout=self._remaining_time(reserve=0))
+        except asyncio.TimeoutError:
+            print("汇总超时，直接返回已得到的子答案")
+            self.last_run_stats["complete"] = False
+            return "\n\n".join(f"{qa['question']}\n{qa['answer']}" for qa in sub_qa_pairs
+                                 if 'missing' not in qa and 'merged_into' not in qa)
+
+    def _summary_messages(self, original_question: str, sub_qa_pairs: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+        """格式化子问题和答案，构造汇总消息；有未能回答的子问题时附加说明，要求在最终答案中指出缺失的方面"""
         formatted_qa = []
         total_context_used = 0
         
@@ -228,12 +1310,15 @@ class QueryDecompositionRunner(LLMCallMixin):
         
         print(f"总共使用了 {total_context_used} 条上下文信息")
         sub_qa_text = "\n".join(formatted_qa)
+        missing = [f"- 子问题{i}: {qa['question']} (关注点: {qa['focus']}，原因: {_MISSING_OUTCOME_LABELS[qa['missing']]})"
+                   for i, qa in enumerate(sub_qa_pairs, 1) if 'missing' in qa]
+        if missing:
+            print(f"{len(missing)}个子问题未能回答，汇总时说明缺失的方面")
+            sub_qa_text += MISSING_ASPECTS_TEMPLATE.format(missing_aspects="\n".join(missing))
         
-        messages = self.create_messages(
+        return self.create_messages(
             user_content=RESULT_SUMMARIZATION_PROMPT.format(
                 original_query=original_question,
                 sub_qa_pairs=sub_qa_text
             )
         )
-        
-        return await self.call_llm_async(messages)
@@ -10,6 +10,8 @@ QUERY_DECOMPOSITION_PROMPT = """
 3. 子问题应该覆盖原问题的所有关键方面
 4. 保持子问题的逻辑顺序和连贯性
 5. 避免重复或过于相似的子问题
+6. 如果某个子问题需要用到其他子问题的答案才能回答，在depends_on中列出那些子问题的id；相互独立的子问题depends_on为空列表
+7. 如果某个子问题本身仍然包含多个方面、需要进一步分解，将complex设为true
 
 ## 输出格式：
 请按照以下JSON格式输出分解后的子问题：
@@ -20,12 +22,16 @@ QUERY_DECOMPOSITION_PROMPT = """
         {{
             "id": 1,
             "question": "子问题1",
-            "focus": "关注点描述"
+            "focus": "关注点描述",
+            "depends_on": [],
+            "complex": false
         }},
         {{
             "id": 2,
             "question": "子问题2", 
-            "focus": "关注点描述"
+            "focus": "关注点描述",
+            "depends_on": [1],
+            "complex": false
         }}
     ],
     "reasoning": "分解思路说明"
@@ -38,6 +44,48 @@ QUERY_DECOMPOSITION_PROMPT = """
 请对上述问题进行分解：
 """
 
+# 批量查询分解Prompt模板(一次调用分解多个问题)
+BATCH_DECOMPOSITION_PROMPT = """
+你是一个专业的问题分析专家。你的任务是将下面每个用户问题分别分解成多个简单、具体的子问题，以便更好地进行信息检索和回答。各问题相互独立，分别分解。
+
+## 分解原则：
+1. 将每个复杂问题拆分成2-5个相互独立但相关的子问题
+2. 每个子问题应该足够具体，可以通过单次检索获得明确答案
+3. 子问题应该覆盖原问题的所有关键方面
+4. 保持子问题的逻辑顺序和连贯性
+5. 避免重复或过于相似的子问题
+6. 如果某个子问题需要用到同一问题下其他子问题的答案才能回答，在depends_on中列出那些子问题的id；相互独立的子问题depends_on为空列表
+7. 如果某个子问题本身仍然包含多个方面、需要进一步分解，将complex设为true
+
+## 输出格式：
+请按照以下JSON格式输出，plans的键为问题编号，每个问题的子问题id从1开始编号：
+```json
+{{
+    "plans": {{
+        "1": {{
+            "sub_queries": [
+                {{
+                    "id": 1,
+                    "question": "子问题1",
+                    "focus": "关注点描述",
+                    "depends_on": [],
+                    "complex": false
+                }}
+            ]
+        }},
+        "2": {{
+            "sub_queries": [...]
+        }}
+    }}
+}}
+```
+
+## 用户问题：
+{questions}
+
+请对上述每个问题分别进行分解，确保每个问题编号都有对应的分解结果：
+"""
+
 # 结果汇总Prompt模板
 RESULT_SUMMARIZATION_PROMPT = """
 你是一个专业的信息整合专家。你需要根据多个子问题的回答，为用户的原始问题提供一个全面、准确、连贯的最终答案。
@@ -65,6 +113,15 @@ RESULT_SUMMARIZATION_PROMPT = """
 - 如有必要，可以补充相关的背景信息或注意事项
 """
 
+# 依赖的子问题答案作为补充上下文
+DEPENDENCY_CONTEXT_TEMPLATE = """
+## 前置子问题及其回答：
+{dependency_answers}
+
+## 检索到的文档：
+{context}
+"""
+
 # 单个问题询问Prompt模板
 SINGLE_QUERY_PROMPT = """
 你是一个专业的知识问答助手。你需要基于提供的相关文档内容，为用户的问题提供准确、全面的回答。
@@ -91,3 +148,72 @@ SINGLE_QUERY_PROMPT = """
 请为用户提供准确、有用的回答。如果文档内容不足以完全回答问题，请说明哪些方面无法确定，并基于已有信息提供尽可能有用的回答。如果这是分解后的子问题，请确保答案内容完整且独立，便于与其他子问题答案进行整。
 """
 
+
+# 复杂度路由相关配置
+ROUTER_DECOMPOSE_THRESHOLD = 0.5  # 需要分解的概率达到该值时才调用LLM分解问题
+ROUTER_HISTORY_SIZE = 1000  # 路由器保留的最近判断记录数，用于评估路由效果
+
+# 问题比较相关配置
+QUESTION_FILLER_CHARS = "的了吗呢吧啊呀嘛哦"  # 不影响问题含义的助词/语气词，比较问题的规范形式时忽略
+
+# 语义缓存相关配置
+SEMANTIC_CACHE_SIZE = 1024  # 每类缓存最多保留的条目数(LRU淘汰)
+
+# 检索相关配置
+RETRIEVAL_TOP_K = 5  # 批量检索时每个子问题返回的文档数
+
+# 依赖调度相关配置
+DECOMPOSITION_MAX_DEPTH = 2  # 递归分解的最大层数，1表示只分解原问题
+MAX_CONCURRENT_LLM_CALLS = 8  # 异步执行时同时进行的LLM调用数上限
+
+# 单次调用回答所有子问题相关配置
+MULTI_ANSWER_MAX_CONTEXT_TOKENS = 8000  # 去重后的上下文不超过该token数(且能放入上下文窗口)时，一次调用回答本层所有子问题
+
+# 一次调用回答多个子问题的Prompt模板
+MULTI_ANSWER_PROMPT = """
+你是一个专业的知识问答助手。下面是一个复杂问题分解得到的多个子问题，你需要基于提供的相关文档内容，一次性分别回答每个子问题。
+
+## 回答原则：
+1. 严格基于提供的文档内容进行回答，不要编造信息
+2. 如果文档中没有相关信息，应在该子问题的回答中明确说明
+3. 每个子问题的回答都要完整且独立，便于后续整合
+4. 标注了依赖关系的子问题，可以参考所依赖子问题的回答
+
+## 相关文档内容：
+{context}
+
+## 子问题：
+{sub_queries}
+
+## 输出格式：
+请以JSON格式输出，answers的键为子问题编号，值为该子问题的回答：
+```json
+{{
+    "answers": {{
+        "1": "子问题1的回答",
+        "2": "子问题2的回答"
+    }}
+}}
+```
+
+请确保每个子问题都有回答，并且输出的是有效的JSON格式。
+"""
+
+# 上下文去重与打包相关配置
+SUMMARY_SENTENCE_DEDUP_THRESHOLD = 0.9  # 汇总前子答案中的句子与前面子答案中某句的字符n-gram相似度达到该值时视为重复并去除
+SUMMARY_SENTENCE_MIN_CHARS = 10  # 归一化后短于该长度的句子不参与去重，避免误删"是的"这类短句
+
+# 批量分解相关配置
+DECOMPOSE_BATCH_TOKEN_BUDGET = 2000  # 批量分解时每次调用中问题文本的token数上限
+DECOMPOSE_BATCH_MAX_QUESTIONS = 20  # 批量分解时每次调用最多包含的问题数
+DECOMPOSE_BATCH_MAX_RETRIES = 2  # 分解结果解析失败的问题最多重试的轮数，仍失败时以原问题作为单个子问题
+
+# 截止时间相关配置
+SUMMARY_RESERVE_SECONDS = 10  # 设置了运行截止时间时为汇总预留的时间(秒)，子问题阶段在此之前结束
+
+# 有子问题未能回答时附加在子问题答案之后的说明
+MISSING_ASPECTS_TEMPLATE = """
+## 未能回答的方面：
+以下子问题未能在时限内得到回答(或处理出错)，请在最终答案中明确说明这些方面暂时无法回答，不要猜测：
+{missing_aspects}
+"""
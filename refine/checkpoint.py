@@ -0,0 +1,84 @@
+import json
+import os
+import re
+import time
+from typing import Any, Dict, List, Optional
+
+CHECKPOINT_FORMAT_VERSION = 1  # 检查点文件格式版本，格式变化时递增以使旧检查点失效
+
+_RUN_ID_PATTERN = re.compile(r"^[\w.-]+$")
+
+
+class CheckpointStore:
+    """
+    Refine迭代检查点的磁盘存储
+
+    每个运行对应 {directory}/{run_id}.json，每完成一轮迭代覆盖写入一次。
+    运行完成后检查点保留(completed为True)，相同run_id再次运行时直接返回保存的答案。
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def get(self, run_id: str) -> Optional[Dict[str, Any]]:
+        """
+        读取检查点
+
+        Args:
+            run_id: 运行ID
+
+        Returns:
+            Optional[Dict[str, Any]]: 检查点内容，不存在或版本不匹配时返回None
+        """
+        path = self._path(run_id)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                checkpoint = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"读取检查点失败({path}): {e}")
+            return None
+        if checkpoint.get("version") != CHECKPOINT_FORMAT_VERSION:
+            return None
+        return checkpoint
+
+    def put(self, run_id: str, checkpoint: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        写入检查点(先写临时文件再原子替换，避免中断时留下损坏的文件)
+
+        Args:
+            run_id: 运行ID
+            checkpoint: 检查点内容
+
+        Returns:
+            Dict[str, Any]: 写入的检查点内容
+        """
+        checkpoint = {**checkpoint, "version": CHECKPOINT_FORMAT_VERSION, "run_id": run_id,
+                      "updated_at": time.time()}
+        path = self._path(run_id)
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(checkpoint, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+        return checkpoint
+
+    def delete(self, run_id: str) -> bool:
+        """删除检查点，返回是否存在并被删除"""
+        path = self._path(run_id)
+        if not os.path.exists(path):
+            return False
+        os.remove(path)
+        return True
+
+    def list_runs(self) -> List[str]:
+        """列出所有保存了检查点的运行ID"""
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name[:-len(".json")] for name in os.listdir(self.directory) if name.endswith(".json"))
+
+    def _path(self, run_id: str) -> str:
+        if not _RUN_ID_PATTERN.match(run_id):
+            raise ValueError(f"run_id只能包含字母、数字、下划线、点和短横线: {run_id}")
+        return os.path.join(self.directory, f"{run_id}.json")
@@ -1,76 +1,785 @@
-from refine.template import INITIAL_TEMPLATE,REFINE_TEMPLATE
-from base.mixins import LLMCallMixin
+import asyncio
+import copy
+import time
+from typing import Any, Dict, List, Optional
+from refine.template import (
+    INITIAL_TEMPLATE,
+    REFINE_TEMPLATE,
+    DELTA_INITIAL_TEMPLATE,
+    DELTA_REFINE_TEMPLATE,
+    MERGE_TEMPLATE,
+    DEFAULT_ITERATION_COUNT,
+    REFINE_RELEVANCE_THRESHOLD,
+    REFINE_NOVELTY_THRESHOLD,
+    REFINE_CONVERGENCE_THRESHOLD,
+    REFINE_CONVERGENCE_PATIENCE,
+    DELTA_ANSWER_MAX_TOKENS,
+    DELTA_MAX_OUTPUT_TOKENS,
+    DELTA_DEDUP_THRESHOLD,
+    REFINE_ANSWER_RESERVE_TOKENS,
+    TREE_FAN_OUT,
+    TREE_DEPTH,
+    MAX_CONCURRENT_REQUESTS
+)
+from base.mixins import LLMCallMixin, DEFAULT_SYSTEM_PROMPT, STUFF_HEADROOM_RATIO
+from base.tokens import estimate_tokens, get_context_window
+from base.parsing import extract_json
+from base.cluster import ClusterChunker
+from base.fingerprint import corpus_fingerprint
+from base.similarity import Scorer, tokenize, text_similarity
+from refine.checkpoint import CheckpointStore
 
 class LLMRefineRunner(LLMCallMixin):
-    def __init__(self, llm_api_key: str, llm_api_url: str):
+    REFINE_MODES = ("full", "delta")
+    
+    def __init__(self, llm_api_key: str, llm_api_url: str, chunker: Optional[ClusterChunker] = None,
+                 scorer: Optional[Scorer] = None, iteration_token_budget: Optional[int] = None,
+                 checkpoint_store: Optional[CheckpointStore] = None):
+        """
+        Args:
+            llm_api_key: LLM API Key
+            llm_api_url: LLM API地址
+            chunker: 可选的聚类分块器，设置后每轮迭代处理一个语义聚类，并跳过与问题无关的聚类
+            scorer: 可选的相关度打分函数(如base.similarity.LexicalScorer())，设置后按相关度从高到低安排迭代
+            iteration_token_budget: 每轮迭代上下文的token上限，默认根据模型窗口、模板和答案预留自动计算
+            checkpoint_store: 可选的检查点存储，设置后传入run_id的运行每完成一轮迭代保存一次进度，可中断后恢复
+        """
         super().__init__(llm_api_key, llm_api_url)
+        self.chunker = chunker
+        self.scorer = scorer
+        self.iteration_token_budget = iteration_token_budget
+        self.checkpoint_store = checkpoint_store
+        self.stream_output = True  # 异步迭代时是否流式打印答案
+        self.call_semaphore: Optional[asyncio.Semaphore] = None  # 设置后异步迭代调用受其限制(多问题共享调度)
+        self.last_run_stats: Dict[str, Any] = {}  # 最近一次执行的统计信息
 
 
-    def run(self, question: str, iterate_account: str, context: list[str]) -> str:
-        # 将上下文分成 iterate_account 个部分
-        chunk_size = max(1, len(context) // iterate_account)
-        context_chunks = [context[i:i + chunk_size] for i in range(0, len(context), chunk_size)]
+    def run(self, question: str, iterate_account: int, context: list[str], allow_fast_path: bool = True,
+            early_stop: bool = False, latency_budget: Optional[float] = None, refine_mode: str = "full",
+            run_id: Optional[str] = None) -> str:
+        self._check_refine_mode(refine_mode)
+        checkpoint = self._load_checkpoint(run_id, question, context, refine_mode)
+        if checkpoint is not None and checkpoint["completed"]:
+            print(f"运行{run_id}已完成，直接返回保存的答案")
+            self.last_run_stats = checkpoint["stats"]
+            return checkpoint["answer"]
         
-        # 确保不超过指定的迭代次数
-        context_chunks = context_chunks[:iterate_account]
+        # 上下文可一次放入模型窗口时直接单次调用回答
+        if checkpoint is None and allow_fast_path and self.can_stuff(question, context, "迭代"):
+            current_answer = self.call_llm_sync(self.create_stuff_messages(question, context))
+            self._save_checkpoint(run_id, question, context, refine_mode, 0, current_answer, 0, completed=True)
+            return current_answer
         
-        # 第一次迭代使用初始模板
-        first_context = "\n".join(context_chunks[0])
-        messages = self.create_messages(
-            user_content=INITIAL_TEMPLATE.format(context=first_context, question=question)
-        )
-        print("尝试第一次提问,messages:",messages)
-        current_answer = self.call_llm_sync(messages)
+        start_time = time.monotonic()
+        if checkpoint is not None:
+            context_chunks, current_answer, start_index, stable_rounds = self._resume_from_checkpoint(
+                checkpoint, context
+            )
+        else:
+            plan = self.plan_iterations(question, context, iterate_account, refine_mode)
+            context_chunks = plan["iterations"]
+            self.last_run_stats = self._new_iteration_stats(len(context_chunks))
+            self.last_run_stats["plan"] = plan
+            
+            # 第一次迭代使用初始模板
+            first_context = "\n".join(context_chunks[0])
+            messages = self._build_initial_messages(question, first_context, refine_mode)
+            print("尝试第一次提问,messages:",messages)
+            response = self.call_llm_sync(messages, **self._step_call_kwargs(refine_mode))
+            self._record_usage(messages, response)
+            current_answer = self._apply_step_response(response, "", refine_mode)
+            self.last_run_stats["iterations_run"] += 1
+            start_index, stable_rounds = 1, 0
+            self._save_checkpoint(run_id, question, context, refine_mode, 1, current_answer, 0)
         
         # 后续迭代使用refinement模板
-        for i in range(1, len(context_chunks)):
+        for i in range(start_index, len(context_chunks)):
+            if latency_budget is not None and self._exceeds_latency_budget(start_time, latency_budget):
+                print("剩余时间不足以完成下一轮迭代，按延迟预算截断")
+                for rest in context_chunks[i:]:
+                    self._record_saved_iteration("iterations_truncated", question, current_answer, "\n".join(rest))
+                break
             chunk_context = "\n".join(context_chunks[i])
-            messages = self.create_messages(
-                user_content=REFINE_TEMPLATE.format(
-                    question=question,
-                    existing_answer=current_answer,
-                    context=chunk_context
-                )
-            )
+            if early_stop and not self._is_chunk_useful(question, current_answer, chunk_context):
+                print("第{}次迭代的上下文与问题无关或已被答案覆盖，跳过".format(i))
+                self._record_saved_iteration("iterations_skipped", question, current_answer, chunk_context)
+                continue
+            messages = self._build_refine_messages(question, current_answer, chunk_context, refine_mode)
             print("尝试第{}次迭代提问,messages:".format(i),messages)
-            current_answer = self.call_llm_sync(messages)
+            response = self.call_llm_sync(messages, **self._step_call_kwargs(refine_mode))
+            self._record_usage(messages, response)
+            previous_answer, current_answer = current_answer, self._apply_step_response(
+                response, current_answer, refine_mode
+            )
+            self.last_run_stats["iterations_run"] += 1
+            
+            stable_rounds = stable_rounds + 1 if self._is_answer_unchanged(previous_answer, current_answer) else 0
+            self._save_checkpoint(run_id, question, context, refine_mode, i + 1, current_answer, stable_rounds)
+            if early_stop and stable_rounds >= REFINE_CONVERGENCE_PATIENCE:
+                print("答案已收敛，提前结束迭代")
+                for rest in context_chunks[i+1:]:
+                    self._record_saved_iteration("iterations_stopped", question, current_answer, "\n".join(rest))
+                break
         
+        self._save_checkpoint(run_id, question, context, refine_mode, len(context_chunks), current_answer,
+                              stable_rounds, completed=True)
         return current_answer
 
 
-    async def run_async(self, question: str, iterate_account: str, context: list[str]) -> str:
-        # 将上下文分成 iterate_account 个部分
-        chunk_size = max(1, len(context) // iterate_account)
-        context_chunks = [context[i:i + chunk_size] for i in range(0, len(context), chunk_size)]
+    async def run_async(self, question: str, iterate_account: int, context: list[str], allow_fast_path: bool = True,
+                        early_stop: bool = False, latency_budget: Optional[float] = None,
+                        refine_mode: str = "full", run_id: Optional[str] = None) -> str:
+        self._check_refine_mode(refine_mode)
+        checkpoint = self._load_checkpoint(run_id, question, context, refine_mode)
+        if checkpoint is not None and checkpoint["completed"]:
+            print(f"运行{run_id}已完成，直接返回保存的答案")
+            self.last_run_stats = checkpoint["stats"]
+            return checkpoint["answer"]
         
-        # 确保不超过指定的迭代次数
-        context_chunks = context_chunks[:iterate_account]
+        # 上下文可一次放入模型窗口时直接单次调用回答
+        if checkpoint is None and allow_fast_path and self.can_stuff(question, context, "迭代"):
+            current_answer = await self._call_step_async(self.create_stuff_messages(question, context), "full")
+            self._save_checkpoint(run_id, question, context, refine_mode, 0, current_answer, 0, completed=True)
+            return current_answer
+        
+        start_time = time.monotonic()
+        if checkpoint is not None:
+            context_chunks, current_answer, start_index, stable_rounds = self._resume_from_checkpoint(
+                checkpoint, context
+            )
+        else:
+            plan = self.plan_iterations(question, context, iterate_account, refine_mode)
+            context_chunks = plan["iterations"]
+            self.last_run_stats = self._new_iteration_stats(len(context_chunks))
+            self.last_run_stats["plan"] = plan
+            
+            # 第一次迭代使用初始模板
+            first_context = "\n".join(context_chunks[0])
+            messages = self._build_initial_messages(question, first_context, refine_mode)
+            print("尝试第一次提问,messages:",messages)
+            response = await self._call_step_async(messages, refine_mode)
+            self._record_usage(messages, response)
+            current_answer = self._apply_step_response(response, "", refine_mode)
+            self.last_run_stats["iterations_run"] += 1
+            start_index, stable_rounds = 1, 0
+            self._save_checkpoint(run_id, question, context, refine_mode, 1, current_answer, 0)
         
-        # 第一次迭代使用初始模板
-        first_context = "\n".join(context_chunks[0])
-        messages = self.create_messages(
-            user_content=INITIAL_TEMPLATE.format(context=first_context, question=question)
-        )
-        print("尝试第一次提问,messages:",messages)
-        current_answer = ""
-        async for chunk in await self.call_llm_async(messages, stream=True):
-            print(chunk, end='', flush=True)
-            current_answer += chunk
-        print("")
         # 后续迭代使用refinement模板
-        for i in range(1, len(context_chunks)):
+        for i in range(start_index, len(context_chunks)):
+            if latency_budget is not None and self._exceeds_latency_budget(start_time, latency_budget):
+                print("剩余时间不足以完成下一轮迭代，按延迟预算截断")
+                for rest in context_chunks[i:]:
+                    self._record_saved_iteration("iterations_truncated", question, current_answer, "\n".join(rest))
+                break
             chunk_context = "\n".join(context_chunks[i])
-            messages = self.create_messages(
-                user_content=REFINE_TEMPLATE.format(
+            if early_stop and not self._is_chunk_useful(question, current_answer, chunk_context):
+                print("第{}次迭代的上下文与问题无关或已被答案覆盖，跳过".format(i))
+                self._record_saved_iteration("iterations_skipped", question, current_answer, chunk_context)
+                continue
+            messages = self._build_refine_messages(question, current_answer, chunk_context, refine_mode)
+            print("尝试第{}次迭代提问".format(i))
+            response = await self._call_step_async(messages, refine_mode)
+            self._record_usage(messages, response)
+            previous_answer, current_answer = current_answer, self._apply_step_response(
+                response, current_answer, refine_mode
+            )
+            self.last_run_stats["iterations_run"] += 1
+            
+            stable_rounds = stable_rounds + 1 if self._is_answer_unchanged(previous_answer, current_answer) else 0
+            self._save_checkpoint(run_id, question, context, refine_mode, i + 1, current_answer, stable_rounds)
+            if early_stop and stable_rounds >= REFINE_CONVERGENCE_PATIENCE:
+                print("答案已收敛，提前结束迭代")
+                for rest in context_chunks[i+1:]:
+                    self._record_saved_iteration("iterations_stopped", question, current_answer, "\n".join(rest))
+                break
+        
+        self._save_checkpoint(run_id, question, context, refine_mode, len(context_chunks), current_answer,
+                              stable_rounds, completed=True)
+        return current_answer
+
+
+    async def run_many(self, questions: List[str], context: list[str],
+                       iterate_account: int = DEFAULT_ITERATION_COUNT,
+                       max_concurrency: int = MAX_CONCURRENT_REQUESTS, **run_kwargs) -> List[Dict[str, Any]]:
+        """
+        多个问题的迭代链在同一个有界并发调度器上交错执行
+        
+        每个问题的迭代仍然串行，但所有问题的迭代链同时推进，任意时刻进行中的LLM调用不超过max_concurrency，
+        整体吞吐随服务端并发能力而不是单个问题的迭代轮数扩展。单个问题失败不影响其他问题。
+        
+        Args:
+            questions: 问题列表
+            context: 所有问题共享的上下文信息列表
+            iterate_account: 每个问题的迭代轮数上限
+            max_concurrency: 同时进行的LLM调用数上限
+            **run_kwargs: 传给run_async的其余参数(如early_stop、refine_mode)
+            
+        Returns:
+            List[Dict[str, Any]]: 与questions一一对应的结果，包含answer、error、usage、stats和elapsed
+        """
+        if "run_id" in run_kwargs:
+            raise ValueError("run_many不支持run_id，请为每个问题单独调用run_async")
+        start_time = time.monotonic()
+        semaphore = asyncio.Semaphore(max_concurrency)
+        # worker由copy.copy浅拷贝得到，必须在复制前创建异步客户端，各worker才会共享同一个客户端及其连接池
+        _ = self.async_client
+        
+        async def run_question(question: str) -> Dict[str, Any]:
+            # 每个问题使用独立的worker，统计信息互不干扰
+            worker = copy.copy(self)
+            worker.stream_output = False
+            worker.call_semaphore = semaphore
+            worker.last_run_stats = {}
+            question_start = time.monotonic()
+            result = {"question": question, "answer": None, "error": None}
+            try:
+                result["answer"] = await worker.run_async(question, iterate_account, context, **run_kwargs)
+            except Exception as e:
+                print(f"  - 问题处理失败: {question}: {e}")
+                result["error"] = str(e)
+            result["elapsed"] = time.monotonic() - question_start
+            result["stats"] = worker.last_run_stats
+            result["usage"] = self._result_usage(worker.last_run_stats, result["answer"])
+            return result
+        
+        print(f"多问题批量处理：{len(questions)}个问题，最多{max_concurrency}个并发调用")
+        results = await asyncio.gather(*[run_question(question) for question in questions])
+        
+        usage = {"llm_calls": 0, "prompt_tokens": 0, "completion_tokens": 0}
+        for result in results:
+            for key in usage:
+                usage[key] += result["usage"][key]
+        self.last_run_stats = {
+            "questions": len(questions),
+            "succeeded": sum(1 for result in results if result["error"] is None),
+            "failed": sum(1 for result in results if result["error"] is not None),
+            "max_concurrency": max_concurrency,
+            "usage": usage,
+            "elapsed": time.monotonic() - start_time
+        }
+        return results
+
+
+    @staticmethod
+    def _result_usage(stats: Dict[str, Any], answer: Optional[str]) -> Dict[str, int]:
+        """从一次运行的统计信息中取出用量(快速路径只记录了prompt的估算)"""
+        if "usage" in stats:
+            return dict(stats["usage"])
+        return {
+            "llm_calls": stats.get("llm_calls", 0),
+            "prompt_tokens": stats.get("prompt_tokens", 0),
+            "completion_tokens": estimate_tokens(answer or "")
+        }
+
+
+    async def run_tree_async(self, question: str, iterate_account: int, context: list[str],
+                             fan_out: int = TREE_FAN_OUT, depth: int = TREE_DEPTH,
+                             allow_fast_path: bool = True) -> str:
+        """
+        树形迭代：多条独立的迭代链并行处理互不相交的上下文分组，再逐层合并部分答案
+        
+        叶子上的每条迭代链与串行模式相同(第一轮INITIAL_TEMPLATE，后续REFINE_TEMPLATE)，
+        部分答案每fan_out个一组，以MERGE_TEMPLATE逐层合并，串行调用次数从迭代轮数降为
+        单条链的长度加上合并树的深度。
+        
+        Args:
+            question: 用户问题
+            iterate_account: 迭代轮数上限(所有链合计)，上下文按token数均匀分摊到这么多轮，
+                因此不小于fan_out ** depth时每条链至少分到一轮
+            context: 上下文信息列表
+            fan_out: 每次合并调用合并的部分答案数
+            depth: 合并树的深度，并行迭代链数为fan_out ** depth
+            allow_fast_path: 上下文可一次放入模型窗口时是否直接单次调用回答
+            
+        Returns:
+            str: 最终答案
+        """
+        if fan_out < 2 or depth < 0:
+            raise ValueError("fan_out必须不小于2，depth必须不小于0")
+        if allow_fast_path and self.can_stuff(question, context, "迭代"):
+            return await self.call_llm_async(self.create_stuff_messages(question, context))
+        
+        plan = self.plan_iterations(question, context, iterate_account, spread=True)
+        iterations = plan["iterations"]
+        # 链数不超过迭代轮数；按轮次轮流分配，保持每条链内的相关度顺序
+        chain_count = min(fan_out ** depth, len(iterations))
+        chains = [iterations[i::chain_count] for i in range(chain_count)]
+        self.last_run_stats = {
+            "fast_path": False,
+            "mode": "tree",
+            "plan": plan,
+            "iterations_planned": len(iterations),
+            "iterations_run": 0,
+            "chains": chain_count,
+            "chains_failed": 0,
+            "merge_calls": 0,
+            "merge_levels": 0,
+            "serial_calls": max(len(chain) for chain in chains)
+        }
+        
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        print(f"树形迭代：{chain_count}条迭代链并行处理{len(iterations)}轮上下文")
+        gathered = await asyncio.gather(
+            *[self._run_chain_async(question, chain, semaphore) for chain in chains], return_exceptions=True
+        )
+        
+        # 单条链失败不影响整体，只有全部失败时才抛出异常
+        answers = []
+        for i, result in enumerate(gathered):
+            if isinstance(result, Exception):
+                print(f"  - 第{i+1}条迭代链失败，已跳过: {result}")
+                self.last_run_stats["chains_failed"] += 1
+            else:
+                answers.append(result)
+        if not answers:
+            raise gathered[0]
+        
+        # 逐层合并，每fan_out个部分答案一组，不足一组的直接进入下一层
+        while len(answers) > 1:
+            groups = [answers[i:i + fan_out] for i in range(0, len(answers), fan_out)]
+            self.last_run_stats["merge_levels"] += 1
+            print(f"第{self.last_run_stats['merge_levels']}层合并：{len(answers)}个部分答案合并为{len(groups)}个")
+            answers = await asyncio.gather(*[self._merge_answers_async(question, group, semaphore) for group in groups])
+        self.last_run_stats["serial_calls"] += self.last_run_stats["merge_levels"]
+        return answers[0]
+
+
+    async def _run_chain_async(self, question: str, chain: List[List[str]], semaphore: asyncio.Semaphore) -> str:
+        """在一组上下文上执行一条串行迭代链(不流式输出，避免并行链的输出交错)"""
+        current_answer = ""
+        for i, chunk in enumerate(chain):
+            chunk_context = "\n".join(chunk)
+            if i == 0:
+                messages = self._build_initial_messages(question, chunk_context, "full")
+            else:
+                messages = self._build_refine_messages(question, current_answer, chunk_context, "full")
+            async with semaphore:
+                current_answer = await self.call_llm_async(messages)
+            self.last_run_stats["iterations_run"] += 1
+        return current_answer
+
+
+    async def _merge_answers_async(self, question: str, answers: List[str], semaphore: asyncio.Semaphore) -> str:
+        """以第一个部分答案为当前答案，合并同组的其余部分答案"""
+        if len(answers) == 1:
+            return answers[0]
+        partial_answers = "\n\n".join(f"部分答案{i}:\n{answer}" for i, answer in enumerate(answers[1:], 1))
+        messages = self.create_messages(
+            user_content=MERGE_TEMPLATE.format(
+                question=question,
+                existing_answer=answers[0],
+                partial_answers=partial_answers
+            )
+        )
+        async with semaphore:
+            merged = await self.call_llm_async(messages)
+        self.last_run_stats["merge_calls"] += 1
+        return merged
+
+
+    def _check_refine_mode(self, refine_mode: str):
+        """校验迭代模式参数"""
+        if refine_mode not in self.REFINE_MODES:
+            raise ValueError(f"不支持的refine_mode: {refine_mode}，可选值: {self.REFINE_MODES}")
+
+
+    def _build_initial_messages(self, question: str, context: str, refine_mode: str) -> List[Dict[str, str]]:
+        """构造第一轮迭代的消息"""
+        template = DELTA_INITIAL_TEMPLATE if refine_mode == "delta" else INITIAL_TEMPLATE
+        return self.create_messages(user_content=template.format(context=context, question=question))
+
+
+    def _build_refine_messages(self, question: str, current_answer: str, context: str,
+                               refine_mode: str) -> List[Dict[str, str]]:
+        """构造后续迭代的消息，delta模式下当前答案以带编号的要点形式发送"""
+        if refine_mode == "delta":
+            points = self._parse_points(current_answer)
+            existing_points = "\n".join(f"{i}. {point}" for i, point in enumerate(points, 1)) or "(暂无)"
+            return self.create_messages(
+                user_content=DELTA_REFINE_TEMPLATE.format(
                     question=question,
-                    existing_answer=current_answer,
-                    context=chunk_context
+                    existing_points=existing_points,
+                    context=context
                 )
             )
-            print("尝试第{}次迭代提问".format(i))
-            current_answer = ""
-            async for chunk in await self.call_llm_async(messages, stream=True):
-                print(chunk, end='', flush=True)
-                current_answer += chunk
-            print("")
-        return current_answer
+        return self.create_messages(
+            user_content=REFINE_TEMPLATE.format(
+                question=question,
+                existing_answer=current_answer,
+                context=context
+            )
+        )
+
+
+    def _step_call_kwargs(self, refine_mode: str) -> Dict[str, Any]:
+        """delta模式下限制单次调用的输出长度"""
+        return {"max_tokens": DELTA_MAX_OUTPUT_TOKENS} if refine_mode == "delta" else {}
+
+
+    async def _call_step_async(self, messages: List[Dict[str, str]], refine_mode: str) -> str:
+        """异步执行一轮迭代调用，full模式流式打印答案，delta模式的结构化输出直接返回"""
+        if self.call_semaphore is not None:
+            async with self.call_semaphore:
+                return await self.call_llm_async(messages, **self._step_call_kwargs(refine_mode))
+        if refine_mode == "delta" or not self.stream_output:
+            return await self.call_llm_async(messages, **self._step_call_kwargs(refine_mode))
+        
+        response = ""
+        async for chunk in await self.call_llm_async(messages, stream=True):
+            print(chunk, end='', flush=True)
+            response += chunk
+        print("")
+        return response
+
+
+    def _apply_step_response(self, response: str, current_answer: str, refine_mode: str) -> str:
+        """
+        根据一轮迭代的输出得到新的答案
+        
+        full模式下输出即新的完整答案；delta模式下在本地把增删改合并到当前要点列表中，
+        并保证答案不超过DELTA_ANSWER_MAX_TOKENS。
+        
+        Args:
+            response: 本轮LLM输出
+            current_answer: 当前答案
+            refine_mode: 迭代模式
+            
+        Returns:
+            str: 新的答案
+        """
+        if refine_mode != "delta":
+            return response
+        
+        points = self._parse_points(current_answer)
+        result = extract_json(response)
+        if not isinstance(result, dict):
+            print("增量结果解析失败，保持当前答案不变")
+            if not points:
+                points = [line.strip("-* \t") for line in response.splitlines() if line.strip("-* \t")]
+            return self._render_points(self._truncate_points(points))
+        
+        # 先修改、再删除、最后追加新要点
+        for item in self._list_field(result, "update"):
+            try:
+                index = int(item.get("id")) - 1
+            except (AttributeError, TypeError, ValueError):
+                continue
+            text = item.get("text")
+            if 0 <= index < len(points) and isinstance(text, str) and text.strip():
+                points[index] = text.strip()
+        removed = set()
+        for item in self._list_field(result, "remove"):
+            try:
+                removed.add(int(item) - 1)
+            except (TypeError, ValueError):
+                continue
+        points = [point for i, point in enumerate(points) if i not in removed]
+        for point in self._list_field(result, "points") + self._list_field(result, "add"):
+            if not isinstance(point, str) or not point.strip():
+                continue
+            if any(text_similarity(point, existing) >= DELTA_DEDUP_THRESHOLD for existing in points):
+                continue
+            points.append(point.strip())
+        return self._render_points(self._truncate_points(points))
+
+
+    @staticmethod
+    def _truncate_points(points: List[str]) -> List[str]:
+        """按顺序保留要点直到达到DELTA_ANSWER_MAX_TOKENS，超出部分(最新追加的要点)被丢弃"""
+        kept, total_tokens = [], 0
+        for point in points:
+            point_tokens = estimate_tokens(point) + 1
+            if total_tokens + point_tokens > DELTA_ANSWER_MAX_TOKENS:
+                print(f"答案达到token上限，丢弃{len(points) - len(kept)}条要点")
+                break
+            kept.append(point)
+            total_tokens += point_tokens
+        return kept
+
+
+    @staticmethod
+    def _list_field(result: Dict[str, Any], key: str) -> list:
+        """取增量结果中的列表字段，缺失、为null或不是列表时返回空列表"""
+        value = result.get(key)
+        return value if isinstance(value, list) else []
+
+    @staticmethod
+    def _parse_points(answer: str) -> List[str]:
+        """从要点形式的答案中解析要点列表"""
+        return [line[2:].strip() for line in answer.splitlines() if line.startswith("- ") and line[2:].strip()]
+
+
+    @staticmethod
+    def _render_points(points: List[str]) -> str:
+        """将要点列表渲染为答案文本"""
+        return "\n".join(f"- {point}" for point in points)
+
+
+    def _new_iteration_stats(self, iterations_planned: int) -> Dict[str, Any]:
+        """初始化迭代统计信息"""
+        return {
+            "fast_path": False,
+            "iterations_planned": iterations_planned,
+            "iterations_run": 0,
+            "iterations_skipped": 0,
+            "iterations_stopped": 0,
+            "iterations_truncated": 0,
+            "tokens_saved": 0,
+            "usage": {"llm_calls": 0, "prompt_tokens": 0, "completion_tokens": 0}
+        }
+
+
+    def _record_usage(self, messages: List[Dict[str, str]], response: str):
+        """累计一次迭代调用的用量(token数为估算值)"""
+        usage = self.last_run_stats["usage"]
+        usage["llm_calls"] += 1
+        usage["prompt_tokens"] += sum(estimate_tokens(message["content"]) for message in messages)
+        usage["completion_tokens"] += estimate_tokens(response)
+
+
+    def _load_checkpoint(self, run_id: Optional[str], question: str, context: list[str],
+                         refine_mode: str) -> Optional[Dict[str, Any]]:
+        """
+        读取运行的检查点，并校验问题、迭代模式和语料与本次运行一致
+        
+        Args:
+            run_id: 运行ID，为None时不使用检查点
+            question: 用户问题
+            context: 上下文信息列表
+            refine_mode: 迭代模式
+            
+        Returns:
+            Optional[Dict[str, Any]]: 检查点内容，没有检查点时返回None
+        """
+        if run_id is None:
+            return None
+        if self.checkpoint_store is None:
+            raise ValueError("使用run_id需要在构造时提供checkpoint_store")
+        checkpoint = self.checkpoint_store.get(run_id)
+        if checkpoint is None:
+            return None
+        if checkpoint["question"] != question or checkpoint["refine_mode"] != refine_mode:
+            raise ValueError(f"运行{run_id}的检查点与本次的问题或迭代模式不一致")
+        if checkpoint["corpus_fingerprint"] != corpus_fingerprint(context):
+            raise ValueError(f"运行{run_id}的检查点与本次的上下文不一致，无法恢复")
+        return checkpoint
+
+
+    def _save_checkpoint(self, run_id: Optional[str], question: str, context: list[str], refine_mode: str,
+                         next_iteration: int, current_answer: str, stable_rounds: int, completed: bool = False):
+        """保存运行进度；迭代计划以文档下标记录，恢复时根据上下文还原"""
+        if run_id is None:
+            return
+        plan = self.last_run_stats.get("plan")
+        if plan is not None:
+            positions = {}
+            for index, doc in enumerate(context):
+                positions.setdefault(doc, index)
+            plan = {
+                **plan,
+                "iterations": [[positions[doc] for doc in iteration] for iteration in plan["iterations"]],
+                "dropped_documents": [positions[doc] for doc in plan.get("dropped_documents", [])]
+            }
+        self.checkpoint_store.put(run_id, {
+            "question": question,
+            "refine_mode": refine_mode,
+            "corpus_fingerprint": corpus_fingerprint(context),
+            "plan": plan,
+            "next_iteration": next_iteration,
+            "answer": current_answer,
+            "stable_rounds": stable_rounds,
+            "stats": {key: value for key, value in self.last_run_stats.items() if key != "plan"},
+            "completed": completed
+        })
+
+
+    def _resume_from_checkpoint(self, checkpoint: Dict[str, Any], context: list[str]):
+        """
+        从检查点恢复迭代状态
+        
+        Returns:
+            tuple: (每轮的文档列表, 当前答案, 下一轮迭代的下标, 连续未变化的轮数)
+        """
+        plan = {**checkpoint["plan"]}
+        plan["iterations"] = [[context[index] for index in iteration] for iteration in plan["iterations"]]
+        plan["dropped_documents"] = [context[index] for index in plan.get("dropped_documents", [])]
+        self.last_run_stats = {**checkpoint["stats"], "plan": plan}
+        print(f"从检查点恢复运行{checkpoint['run_id']}：已完成{checkpoint['next_iteration']}/{len(plan['iterations'])}轮")
+        return plan["iterations"], checkpoint["answer"], checkpoint["next_iteration"], checkpoint["stable_rounds"]
+
+
+    def _is_chunk_useful(self, question: str, current_answer: str, chunk_context: str) -> bool:
+        """
+        本地判断下一段上下文是否值得再做一轮迭代(不调用LLM)
+        
+        上下文需要覆盖足够比例的问题词项，并且包含足够比例当前答案中尚未出现的内容。
+        
+        Args:
+            question: 用户问题
+            current_answer: 当前答案
+            chunk_context: 下一轮迭代的上下文
+            
+        Returns:
+            bool: 是否执行该轮迭代
+        """
+        chunk_terms = set(tokenize(chunk_context))
+        question_terms = set(tokenize(question))
+        if not chunk_terms or not question_terms:
+            return True
+        relevance = len(question_terms & chunk_terms) / len(question_terms)
+        novelty = len(chunk_terms - set(tokenize(current_answer))) / len(chunk_terms)
+        return relevance >= REFINE_RELEVANCE_THRESHOLD and novelty >= REFINE_NOVELTY_THRESHOLD
+
+
+    def _is_answer_unchanged(self, previous_answer: str, current_answer: str) -> bool:
+        """判断相邻两轮的答案是否基本没有变化"""
+        return text_similarity(previous_answer, current_answer) >= REFINE_CONVERGENCE_THRESHOLD
+
+
+    def _exceeds_latency_budget(self, start_time: float, latency_budget: float) -> bool:
+        """按已完成迭代的平均耗时预估，判断再做一轮是否会超出延迟预算"""
+        elapsed = time.monotonic() - start_time
+        average = elapsed / max(1, self.last_run_stats["iterations_run"])
+        return elapsed + average > latency_budget
+
+
+    def _record_saved_iteration(self, key: str, question: str, current_answer: str, chunk_context: str):
+        """记录一次被省去的迭代，并估算节省的token(prompt + 重新生成的答案)"""
+        prompt_tokens = estimate_tokens(DEFAULT_SYSTEM_PROMPT + REFINE_TEMPLATE + question + chunk_context)
+        self.last_run_stats[key] += 1
+        self.last_run_stats["tokens_saved"] += prompt_tokens + 2 * estimate_tokens(current_answer)
+
+
+    def plan_iterations(self, question: str, context: list[str], iterate_account: int = DEFAULT_ITERATION_COUNT,
+                        refine_mode: str = "full", spread: bool = False) -> Dict[str, Any]:
+        """
+        按token预算规划迭代：每轮尽量装满上下文，用尽量少的串行迭代覆盖全部文档
+        
+        每轮的预算为模型窗口(扣除输出预留)减去模板、问题和当前答案的预留。
+        iterate_account是迭代次数的硬上限：预算内无法用这么多轮覆盖全部文档时，只保留前iterate_account轮，
+        其余文档不参与迭代，在计划中标记exceeds_iterate_account并记录被丢弃的文档。
+        设置了聚类分块器时以聚类为单位装填(无关聚类已被跳过)，设置了打分函数时相关度高的内容排在前面，
+        因此被丢弃的是相关度最低的内容。
+        spread为True时不追求最少轮数，而是把文档按token数均匀分摊到iterate_account轮(供树形迭代的并行链使用)。
+        
+        Args:
+            question: 用户问题
+            context: 上下文信息列表
+            iterate_account: 迭代次数上限
+            refine_mode: 迭代模式，决定为当前答案预留的token数
+            spread: 是否把文档均匀分摊到iterate_account轮
+            
+        Returns:
+            Dict[str, Any]: 迭代计划，iterations为每轮的文档列表，iteration_tokens为每轮上下文的估算token数，
+                dropped_documents为超出迭代上限而未参与迭代的文档
+        """
+        iterate_account = max(1, iterate_account)
+        token_budget = self._iteration_token_budget(question, refine_mode)
+        units = self._budget_units(self._ordered_units(question, iterate_account, context), token_budget)
+        sizes = [sum(estimate_tokens(doc) + 1 for doc in unit) for unit in units]
+        groups = self._pack_units(sizes, token_budget)
+        if spread and len(groups) < iterate_account:
+            groups = self._spread_units(sizes, iterate_account, token_budget) or groups
+        
+        exceeds = len(groups) > iterate_account
+        dropped_groups = groups[iterate_account:]
+        groups = groups[:iterate_account]
+        dropped = [doc for group in dropped_groups for i in group for doc in units[i]]
+        if exceeds:
+            print(f"在每轮{token_budget} tokens的预算下需要{len(groups) + len(dropped_groups)}轮才能覆盖全部文档，"
+                  f"超过迭代上限{iterate_account}，丢弃相关度最低的{len(dropped)}个文档")
+        
+        iterations = [[doc for i in group for doc in units[i]] for group in groups]
+        return {
+            "iterations": iterations,
+            "iteration_tokens": [sum(sizes[i] for i in group) for group in groups],
+            "token_budget": token_budget,
+            "iterate_account": iterate_account,
+            "document_count": sum(len(iteration) for iteration in iterations),
+            "exceeds_iterate_account": exceeds,
+            "dropped_documents": dropped
+        }
+
+
+    @staticmethod
+    def _budget_units(units: list[list[str]], token_budget: int) -> list[list[str]]:
+        """超出单轮预算的聚类按文档拆分为多个单元(单个文档超出预算时独占一轮)"""
+        result = []
+        for unit in units:
+            if len(unit) > 1 and sum(estimate_tokens(doc) + 1 for doc in unit) > token_budget:
+                result.extend([doc] for doc in unit)
+            else:
+                result.append(unit)
+        return result
+
+
+    @staticmethod
+    def _pack_units(sizes: List[int], token_budget: int) -> List[List[int]]:
+        """按顺序贪心装填，返回每轮包含的单元下标；没有单元时返回一个空轮次"""
+        groups, current, current_tokens = [], [], 0
+        for i, size in enumerate(sizes):
+            if current and current_tokens + size > token_budget:
+                groups.append(current)
+                current, current_tokens = [], 0
+            current.append(i)
+            current_tokens += size
+        if current or not groups:
+            groups.append(current)
+        return groups
+
+
+    @staticmethod
+    def _spread_units(sizes: List[int], iteration_count: int, token_budget: int) -> Optional[List[List[int]]]:
+        """
+        按累计token数把单元顺序均匀分到最多iteration_count轮
+        
+        每个单元按其中点所在的累计位置归入对应轮次，轮次数不超过iteration_count；
+        分配后有轮次超出预算(大单元扎堆)时返回None，由调用方退回贪心装填。
+        """
+        total = sum(sizes)
+        if total == 0:
+            return None
+        groups = [[] for _ in range(iteration_count)]
+        cumulative = 0
+        for i, size in enumerate(sizes):
+            index = min(iteration_count - 1, int((cumulative + size / 2) * iteration_count / total))
+            groups[index].append(i)
+            cumulative += size
+        groups = [group for group in groups if group]
+        for group in groups:
+            if len(group) > 1 and sum(sizes[i] for i in group) > token_budget:
+                return None
+        return groups
+
+
+    def _iteration_token_budget(self, question: str, refine_mode: str) -> int:
+        """计算每轮迭代可用于上下文的token数"""
+        if self.iteration_token_budget is not None:
+            return self.iteration_token_budget
+        template = DELTA_REFINE_TEMPLATE if refine_mode == "delta" else REFINE_TEMPLATE
+        answer_reserve = DELTA_ANSWER_MAX_TOKENS if refine_mode == "delta" else REFINE_ANSWER_RESERVE_TOKENS
+        usable = int(get_context_window(self.model) * (1 - STUFF_HEADROOM_RATIO))
+        fixed = estimate_tokens(DEFAULT_SYSTEM_PROMPT + template + question)
+        return max(1, usable - fixed - answer_reserve)
+
+
+    def _ordered_units(self, question: str, iterate_account: int, context: list[str]) -> list[list[str]]:
+        """
+        得到按迭代顺序排列的装填单元
+        
+        设置了聚类分块器时每个聚类为一个单元；否则每个文档为一个单元。
+        设置了打分函数时先按相关度排序，最相关的内容最先参与迭代。
+        """
+        scores = None
+        if self.scorer is not None and context:
+            scores = dict(zip(context, self.scorer(question, context)))
+        
+        if self.chunker is not None:
+            clusters = self.chunker.split(context, iterate_account, question)
+            if scores is not None:
+                clusters.sort(key=lambda cluster: max(scores[doc] for doc in cluster), reverse=True)
+            return clusters
+        
+        if scores is not None:
+            context = sorted(context, key=lambda doc: scores[doc], reverse=True)
+        return [[doc] for doc in context]
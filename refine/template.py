@@ -29,4 +29,77 @@ REFINE_TEMPLATE="""
 更新后的完整答案：
 """
 
+DELTA_INITIAL_TEMPLATE="""
+你正在参与一个迭代检索问答过程。以下是第一轮检索到的上下文信息，请基于这些信息给出初步回答。
+注意：这可能不是全部信息，后续还会有更多相关内容来完善答案。
+---
+上下文信息:
+{context}
+---
+问题:
+{question}
+---
+请把回答拆成若干条要点，每条只包含一个信息点，表述简洁。只输出JSON，不要输出任何其他内容：
+{{"points": ["要点1", "要点2"]}}
+"""
+
+DELTA_REFINE_TEMPLATE="""
+这是一个迭代检索的过程，我们正在逐步完善答案。当前答案由以下带编号的要点组成。
+原始问题：{question}
+当前答案要点：
+{existing_points}
+---
+新检索到的上下文信息:
+{context}
+---
+
+请结合新的上下文信息，只输出需要对当前答案做的修改，不要重复未变化的要点：
+1. add：新信息补充的、当前答案中没有的要点
+2. update：需要修正的要点，给出编号和修正后的完整内容
+3. remove：与新信息冲突且应删除的要点编号
+4. 如果新信息不相关或重复，三项均为空列表
+
+只输出JSON，不要输出任何其他内容：
+{{"add": ["新要点"], "update": [{{"id": 1, "text": "修正后的要点"}}], "remove": [2]}}
+"""
+
+MERGE_TEMPLATE="""
+这是一个迭代检索的过程，多组上下文分别得到了部分答案，我们正在逐步合并这些答案。
+原始问题：{question}
+当前答案：{existing_answer}
+---
+基于其他上下文得到的部分答案:
+{partial_answers}
+---
+
+请结合其他部分答案，完善和更新当前答案：
+1. 如果部分答案之间存在冲突，请优先采用更准确、更具体的信息
+2. 如果其他部分答案补充了缺失的细节，请整合到答案中
+3. 如果其他部分答案不相关或重复，请保持原答案不变
+4. 请保持答案的逻辑性和完整性
+
+合并后的完整答案：
+"""
+
 DEFAULT_ITERATION_COUNT = 4
+
+# 提前终止相关配置
+REFINE_RELEVANCE_THRESHOLD = 0.15  # 上下文覆盖问题词项的最低比例，低于该值视为与问题无关
+REFINE_NOVELTY_THRESHOLD = 0.2  # 上下文中未出现在当前答案里的内容比例，低于该值视为已被答案覆盖
+REFINE_CONVERGENCE_THRESHOLD = 0.95  # 相邻两轮答案的相似度达到该值视为未变化
+REFINE_CONVERGENCE_PATIENCE = 2  # 连续多少轮答案未变化后提前结束迭代
+
+# 增量(delta)迭代相关配置
+DELTA_ANSWER_MAX_TOKENS = 1500  # 要点形式的答案的token上限，超出的新增要点被丢弃
+DELTA_MAX_OUTPUT_TOKENS = 600  # 增量迭代时单次调用的输出token上限
+DELTA_DEDUP_THRESHOLD = 0.9  # 新增要点与已有要点的相似度达到该值时视为重复
+
+# 迭代规划相关配置
+REFINE_ANSWER_RESERVE_TOKENS = 4000  # full模式下为当前答案(会随prompt重新发送)预留的token数
+
+# 树形(tree)迭代相关配置
+TREE_FAN_OUT = 2  # 每次合并调用合并的部分答案数
+TREE_DEPTH = 2  # 合并树的深度，并行迭代链数为 TREE_FAN_OUT ** TREE_DEPTH
+
+# 并行调用相关配置
+MAX_CONCURRENT_REQUESTS = 8  # 树形迭代、多问题批量处理时同时进行的LLM调用数上限
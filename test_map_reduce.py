@@ -4,6 +4,7 @@ Map-Reduce策略测试文件
 
 from config import LLM_API_KEY, LLM_API_URL
 from map_reduce.runner import LLMMapReduceRunner
+from map_reduce.source import iter_json_array
 import asyncio
 import json
 import time
@@ -27,9 +28,9 @@ async def test_map_reduce():
     print(f"\n❓ 问题: {question}")
     print("\n" + "=" * 60)
     
-    # 异步执行Map-Reduce策略
+    # 异步执行Map-Reduce策略(示例知识库足够小，关闭单次调用的快速路径以实际执行Map-Reduce)
     start_time = time.time()
-    result = await runner.run_async(question, knowledge, chunk_count=4)
+    result = await runner.run_async(question, knowledge, chunk_count=4, allow_fast_path=False)
     end_time = time.time()
     
     print("=" * 60)
@@ -57,16 +58,79 @@ async def test_map_reduce_stream():
     print("=" * 60)
     
     start_time = time.time()
-    result = await runner.run_async_stream(question, knowledge, chunk_count=4)
+    result = await runner.run_async_stream(question, knowledge, chunk_count=4, allow_fast_path=False)
     end_time = time.time()
     
     print("=" * 60)
     print(f"⏱️  总处理时间: {end_time - start_time:.2f}秒")
     print("=" * 60)
 
+async def test_map_reduce_many():
+    """测试Map-Reduce策略的多问题批量处理"""
+    
+    runner = LLMMapReduceRunner(llm_api_key=LLM_API_KEY, llm_api_url=LLM_API_URL)
+    
+    with open("ai_agent_knowledge.json", "r", encoding="utf-8") as f:
+        knowledge = json.load(f)
+    
+    questions = [
+        "什么是智能体,能用在哪些领域?",
+        "智能体的核心技术包括哪些?",
+        "多智能体系统有什么特点?"
+    ]
+    
+    print("\n" + "=" * 60)
+    print("Map-Reduce多问题批量测试")
+    print("=" * 60)
+    
+    start_time = time.time()
+    results = await runner.run_many(questions, knowledge, chunk_count=4)
+    end_time = time.time()
+    
+    for question, result in zip(questions, results):
+        print(f"❓ 问题: {question}")
+        print(f"📄 答案预览: {result[:100]}...")
+        print("-" * 40)
+    print("=" * 60)
+    print(f"⏱️  总处理时间: {end_time - start_time:.2f}秒")
+    print("=" * 60)
+
+async def test_map_reduce_iterable():
+    """测试Map-Reduce策略的流式语料输入"""
+    
+    runner = LLMMapReduceRunner(llm_api_key=LLM_API_KEY, llm_api_url=LLM_API_URL)
+    
+    question = "什么是智能体,能用在哪些领域?"
+    
+    print("\n" + "=" * 60)
+    print("Map-Reduce流式语料测试")
+    print("=" * 60)
+    print(f"❓ 问题: {question}")
+    print("=" * 60)
+    
+    # 惰性解析知识库文件，不一次性加载到内存
+    start_time = time.time()
+    result = await runner.run_iterable_async(question, iter_json_array("ai_agent_knowledge.json"),
+                                             chunk_token_budget=500)
+    end_time = time.time()
+    
+    print("=" * 60)
+    print("🎯 最终答案:")
+    print("=" * 60)
+    print(result)
+    print("=" * 60)
+    print(f"⏱️  总处理时间: {end_time - start_time:.2f}秒")
+    print("=" * 60)
+
 if __name__ == "__main__":
     # 运行基本测试
     asyncio.run(test_map_reduce())
     
     # 运行流式处理测试
-    asyncio.run(test_map_reduce_stream()) 
\ No newline at end of file
+    asyncio.run(test_map_reduce_stream()) 
+    
+    # 运行多问题批量测试
+    # asyncio.run(test_map_reduce_many())
+    
+    # 运行流式语料测试
+    # asyncio.run(test_map_reduce_iterable())
@@ -4,6 +4,7 @@ Query Decomposition策略测试文件
 
 from config import LLM_API_KEY, LLM_API_URL
 from query_decomposition.runner import QueryDecompositionRunner
+from query_decomposition.cache import DecompositionCache
 import asyncio
 import json
 import time
@@ -55,6 +56,8 @@ async def test_complex_question():
     
     runner = QueryDecompositionRunner(llm_api_key=LLM_API_KEY, llm_api_url=LLM_API_URL)
     
+    with open("ai_agent_knowledge.json", "r", encoding="utf-8") as f:
+        knowledge = json.load(f)
     
     question = "智能体的BDI架构是什么,强化学习在智能体中如何应用？多智能体系统有什么特点和优势？"
     
@@ -173,7 +176,71 @@ async def test_sync_vs_async():
     print("=" * 60)
 
 
+def test_semantic_cache_pairs():
+    """测试语义缓存：含义不同的问题不能互相命中，同义问法可以复用分解计划和子答案(不调用LLM)"""
+    
+    plan = [{"sub_question": "示例子问题"}]
+    context_fingerprint = "same-context"
+    
+    print("\n" + "=" * 60)
+    print("语义缓存命中测试")
+    print("=" * 60)
+    
+    cases = [
+        ("在企业级应用场景中，大模型驱动的智能体的优点有哪些？", "在企业级应用场景中，大模型驱动的智能体的缺点有哪些？", False),
+        ("在企业级应用场景中，大模型驱动的智能体与传统自动化流程的区别？",
+         "在企业级应用场景中，大模型驱动的智能体与传统自动化流程的联系？", False),
+        ("A公司收购了B公司吗", "B公司收购了A公司吗", False),
+        ("强化学习是否优于监督学习", "监督学习是否优于强化学习", False),
+        ("智能体是什么？", "什么是智能体？", True),
+        ("智能体的核心技术包括哪些?", "请问智能体的核心技术有哪些呢？", True),
+        ("智能体有哪些应用领域？", "智能体的应用领域有哪些？", True),
+    ]
+    for cached_question, question, expected in cases:
+        cache = DecompositionCache()
+        cache.put_plan(cached_question, plan)
+        cache.put_answer(cached_question, context_fingerprint, "缓存的答案")
+        plan_hit = cache.get_plan(question) is not None
+        answer_hit = cache.get_answer(question, context_fingerprint) is not None
+        print(f"❓ {cached_question} → {question}: 计划命中={plan_hit}, 子答案命中={answer_hit}")
+        assert plan_hit == expected and answer_hit == expected, f"缓存命中结果不符合预期: {cached_question} / {question}"
+    print("=" * 60)
+
+
+def test_merge_sub_queries():
+    """测试子问题合并：同义问法合并，主客体互换或只差一个实词的子问题不合并(不调用LLM)"""
+    
+    runner = QueryDecompositionRunner(llm_api_key=LLM_API_KEY, llm_api_url=LLM_API_URL)
+    runner.last_run_stats = {"merged_sub_queries": 0}
+    
+    print("\n" + "=" * 60)
+    print("子问题合并测试")
+    print("=" * 60)
+    
+    cases = [
+        ("强化学习是否优于监督学习？", "监督学习是否优于强化学习？", False),
+        ("A公司收购了B公司吗", "B公司收购了A公司吗", False),
+        ("智能体的优点有哪些？", "智能体的缺点有哪些？", False),
+        ("智能体和大模型的区别？", "智能体和大模型的联系？", False),
+        ("智能体是什么？", "什么是智能体？", True),
+        ("智能体的核心技术有哪些？", "智能体的核心技术包括哪些？", True),
+        ("BDI架构是什么？", "BDI架构的定义是什么？", True),
+    ]
+    for first, second, expected in cases:
+        merged_into = runner._merge_sub_queries([{"question": first}, {"question": second}])
+        merged = merged_into[1] == 0
+        print(f"❓ {first} / {second}: 合并={merged}")
+        assert merged == expected, f"子问题合并结果不符合预期: {first} / {second}"
+    print("=" * 60)
+
+
 if __name__ == "__main__":
+    # 运行语义缓存测试(不调用LLM)
+    # test_semantic_cache_pairs()
+    
+    # 运行子问题合并测试(不调用LLM)
+    # test_merge_sub_queries()
+    
     # 运行基本测试
     # asyncio.run(test_query_decomposition())
     
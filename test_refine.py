@@ -29,9 +29,9 @@ async def test_refine():
     print(f"🔄 迭代次数: {iterate_account}")
     print("\n" + "=" * 60)
     
-    # 异步执行Refine策略
+    # 异步执行Refine策略(示例知识库足够小，关闭单次调用的快速路径以实际执行迭代)
     start_time = time.time()
-    result = await runner.run_async(question, iterate_account, knowledge)
+    result = await runner.run_async(question, iterate_account, knowledge, allow_fast_path=False)
     end_time = time.time()
     
     print("=" * 60)
@@ -62,7 +62,7 @@ async def test_refine_different_iterations():
     print("-" * 40)
     
     start_time = time.time()
-    result = await runner.run_async(question, DEFAULT_ITERATION_COUNT, knowledge)
+    result = await runner.run_async(question, DEFAULT_ITERATION_COUNT, knowledge, allow_fast_path=False)
     end_time = time.time()
     
     print(f"📝 结果长度: {len(result)} 字符")
@@ -71,9 +71,45 @@ async def test_refine_different_iterations():
     print("-" * 40)
     print("=" * 60)
 
+async def test_refine_tree():
+    """测试树形迭代：多条迭代链并行，部分答案逐层合并"""
+    
+    runner = LLMRefineRunner(llm_api_key=LLM_API_KEY, llm_api_url=LLM_API_URL)
+    
+    with open("ai_agent_knowledge.json", "r", encoding="utf-8") as f:
+        knowledge = json.load(f)
+    
+    question = "智能体的核心技术包括哪些?"
+    
+    print("\n" + "=" * 60)
+    print("Refine策略树形迭代测试")
+    print("=" * 60)
+    print(f"❓ 问题: {question}")
+    print("=" * 60)
+    
+    # 迭代轮数取fan_out ** depth，保证每条链都分到上下文，合并树达到完整深度
+    fan_out, depth = 2, 2
+    iterate_account = max(DEFAULT_ITERATION_COUNT, fan_out ** depth)
+    
+    start_time = time.time()
+    result = await runner.run_tree_async(question, iterate_account, knowledge, fan_out=fan_out, depth=depth,
+                                         allow_fast_path=False)
+    end_time = time.time()
+    
+    stats = runner.last_run_stats
+    print(f"🌲 迭代链数: {stats['chains']}, 合并层数: {stats['merge_levels']}, "
+          f"合并调用: {stats['merge_calls']}, 串行调用: {stats['serial_calls']}")
+    assert stats["merge_levels"] >= 2, "树形迭代应至少有两层合并"
+    print(f"⏱️  处理时间: {end_time - start_time:.2f}秒")
+    print(f"📄 答案预览: {result[:100]}...")
+    print("=" * 60)
+
 if __name__ == "__main__":
     # 运行基本测试
     # asyncio.run(test_refine())
     
     # 运行不同迭代次数测试
     asyncio.run(test_refine_different_iterations())
+    
+    # 运行树形迭代测试
+    # asyncio.run(test_refine_tree())